@@ -11,70 +11,293 @@ PIPELINE = 'pipe_vms_brazil_api'
 class PipeVMSBrazilDagFactory(DagFactory):
     """Concrete class to handle the DAG for pipe_vms_brazil_api."""
 
-    def __init__(self, pipeline=PIPELINE, **kwargs):
+    def __init__(self, pipeline=PIPELINE, incremental=False, batch_days=None, **kwargs):
         """
         Constructs the DAG.
 
         :@param pipeline: The pipeline name. Default value the PIPELINE.
         :@type pipeline: str.
+        :@param incremental: If the DAG polls the API since the watermark
+        instead of fetching a whole day. Default value False.
+        :@type incremental: bool.
+        :@param batch_days: The days of each batch of the backfill DAG, that
+        prepares and loads them in a single task each. Default value None,
+        the daily DAG.
+        :@type batch_days: int.
         :@param kwargs: A dict of optional parameters.
         :@param kwargs: dict.
         """
         super(PipeVMSBrazilDagFactory, self).__init__(pipeline=pipeline, **kwargs)
+        self.incremental = incremental
+        self.batch_days = batch_days
 
     def source_date(self):
         """
-        Validates that the schedule interval only be in daily mode.
+        Validates that the schedule interval only be in daily mode, the
+        incremental polls and the backfill batches can run at any interval.
 
         :raise: A ValueError.
         """
-        if self.schedule_interval != '@daily':
+        if not self.incremental and not self.batch_days and self.schedule_interval != '@daily':
             raise ValueError('Unsupported schedule interval {}'.format(self.schedule_interval))
 
-    def build(self, dag_id):
+    def metrics_arguments(self, step, run='{ds}'):
         """
-        Override of build method.
+        The arguments saving the metrics of a step in GCS, when the
+        brazil_vms_metrics_gcs_path is configured, with the brazil_profile.
+
+        :@param step: The name of the step.
+        :@type step: str.
+        :@param run: The name of the metrics file of the run, formatted with
+        the config. Default value the ds.
+        :@type run: str.
+        :@return: The arguments.
+        :@rtype: list.
+        """
+        config = self.config
+        arguments = []
+        if config.get('brazil_vms_metrics_gcs_path'):
+            metrics_path = config['brazil_vms_metrics_gcs_path'].rstrip('/')
+            arguments.append('-mt {}/{}/{}.json'.format(metrics_path, step, run.format(**config)))
+            if config.get('brazil_profile'):
+                arguments.append('-pf {}'.format(config['brazil_profile']))
+        return arguments
+
+    def prepares_arguments(self):
+        """
+        The arguments of the prepare shared by the daily and the batched
+        DAGs, without the dates.
+
+        :@return: The arguments.
+        :@rtype: list.
+        """
+        config = self.config
+        return (['-i {brazil_vms_gcs_path}/'.format(**config),
+                 '-o {brazil_vms_merged_gcs_path}/'.format(**config),
+                 '-cl {}'.format(config.get('brazil_compresslevel', 9)),
+                 '-w {}'.format(config.get('brazil_compress_workers', 1)),
+                 '-of {}'.format(config.get('brazil_output_format', 'ndjson')),
+                 '-jb {}'.format(config.get('brazil_json_backend', 'json'))]
+                + (['-dr {brazil_vms_device_registry}'.format(**config)]
+                   if config.get('brazil_vms_device_registry') else [])
+                + (['-f'] if config.get('is_force_enabled', False) else [])
+                + ([] if config.get('is_dedup_enabled', True) else ['-nd'])
+                + (['-en', '-msk {}'.format(config.get('brazil_max_speed_kmh', 100))]
+                   if config.get('is_enrich_enabled', False) else []))
+
+    def build_incremental(self, dag_id):
+        """
+        Builds the DAG polling the API since the watermark, saving the new
+        messages as deltas compacted by the daily prepare.
 
         :@param dag_id: The id of the DAG.
         :@type table: str.
         """
         config = self.config
-        brazil_vms_gcs_path=config['brazil_vms_gcs_path']
-        config['brazil_vms_gcs_path']=brazil_vms_gcs_path[:-1] if brazil_vms_gcs_path.endswith('/') else brazil_vms_gcs_path
 
-        with DAG(dag_id, schedule_interval=self.schedule_interval, default_args=self.default_args) as dag:
+        # The polls share the watermark, they can not overlap.
+        with DAG(dag_id, schedule_interval=self.schedule_interval, default_args=self.default_args,
+                 catchup=False, max_active_runs=1) as dag:
+
+            fetch = self.build_docker_task({
+                'task_id':'pipe_brazil_fetch_incremental',
+                'pool':BRAZIL_VMS_SCRAPPER_POOL,
+                'docker_run':'{docker_run}'.format(**config),
+                'image':'{docker_image}'.format(**config),
+                'name':'pipe-brazil-fetch-incremental',
+                'dag':dag,
+                'retries':2,
+                'arguments':['fetch_brazil_vms_data',
+                             '--incremental',
+                             '-o {brazil_vms_gcs_path}/'.format(**config),
+                             '-rtr {}'.format(config.get('brazil_api_max_retries', 3)),
+                             '-ov {}'.format(config.get('brazil_incremental_overlap_minutes', 10))]
+                            + (['-st'] if config.get('is_fetch_stream_enabled', False) else [])
+                            + (['-dr {brazil_vms_device_registry}'.format(**config),
+                                '-drd {}'.format(config.get('brazil_devices_refresh_days', 0))]
+                               if config.get('brazil_vms_device_registry') else [])
+                            + (['-rps {}'.format(config['brazil_api_max_requests_per_second'])]
+                               if config.get('brazil_api_max_requests_per_second') else [])
+                            + self.metrics_arguments('fetch_incremental', '{{{{ ts_nodash }}}}')
+            })
+
+            dag >> fetch
+
+        return dag
+
+    def build_batched(self, dag_id):
+        """
+        Builds the DAG backfilling batches of batch_days days, each batch
+        prepared and loaded by a single task, so the start of the pods is
+        paid once per batch instead of once per day.
+
+        :@param dag_id: The id of the DAG.
+        :@type table: str.
+        """
+        config = self.config
+        date_end = '{{{{ macros.ds_add(ds, {}) }}}}'.format(self.batch_days - 1)
+        parallel_days = config.get('brazil_batch_parallel_days', 2)
+
+        with DAG(dag_id, schedule_interval=self.schedule_interval, default_args=self.default_args,
+                 max_active_runs=config.get('brazil_batch_max_active_runs', 1)) as dag:
 
             prepares_data = self.build_docker_task({
-                'task_id':'pipe_brazil_prepares',
+                'task_id':'pipe_brazil_prepares_batch',
                 'pool':'k8operators_limit',
                 'docker_run':'{docker_run}'.format(**config),
                 'image':'{docker_image}'.format(**config),
-                'name':'pipe-brazil-prepares',
+                'name':'pipe-brazil-prepares-batch',
                 'dag':dag,
-                'retries':5,
+                'retries':2,
                 'max_retry_delay': timedelta(hours=5),
                 'arguments':['prepares_brazil_vms_data',
                              '-d {ds}'.format(**config),
-                             '-i {brazil_vms_gcs_path}/'.format(**config),
-                             '-o {brazil_vms_merged_gcs_path}/'.format(**config)]
+                             '-de {}'.format(date_end),
+                             '-P {}'.format(parallel_days)]
+                             + self.prepares_arguments()
+                             + self.metrics_arguments('prepares_data_batch')
             })
 
             load = self.build_docker_task({
-                'task_id':'pipe_brazil_load',
+                'task_id':'pipe_brazil_load_batch',
                 'pool':'k8operators_limit',
                 'docker_run':'{docker_run}'.format(**config),
                 'image':'{docker_image}'.format(**config),
-                'name':'pipe-brazil-load',
+                'name':'pipe-brazil-load-batch',
+                'dag':dag,
+                'retries':2,
+                'max_retry_delay': timedelta(hours=5),
+                'arguments':['load_days_brazil_vms_data',
+                             '-d {ds}'.format(**config),
+                             '-de {}'.format(date_end),
+                             '-P {}'.format(parallel_days),
+                             '-i {brazil_vms_merged_gcs_path}'.format(**config),
+                             '-t {project_id}:{brazil_vms_bq_dataset_table}'.format(**config),
+                             '-of {}'.format(config.get('brazil_output_format', 'ndjson'))]
+                             + (['-f'] if config.get('is_force_enabled', False) else [])
+                             + self.metrics_arguments('load_batch')
+            })
+
+            dag >> prepares_data >> load
+
+        return dag
+
+    def build(self, dag_id):
+        """
+        Override of build method.
+
+        :@param dag_id: The id of the DAG.
+        :@type table: str.
+        """
+        config = self.config
+        brazil_vms_gcs_path=config['brazil_vms_gcs_path']
+        config['brazil_vms_gcs_path']=brazil_vms_gcs_path[:-1] if brazil_vms_gcs_path.endswith('/') else brazil_vms_gcs_path
+        if self.incremental:
+            return self.build_incremental(dag_id)
+        if self.batch_days:
+            return self.build_batched(dag_id)
+        # The incremental days are compacted with the late deltas of the previous days, that are only
+        # prepared and loaded again when a poll added deltas since their last run.
+        incremental = config.get('is_incremental_enabled', False) and not config.get('is_fused_enabled', False)
+        late_days = int(config.get('brazil_incremental_late_days', 1)) if incremental else 0
+        date_start = '{{{{ macros.ds_add(ds, -{}) }}}}'.format(late_days) if late_days else '{ds}'.format(**config)
+
+        with DAG(dag_id, schedule_interval=self.schedule_interval, default_args=self.default_args) as dag:
+
+            prepares_data = self.build_docker_task({
+                'task_id':'pipe_brazil_prepares',
+                'pool':'k8operators_limit',
+                'docker_run':'{docker_run}'.format(**config),
+                'image':'{docker_image}'.format(**config),
+                'name':'pipe-brazil-prepares',
                 'dag':dag,
                 'retries':5,
                 'max_retry_delay': timedelta(hours=5),
-                'arguments':['load_brazil_vms_data',
-                             '{ds}'.format(**config),
-                             '{brazil_vms_merged_gcs_path}'.format(**config),
-                             '{project_id}:{brazil_vms_bq_dataset_table}'.format(**config)]
+                'arguments':['prepares_brazil_vms_data',
+                             '-d {}'.format(date_start)]
+                             + self.prepares_arguments()
+                             + self.metrics_arguments('prepares_data')
+                             + (['-de {ds}'.format(**config), '-cd'] if incremental else [])
             })
 
-            if (config.get('is_fetch_enabled', False)):
+            if incremental:
+                load = self.build_docker_task({
+                    'task_id':'pipe_brazil_load',
+                    'pool':'k8operators_limit',
+                    'docker_run':'{docker_run}'.format(**config),
+                    'image':'{docker_image}'.format(**config),
+                    'name':'pipe-brazil-load',
+                    'dag':dag,
+                    'retries':5,
+                    'max_retry_delay': timedelta(hours=5),
+                    'arguments':['load_days_brazil_vms_data',
+                                 '-d {}'.format(date_start),
+                                 '-de {ds}'.format(**config),
+                                 '-i {brazil_vms_merged_gcs_path}'.format(**config),
+                                 '-t {project_id}:{brazil_vms_bq_dataset_table}'.format(**config),
+                                 '-of {}'.format(config.get('brazil_output_format', 'ndjson'))]
+                                 + (['-f'] if config.get('is_force_enabled', False) else [])
+                                 + self.metrics_arguments('load')
+                })
+            else:
+                load = self.build_docker_task({
+                    'task_id':'pipe_brazil_load',
+                    'pool':'k8operators_limit',
+                    'docker_run':'{docker_run}'.format(**config),
+                    'image':'{docker_image}'.format(**config),
+                    'name':'pipe-brazil-load',
+                    'dag':dag,
+                    'retries':5,
+                    'max_retry_delay': timedelta(hours=5),
+                    'arguments':['load_brazil_vms_data',
+                                 '{ds}'.format(**config),
+                                 '{brazil_vms_merged_gcs_path}'.format(**config),
+                                 '{project_id}:{brazil_vms_bq_dataset_table}'.format(**config),
+                                 config.get('brazil_output_format', 'ndjson')]
+                                 + (['force'] if config.get('is_force_enabled', False) else [])
+                })
+
+            if (config.get('is_fused_enabled', False)):
+                fetch_prepares = self.build_docker_task({
+                    'task_id':'pipe_brazil_fetch_prepares',
+                    'pool':BRAZIL_VMS_SCRAPPER_POOL,
+                    'docker_run':'{docker_run}'.format(**config),
+                    'image':'{docker_image}'.format(**config),
+                    'name':'pipe-brazil-fetch-prepares',
+                    'dag':dag,
+                    'retries':5,
+                    'max_retry_delay': timedelta(hours=5),
+                    'arguments':['fetch_prepares_brazil_vms_data',
+                                 '-d {ds}'.format(**config),
+                                 '-o {brazil_vms_merged_gcs_path}/'.format(**config),
+                                 '-rtr {}'.format(config.get('brazil_api_max_retries', 3)),
+                                 '-cl {}'.format(config.get('brazil_compresslevel', 9)),
+                                 '-w {}'.format(config.get('brazil_compress_workers', 1)),
+                                 '-of {}'.format(config.get('brazil_output_format', 'ndjson')),
+                                 '-jb {}'.format(config.get('brazil_json_backend', 'json'))]
+                                + (['-a {brazil_vms_gcs_path}/'.format(**config)]
+                                   if config.get('is_raw_archive_enabled', True) else [])
+                                + (['-dr {brazil_vms_device_registry}'.format(**config),
+                                    '-drd {}'.format(config.get('brazil_devices_refresh_days', 0))]
+                                   if config.get('brazil_vms_device_registry') else [])
+                                + ([] if config.get('is_dedup_enabled', True) else ['-nd'])
+                                + (['-en', '-msk {}'.format(config.get('brazil_max_speed_kmh', 100))]
+                                   if config.get('is_enrich_enabled', False) else [])
+                                + self.metrics_arguments('fetch_prepare')
+                })
+
+                dag >> fetch_prepares >> load
+            elif (incremental):
+                # The messages come as deltas from the incremental DAG, the devices from its first poll of the day,
+                # or from the registry, then the polls do not upload the devices file.
+                if config.get('brazil_vms_device_registry'):
+                    dag >> prepares_data
+                else:
+                    for devices_existence in self.source_gcs_sensors(dag, date='devices/{ds}.json.gz'.format(**config)):
+                        dag >> devices_existence >> prepares_data
+
+                prepares_data >> load
+            elif (config.get('is_fetch_enabled', False)):
                 fetch = self.build_docker_task({
                     'task_id':'pipe_brazil_fetch',
                     'pool':BRAZIL_VMS_SCRAPPER_POOL,
@@ -87,7 +310,16 @@ class PipeVMSBrazilDagFactory(DagFactory):
                     'arguments':['fetch_brazil_vms_data',
                                  '-d {ds}'.format(**config),
                                  '-o {brazil_vms_gcs_path}/'.format(**config),
-                                 '-rtr {}'.format(config.get('brazil_api_max_retries', 3))]
+                                 '-rtr {}'.format(config.get('brazil_api_max_retries', 3)),
+                                 '-win {}'.format(config.get('brazil_api_windows', 1)),
+                                 '-c {}'.format(config.get('brazil_api_concurrency', 1))]
+                                + (['-st'] if config.get('is_fetch_stream_enabled', False) else [])
+                                + (['-dr {brazil_vms_device_registry}'.format(**config),
+                                    '-drd {}'.format(config.get('brazil_devices_refresh_days', 0))]
+                                   if config.get('brazil_vms_device_registry') else [])
+                                + (['-rps {}'.format(config['brazil_api_max_requests_per_second'])]
+                                   if config.get('brazil_api_max_requests_per_second') else [])
+                                + self.metrics_arguments('fetch')
                 })
 
                 dag >> fetch >> prepares_data >> load
@@ -102,4 +334,16 @@ class PipeVMSBrazilDagFactory(DagFactory):
 
         return dag
 
-pipe_vms_brazil_api_dag = PipeVMSBrazilDagFactory().build(PIPELINE)
+daily_factory = PipeVMSBrazilDagFactory()
+pipe_vms_brazil_api_dag = daily_factory.build(PIPELINE)
+
+if daily_factory.config.get('is_incremental_enabled', False):
+    pipe_vms_brazil_api_incremental_dag = PipeVMSBrazilDagFactory(
+        schedule_interval=daily_factory.config.get('brazil_incremental_schedule_interval', '*/15 * * * *'),
+        incremental=True).build('{}_incremental'.format(PIPELINE))
+
+if daily_factory.config.get('brazil_backfill_batch_days'):
+    batch_days = int(daily_factory.config['brazil_backfill_batch_days'])
+    pipe_vms_brazil_api_backfill_dag = PipeVMSBrazilDagFactory(
+        schedule_interval=timedelta(days=batch_days),
+        batch_days=batch_days).build('{}_backfill'.format(PIPELINE))
@@ -0,0 +1,27 @@
+"""
+The files shipped as package data: the BigQuery schema of the merged
+messages and the script loading a day to BigQuery. They are found through
+importlib.resources, so they are there also when the package is installed
+from a wheel, not only from the source tree.
+"""
+
+import importlib.resources
+
+
+SCHEMA = 'brazil_schema.json'
+LOAD_SCRIPT = 'gcs2bq.sh'
+
+
+def asset_path(name):
+    """
+    The path of an asset.
+    :param name: The name of the file, ex. SCHEMA.
+    :type name: str
+    :return: A context manager giving the path, a temporary copy while it is
+    open when the package is zipped.
+    :rtype: contextmanager
+    """
+    if hasattr(importlib.resources, 'files'):
+        return importlib.resources.as_file(importlib.resources.files(__name__) / name)
+    # Python 3.7 and 3.8.
+    return importlib.resources.path(__name__, name)
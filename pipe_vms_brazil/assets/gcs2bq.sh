@@ -0,0 +1,152 @@
+#!/bin/bash
+THIS_SCRIPT_DIR="$( cd "$(dirname "${BASH_SOURCE[0]}")" ; pwd -P )"
+PROCESS=$(basename $0 .sh)
+ARGS=( QUERIED_DATE \
+  GCS_PATH \
+  BQ_PATH )
+
+echo -e "\nRunning:\n${PROCESS}.sh $@ \n"
+
+OPTIONAL_ARGS=( OUTPUT_FORMAT FORCE )
+
+display_usage() {
+  echo -e "\nUsage:\n${PROCESS}.sh ${ARGS[*]} [${OPTIONAL_ARGS[*]}] \n"
+  echo -e "QUERIED_DATE: The start date of messages you want to download (ex. YYYY-MMM-DD))."
+  echo -e "GCS_PATH: The path to the Google Cloud Storage where the downloaded file is stored, (ex: gs://bucket/brazil/download)."
+  echo -e "BQ_PATH: The path to Bigquery where to store the content of the GCS path (ex. project.dataset.table)."
+  echo -e "OUTPUT_FORMAT: Optional, the format of the prepared file, ndjson, parquet or avro. Detected from GCS when missing."
+  echo -e "FORCE: Optional, force to load the partition even when the prepared file did not change since the last load."
+}
+
+if [[ $# -lt ${#ARGS[@]} || $# -gt $(( ${#ARGS[@]} + ${#OPTIONAL_ARGS[@]} )) ]]
+then
+    display_usage
+    exit 1
+fi
+
+ARG_VALUES=("$@")
+PARAMS=()
+for index in ${!ARGS[*]}; do
+  echo "${ARGS[$index]}=${ARG_VALUES[$index]}"
+  declare "${ARGS[$index]}"="${ARG_VALUES[$index]}"
+done
+OUTPUT_FORMAT="${ARG_VALUES[${#ARGS[@]}]}"
+FORCE="${ARG_VALUES[$(( ${#ARGS[@]} + 1 ))]}"
+
+#################################################################
+# Detects the format of the prepared file
+#################################################################
+declare -A EXTENSIONS=( [ndjson]=".json.gz" [parquet]=".parquet" [avro]=".avro" )
+if [ -z "${OUTPUT_FORMAT}" ]; then
+  for CANDIDATE in ndjson parquet avro; do
+    if gsutil -q stat "${GCS_PATH}/${QUERIED_DATE}${EXTENSIONS[${CANDIDATE}]}"; then
+      OUTPUT_FORMAT=${CANDIDATE}
+      break
+    fi
+  done
+fi
+# The same schema for every format, so the types of the table do not drift.
+SCHEMA=${THIS_SCRIPT_DIR}/brazil_schema.json
+case ${OUTPUT_FORMAT} in
+  ndjson)
+    SOURCE_FORMAT_ARGS=( --source_format=NEWLINE_DELIMITED_JSON )
+    ;;
+  parquet)
+    SOURCE_FORMAT_ARGS=( --source_format=PARQUET )
+    ;;
+  avro)
+    SOURCE_FORMAT_ARGS=( --source_format=AVRO --use_avro_logical_types )
+    ;;
+  *)
+    echo "ERROR no prepared file found for <${GCS_PATH}/${QUERIED_DATE}> with format <${OUTPUT_FORMAT}>."
+    exit 1
+    ;;
+esac
+echo "OUTPUT_FORMAT=${OUTPUT_FORMAT}"
+
+#################################################################
+# Set envs and buid the GCS_SOURCE
+#################################################################
+TABLE_DESTINATION="${BQ_PATH}\$${QUERIED_DATE//-/}"
+GCS_SOURCE="${GCS_PATH}/${QUERIED_DATE}${EXTENSIONS[${OUTPUT_FORMAT}]}"
+PARTITION_BY_ID="datahora"
+CLUSTER_BY="ID,mID,codMarinha,nome"
+
+#################################################################
+# Skips the load when the prepared file did not change
+#################################################################
+MANIFEST="${GCS_PATH}/_manifests/load/${QUERIED_DATE}.json"
+SOURCE_HASH=$(gsutil stat "${GCS_SOURCE}" | awk '/Hash \((md5|crc32c)\)/ {print $NF}' | paste -sd ' ' -)
+if [ -z "${SOURCE_HASH}" ]; then
+  echo "ERROR can not get the hash of <${GCS_SOURCE}>."
+  exit 1
+fi
+MANIFEST_CONTENT="{\"stage\": \"load\", \"day\": \"${QUERIED_DATE}\", \"source\": \"${GCS_SOURCE}\", \"source_hash\": \"${SOURCE_HASH}\", \"table\": \"${TABLE_DESTINATION}\"}"
+# The partition itself must still be there with rows, it can be deleted after the load.
+if [ "${FORCE}" != "force" ] \
+   && [ "$(gsutil -q cat "${MANIFEST}" 2>/dev/null)" == "${MANIFEST_CONTENT}" ] \
+   && bq show --format=json "${TABLE_DESTINATION}" 2>/dev/null | grep -q '"numRows": *"[1-9]'; then
+  echo "The prepared file <${GCS_SOURCE}> did not change since the last load, see <${MANIFEST}>. Pass force to load it again."
+  exit 0
+fi
+
+#################################################################
+# Cleaned the table in case it exists. (--replace)
+#################################################################
+echo "Clean the partition of the table <${TABLE_DESTINATION}> in case it already exists."
+bq rm -f -t "${TABLE_DESTINATION}"
+if [ "$?" -ne 0 ]; then
+  echo "  ERROR Partition of table <${TABLE_DESTINATION}> can not be removed."
+  exit 1
+fi
+echo "Successfully removed the partition of the table <${TABLE_DESTINATION}>."
+
+#################################################################
+# Load the prepared file from GCS to BQ
+#################################################################
+echo "Load ${OUTPUT_FORMAT} <${GCS_SOURCE}> to bigquery PARTITIONED [clustered by ${CLUSTER_BY}] <${TABLE_DESTINATION}>"
+bq load \
+  "${SOURCE_FORMAT_ARGS[@]}" \
+  --time_partitioning_type=DAY \
+  --time_partitioning_field="${PARTITION_BY_ID}" \
+  --clustering_fields "${CLUSTER_BY}" \
+  --schema_update_option=ALLOW_FIELD_ADDITION \
+  ${TABLE_DESTINATION} \
+  ${GCS_SOURCE} \
+  ${SCHEMA}
+RESULT=$?
+if [ "${RESULT}" -ne 0 ]
+then
+  echo "ERROR uploading ${OUTPUT_FORMAT} from GCS <${GCS_SOURCE}> to BQ ${TABLE_DESTINATION}."
+  exit ${RESULT}
+else
+  echo "Success: The upload from <${GCS_SOURCE}> -> PARTITIONED [clustered by ${CLUSTER_BY}] <${TABLE_DESTINATION}> was completed."
+fi
+
+
+################################################################################
+# Updates the table description
+################################################################################
+TABLE_DESC=(
+  "* Brazil API Messages"
+  "*"
+  "* Source: ${GCS_SOURCE} "
+  "* Date Processed: ${QUERIED_DATE}"
+  "* Partitioned by ${PARTITION_BY_ID}."
+  "* Clusterd by ${CLUSTER_BY}."
+)
+TABLE_DESC=$( IFS=$'\n'; echo "${TABLE_DESC[*]}" )
+bq update --description "${TABLE_DESC}" ${BQ_PATH}
+if [ "$?" -ne 0 ]; then
+  echo "  Unable to update table description ${BQ_PATH}."
+  exit 1
+fi
+echo "Successfully updated the table description for ${BQ_PATH}."
+
+################################################################################
+# Records the load in the manifest
+################################################################################
+echo "${MANIFEST_CONTENT}" | gsutil -q cp - "${MANIFEST}"
+if [ "$?" -ne 0 ]; then
+  echo "  Unable to save the manifest <${MANIFEST}>, the next load will not be skipped."
+fi
@@ -0,0 +1,315 @@
+"""
+Backfills the historical data of a date range.
+
+The range is sharded in ranges of days of the same year split in parallel,
+one process per shard, and the day files are uploaded as soon as their shard
+is split. Each uploaded day is
+recorded in a manifest, so an interrupted backfill run again with the same
+manifest only splits and uploads the days still missing.
+
+Years Files should be in json format, as for historical_data.
+
+Ex.
+python -m pipe_vms_brazil.backfill -s 2012-01-01 -e 2022-12-31 -i ./downloads/output -o gs://vms-gfw/brazil/historical/v20210321/ -P 4 -m 4096 -ds 92
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from datetime import date, timedelta
+
+from multiprocessing import Pool
+
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.historical_data import MEMORY_BUDGET_MB, PROJECT_ID, split_year, upload_day
+
+from pipe_vms_brazil.ndjson import BACKENDS
+
+from pipe_vms_brazil.partition_writer import PARTITIONS
+
+import argparse, json, os, resource, sys, threading, time
+
+
+# FORMATS
+FORMAT_DT = '%Y-%m-%d'
+
+
+class BackfillManifest(object):
+    """The days already uploaded, appended as a JSON line per day."""
+
+    def __init__(self, path):
+        """
+        Constructs the manifest, loading the days already recorded.
+
+        :param path: The local path of the manifest.
+        :type path: str
+        """
+        self.path = path
+        self.days = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            complete = 0
+            with open(path, 'rb') as manifest:
+                for line in manifest:
+                    if not line.endswith(b'\n'):
+                        break
+                    complete += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.days[entry['day']] = entry
+            # A line cut by an interruption is dropped, its day is redone and
+            # the next record starts in a line of its own.
+            os.truncate(path, complete)
+
+    def done(self, day):
+        """
+        If a day was already uploaded.
+        :param day: The day, YYYY-mm-dd.
+        :type day: str
+        :return: True if it is in the manifest.
+        :rtype: bool
+        """
+        return day in self.days
+
+    def record(self, day, messages, files):
+        """
+        Records a day as uploaded, synced to disk before returning.
+        :param day: The day, YYYY-mm-dd.
+        :type day: str
+        :param messages: The amount of messages of the day.
+        :type messages: int
+        :param files: The amount of files uploaded for the day.
+        :type files: int
+        """
+        entry = dict(day=day, messages=messages, files=files)
+        with self._lock:
+            with open(self.path, 'a') as manifest:
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+                os.fsync(manifest.fileno())
+            self.days[day] = entry
+
+
+def year_ranges(date_start, date_end):
+    """
+    Shards a date range by year.
+    :param date_start: The first day, inclusive.
+    :type date_start: date
+    :param date_end: The last day, inclusive.
+    :type date_end: date
+    :return: The year with its first and last day in the range.
+    :rtype: list of tuple
+    """
+    return [(year, max(date_start, date(year,1,1)), min(date_end, date(year,12,31)))
+            for year in range(date_start.year, date_end.year + 1)]
+
+def day_ranges(date_start, date_end, days_per_shard):
+    """
+    Shards a date range by ranges of days of the same year, as each year is
+    read from its own file.
+    :param date_start: The first day, inclusive.
+    :type date_start: date
+    :param date_end: The last day, inclusive.
+    :type date_end: date
+    :param days_per_shard: The maximum days of each shard.
+    :type days_per_shard: int
+    :return: The year with the first and last day of each shard.
+    :rtype: list of tuple
+    """
+    shards = []
+    for year, first_day, last_day in year_ranges(date_start, date_end):
+        while first_day <= last_day:
+            shard_end = min(last_day, first_day + timedelta(days_per_shard - 1))
+            shards.append((year, first_day, shard_end))
+            first_day = shard_end + timedelta(1)
+    return shards
+
+def _limit_memory(max_memory_mb):
+    if max_memory_mb:
+        limit = max_memory_mb << 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _split_shard(task):
+    year, first_day, last_day, skip_days, options = task
+    shard = f'{first_day}..{last_day}'
+    # The metrics of the process are sent back to be added up.
+    shard_metrics = metrics.reset(f'split_{shard}')
+    try:
+        # A directory per shard, the shards of a year are split at the same time.
+        year_path, daily_counts = split_year(year, first_day=first_day, last_day=last_day, skip_days=skip_days,
+                                             year_path=f'{options["input_directory"]}/{year}/{first_day}', **options)
+        return year, shard, year_path, daily_counts, None, shard_metrics.stages, shard_metrics.counters
+    except Exception as error:
+        return year, shard, None, None, f'{type(error).__name__}: {error}', shard_metrics.stages, shard_metrics.counters
+
+
+def backfill(date_start, date_end, input_directory, output_directory, manifest_path, processes=1,
+             max_memory_mb=None, partition_by='day', compresslevel=9, max_open_files=32,
+             upload_workers=8, project=PROJECT_ID, memory_budget_mb=MEMORY_BUDGET_MB, json_backend='json',
+             days_per_shard=None):
+    """
+    Splits and uploads the days of a date range not in the manifest.
+    :param date_start: The first day, inclusive.
+    :type date_start: date
+    :param date_end: The last day, inclusive.
+    :type date_end: date
+    :param input_directory: The local directory with the Devices.txt and the
+    <year>.json files.
+    :type input_directory: str
+    :param output_directory: The directory where to upload, a folder per year
+    is created inside. Expected with slash at the end.
+    :type output_directory: str
+    :param manifest_path: The local path of the manifest.
+    :type manifest_path: str
+    :param processes: The amount of shards split at the same time. Default 1.
+    :type processes: int
+    :param max_memory_mb: The maximum address space of each process, in MiB.
+    Default None, unlimited.
+    :type max_memory_mb: int
+    :param partition_by: The partition of the files, day or hour. Default day.
+    :type partition_by: str
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param max_open_files: The maximum of GZIP files opened by each process.
+    Default 32.
+    :type max_open_files: int
+    :param upload_workers: The maximum days uploaded at the same time.
+    Default 8.
+    :type upload_workers: int
+    :param project: The GCP project. Default world-fishing-827.
+    :type project: str
+    :param memory_budget_mb: Splits each shard out of core within this
+    memory, in MiB, see split_year. Default 1024, None in memory.
+    :type memory_budget_mb: int
+    :param json_backend: The encoder of the lines, json or orjson. Default
+    json.
+    :type json_backend: str
+    :param days_per_shard: The maximum days of each shard, all of the same
+    year. Each shard reads the whole file of its year. Default None, the days
+    of the range shared out among the processes.
+    :type days_per_shard: int
+    :return: The shards and the days that failed, with their error.
+    :rtype: dict
+    """
+    manifest = BackfillManifest(manifest_path)
+    options = dict(input_directory=input_directory, partition_by=partition_by, compresslevel=compresslevel,
+                   max_open_files=max_open_files, memory_budget_mb=memory_budget_mb, json_backend=json_backend)
+    if not days_per_shard:
+        days_per_shard = -(-((date_end - date_start).days + 1) // max(1, processes))
+    tasks = []
+    for year, first_day, last_day in day_ranges(date_start, date_end, days_per_shard):
+        days = {day for day in manifest.days if first_day.strftime(FORMAT_DT) <= day <= last_day.strftime(FORMAT_DT)}
+        if len(days) == (last_day - first_day).days + 1:
+            print(f'Days {first_day}..{last_day} already uploaded, skipped.')
+            continue
+        tasks.append((year, first_day, last_day, days, options))
+
+    def upload_and_record(year_path, day, messages, year):
+        with metrics.stage('upload'):
+            filenames = upload_day(year_path, day, f'{output_directory}{year}/', project, remove=True)
+        manifest.record(day, messages, len(filenames))
+        metrics.count('days_uploaded')
+
+    failed = {}
+    uploads = []
+    # A fresh process per shard, so the memory of a shard is released.
+    with Pool(max(1, processes), initializer=_limit_memory, initargs=(max_memory_mb,), maxtasksperchild=1) as pool, \
+         ThreadPoolExecutor(max(1, upload_workers)) as uploader:
+        for year, shard, year_path, daily_counts, error, stages, counters in pool.imap_unordered(_split_shard, tasks):
+            for name, stage in stages.items():
+                metrics.add_time(name, stage['seconds'], stage['calls'])
+            for name, amount in counters.items():
+                metrics.count(name, amount)
+            if error is not None:
+                print(f'Days {shard} failed, they will be resumed in the next run: {error}')
+                failed[shard] = error
+                continue
+            print(f'Days {shard} split in {len(daily_counts)} days, {sum(daily_counts.values())} messages.')
+            for day in sorted(daily_counts):
+                uploads.append((day, uploader.submit(upload_and_record, year_path, day, daily_counts[day], year)))
+        for day, future in uploads:
+            try:
+                future.result()
+            except Exception as error:
+                print(f'Day {day} failed to upload, it will be resumed in the next run: {error}')
+                failed[day] = str(error)
+    return failed
+
+
+def main(argv=None, prog=None):
+    """
+    Backfills a historical date range, as the backfill command.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    :param prog: The name of the command in the usage. Default None, the
+    module.
+    :type prog: str
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Backfills the historical'
+                                     'data of a date range in parallel, resuming'
+                                     'from the days already uploaded.')
+    parser.add_argument('-s','--date_start', help='The first date to be'
+                        'processed. Expects a str in format YYYY-MM-DD', required=True)
+    parser.add_argument('-e','--date_end', help='The last date to be'
+                        'processed, inclusive. Expects a str in format YYYY-MM-DD', required=True)
+    parser.add_argument('-i','--input_directory', help='The local directory'
+                        'where the Devices.txt and the year files are stored.', required=True)
+    parser.add_argument('-o','--output_directory', help='The GCS directory'
+                        'where the data will be stored, in a folder per year.'
+                        'Expected with slash at the end.', required=True)
+    parser.add_argument('-mf','--manifest', help='The local path of the'
+                        'manifest of the days uploaded. Default'
+                        '<input_directory>/backfill_manifest.jsonl.', required=False, default=None)
+    parser.add_argument('-P','--processes', help='The amount of shards of'
+                        'days processed in parallel.', required=False, default=1, type=int)
+    parser.add_argument('-ds','--days_per_shard', help='The maximum days of'
+                        'each shard, all of the same year. Each shard reads the whole'
+                        'year file. Default the days shared out among the processes.',
+                        required=False, default=None, type=int)
+    parser.add_argument('-m','--max_memory_mb', help='The maximum memory of'
+                        'each process, in MiB. Default unlimited.', required=False, default=None, type=int)
+    parser.add_argument('-mb','--memory_budget_mb', help='Splits each shard'
+                        'out of core within this memory, in MiB, through a shard per day on'
+                        'local disk. Keep it under --max_memory_mb.', required=False, default=MEMORY_BUDGET_MB, type=int)
+    parser.add_argument('-im','--in_memory', help='Sorts each shard in memory'
+                        'instead, faster but the memory grows with the messages of the shard.',
+                        required=False, action='store_true')
+    parser.add_argument('-mo','--max_open_files', help='The maximum of GZIP'
+                        'files opened by each process.', required=False, default=32, type=int)
+    parser.add_argument('-uw','--upload_workers', help='The maximum days'
+                        'uploaded at the same time.', required=False, default=8, type=int)
+    parser.add_argument('-p','--partition_by', help='The partition of the'
+                        'output files, day or hour.', choices=list(PARTITIONS), default='day', required=False)
+    parser.add_argument('-cl','--compresslevel', help='The GZIP compression'
+                        'level of the output, from 1 (fastest) to 9 (smallest).', required=False, default=9, type=int)
+    parser.add_argument('-jb','--json_backend', help='The encoder of the '
+                        'ndjson lines, json or orjson (faster, compact lines) when installed.',
+                        choices=list(BACKENDS), required=False, default='json')
+    parser.add_argument('-mt','--metrics', help='The path, local or GCS,'
+                        'where the JSON summary of the metrics is saved. Default'
+                        'None, only printed.', required=False, default=None)
+    args = parser.parse_args(argv)
+    metrics.start('backfill', args.metrics)
+    date_start = date.fromisoformat(args.date_start)
+    date_end = date.fromisoformat(args.date_end)
+    manifest_path = args.manifest or os.path.join(args.input_directory, 'backfill_manifest.jsonl')
+
+    start_time = time.time()
+
+    failed = backfill(date_start, date_end, args.input_directory, args.output_directory, manifest_path,
+                      args.processes, args.max_memory_mb, args.partition_by, args.compresslevel,
+                      args.max_open_files, args.upload_workers, memory_budget_mb=None if args.in_memory else args.memory_budget_mb,
+                      json_backend=args.json_backend, days_per_shard=args.days_per_shard)
+    if failed:
+        print(f'Backfill incomplete, {len(failed)} failures. Run it again to resume: {failed}')
+        sys.exit(1)
+
+    ### ALL DONE
+    print("All done, you can find the output files here: {0}".format(args.output_directory))
+    print("Execution time {0} minutes".format((time.time()-start_time)/60))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Benchmarks the stages of the prepare and historical steps.
+
+Synthetic payloads are generated at multiples of the current volume and each
+stage is timed, then run again under tracemalloc to get its peak of memory.
+The stages stream the payload from the start, so each one includes the
+previous ones:
+- parse_devices: decompresses and indexes the devices.
+- parse_messages: decompresses and parses the messages.
+- join: parse_messages plus the join with the devices.
+- prepare_<format>: join plus sorting the merged messages without duplicates
+  and writing them in that format, as the prepare step does by default.
+- prepare_<format>_no_dedup: the same in the order received, as the prepare
+  step does with --no_dedup.
+- split_year: the historical step splitting a year file by day.
+
+The results are written as JSON, with the commit and the Python version, so
+runs of different commits can be compared, ex. with --baseline.
+
+Ex.
+python -m pipe_vms_brazil.benchmark -s 1 10 100 -o benchmark.json
+"""
+
+from contextlib import redirect_stdout
+
+from datetime import date, datetime, timedelta
+
+from pipe_vms_brazil.historical_data import split_year
+
+from pipe_vms_brazil.join import index_devices, join_messages
+
+from pipe_vms_brazil.json_stream import iter_array
+
+from pipe_vms_brazil.output import EXTENSIONS
+
+from pipe_vms_brazil.prepares_data import merge_to_file
+
+from pipe_vms_brazil.synthetic import BASE_FLEET_SIZE, BASE_PINGS_PER_DAY, write_day, write_year
+
+import argparse, gzip, json, os, platform, subprocess, tempfile, time, tracemalloc
+
+
+# FORMATS
+FORMAT_DT = '%Y-%m-%d'
+
+BENCHMARK_DAY = date(2021, 2, 25)
+
+
+def measure(stage, trace_memory=True):
+    """
+    Times a stage and measures its peak of memory in a second run.
+    :param stage: The stage, called without arguments.
+    :type stage: function
+    :param trace_memory: If the peak of memory is measured. Default True.
+    :type trace_memory: bool
+    :return: What the stage returns, the seconds and the peak of bytes
+    allocated, None if not measured.
+    :rtype: tuple
+    """
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = stage()
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                stage()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    return result, seconds, peak
+
+def _count(iterable):
+    count = 0
+    for _ in iterable:
+        count += 1
+    return count
+
+def _formats():
+    """The output formats whose optional dependencies are installed."""
+    formats = ['ndjson']
+    for output_format, module in (('parquet', 'pyarrow'), ('avro', 'fastavro')):
+        try:
+            __import__(module)
+            formats.append(output_format)
+        except ImportError:
+            print(f'{module} is not installed, the {output_format} format is not benchmarked.')
+    return formats
+
+def prepare_stages(directory, day, output_formats, compresslevel=9, workers=1):
+    """
+    The stages of the prepare step over the payloads of a day.
+    :param directory: The local directory with the devices and messages.
+    :type directory: str
+    :param day: The day of the payloads.
+    :type day: date
+    :param output_formats: The formats of the merged file to benchmark.
+    :type output_formats: list of str
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :return: The name and the function of each stage, returning the amount
+    of records processed.
+    :rtype: list of tuple
+    """
+    devices_path = os.path.join(directory, 'devices', f'{day.strftime(FORMAT_DT)}.json.gz')
+    messages_path = os.path.join(directory, 'messages', f'{day.strftime(FORMAT_DT)}.json.gz')
+
+    def load_devices():
+        with gzip.open(devices_path, 'rb') as devices:
+            return index_devices(iter_array(devices, 'devices'))
+
+    def parse_devices():
+        return len(load_devices())
+
+    def parse_messages():
+        with gzip.open(messages_path, 'rb') as messages:
+            return _count(iter_array(messages, 'mensagens'))
+
+    def join():
+        devices = load_devices()
+        with gzip.open(messages_path, 'rb') as messages:
+            return _count(join_messages(devices, iter_array(messages, 'mensagens')))
+
+    def prepare(output_format, dedup):
+        def stage():
+            devices = load_devices()
+            with gzip.open(messages_path, 'rb') as messages:
+                return merge_to_file(devices, iter_array(messages, 'mensagens'),
+                                     os.path.join(directory, f'merged{EXTENSIONS[output_format]}'),
+                                     output_format, compresslevel, workers, dedup)
+        return stage
+
+    stages = [('parse_devices', parse_devices), ('parse_messages', parse_messages), ('join', join)]
+    for output_format in output_formats:
+        stages.append((f'prepare_{output_format}', prepare(output_format, True)))
+        stages.append((f'prepare_{output_format}_no_dedup', prepare(output_format, False)))
+    return stages
+
+def run(scales, output_formats=None, historical_days=7, compresslevel=9, workers=1, trace_memory=True,
+        fleet_size=BASE_FLEET_SIZE, pings_per_day=BASE_PINGS_PER_DAY, work_directory=None):
+    """
+    Benchmarks the stages at several scales of the volume.
+    :param scales: The multiples of the volume, scaling the fleet size.
+    :type scales: list of int
+    :param output_formats: The formats of the merged file. Default None, the
+    ones installed.
+    :type output_formats: list of str
+    :param historical_days: The days of the year file of split_year, 0 to
+    skip it. Default 7.
+    :type historical_days: int
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :param trace_memory: If the peak of memory is measured. Default True.
+    :type trace_memory: bool
+    :param fleet_size: The devices at scale 1. Default 1500.
+    :type fleet_size: int
+    :param pings_per_day: The messages of each device per day. Default 24.
+    :type pings_per_day: int
+    :param work_directory: Where the payloads are generated. Default None, a
+    temporary directory.
+    :type work_directory: str
+    :return: The result of each stage and scale.
+    :rtype: list of dict
+    """
+    output_formats = output_formats or _formats()
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory(dir=work_directory) as directory:
+            scaled_fleet = fleet_size * scale
+            print(f'Generates the payloads at {scale}x, {scaled_fleet} devices.')
+            messages = write_day(directory, BENCHMARK_DAY, scaled_fleet, pings_per_day)
+            stages = prepare_stages(directory, BENCHMARK_DAY, output_formats, compresslevel, workers)
+            if historical_days:
+                historical_directory = os.path.join(directory, 'historical')
+                first_day = date(BENCHMARK_DAY.year, 1, 1)
+                year_messages = write_year(historical_directory, first_day, historical_days, scaled_fleet, pings_per_day)
+                last_day = min(first_day + timedelta(historical_days - 1), date(BENCHMARK_DAY.year, 12, 31))
+                stages.append(('split_year', lambda: sum(split_year(
+                    BENCHMARK_DAY.year, historical_directory, first_day, last_day, compresslevel=compresslevel,
+                    workers=workers)[1].values())))
+            for name, stage in stages:
+                records, seconds, peak = measure(stage, trace_memory)
+                input_messages = year_messages if name == 'split_year' else messages
+                result = dict(stage=name, scale=scale, messages=input_messages, records=records,
+                              seconds=round(seconds, 4),
+                              messages_per_second=round(input_messages / seconds) if seconds else None,
+                              peak_memory_bytes=peak)
+                print(f'{scale}x {name}: {seconds:.3f}s, {result["messages_per_second"]} messages/s, peak {peak} bytes')
+                results.append(result)
+    return results
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """
+    Compares the results with the ones of a previous run.
+    :param results: The results of this run.
+    :type results: list of dict
+    :param baseline: The results of the previous run.
+    :type baseline: list of dict
+    :return: The ratio of seconds per message and peak of memory of each
+    stage and scale in both runs, above 1 when this run is slower or uses more
+    memory.
+    :rtype: list of dict
+    """
+    previous = {(result['stage'], result['scale']): result for result in baseline}
+    ratios = []
+    for result in results:
+        before = previous.get((result['stage'], result['scale']))
+        if before is None:
+            continue
+        ratios.append(dict(stage=result['stage'], scale=result['scale'],
+                           seconds=round((result['seconds'] / result['messages'])
+                                         / (before['seconds'] / before['messages']), 3) if before['seconds'] else None,
+                           peak_memory=round(result['peak_memory_bytes'] / before['peak_memory_bytes'], 3)
+                           if result['peak_memory_bytes'] and before['peak_memory_bytes'] else None))
+    return ratios
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of'
+                                     'the prepare and historical steps with'
+                                     'synthetic data.')
+    parser.add_argument('-s','--scales', help='The multiples of the current'
+                        'volume to benchmark.', nargs='+', required=False, default=[1, 10, 100], type=int)
+    parser.add_argument('-o','--output', help='The JSON file where the'
+                        'results are written.', required=False, default='benchmark.json')
+    parser.add_argument('-b','--baseline', help='The JSON results of a'
+                        'previous run to compare with.', required=False, default=None)
+    parser.add_argument('-of','--output_formats', help='The formats of the'
+                        'merged file. Default the ones installed.', nargs='+', choices=list(EXTENSIONS),
+                        required=False, default=None)
+    parser.add_argument('-y','--historical_days', help='The days of the year'
+                        'file split by the historical step, 0 to skip it.', required=False, default=7, type=int)
+    parser.add_argument('-f','--fleet_size', help='The amount of devices at'
+                        'scale 1.', required=False, default=BASE_FLEET_SIZE, type=int)
+    parser.add_argument('-p','--pings_per_day', help='The messages of each'
+                        'device per day.', required=False, default=BASE_PINGS_PER_DAY, type=int)
+    parser.add_argument('-cl','--compresslevel', help='The GZIP compression'
+                        'level of the output, from 1 (fastest) to 9 (smallest).', required=False, default=9, type=int)
+    parser.add_argument('-w','--workers', help='The amount of processes'
+                        'compressing the output in parallel blocks.', required=False, default=1, type=int)
+    parser.add_argument('-nm','--no_memory', help='Skips the second run of'
+                        'each stage measuring the peak of memory.', action='store_true')
+    parser.add_argument('-wd','--work_directory', help='The local directory'
+                        'where the payloads are generated. Default a temporary one.', required=False, default=None)
+    args = parser.parse_args()
+
+    results = run(args.scales, args.output_formats, args.historical_days, args.compresslevel, args.workers,
+                  not args.no_memory, args.fleet_size, args.pings_per_day, args.work_directory)
+    report = dict(commit=_commit(), python=platform.python_version(), created=datetime.utcnow().isoformat(),
+                  fleet_size=args.fleet_size, pings_per_day=args.pings_per_day, compresslevel=args.compresslevel,
+                  workers=args.workers, results=results)
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline:
+            baseline = json.load(baseline)
+        report['baseline'] = baseline.get('commit')
+        report['comparison'] = compare(results, baseline['results'])
+        for ratio in report['comparison']:
+            print(f'{ratio["scale"]}x {ratio["stage"]}: {ratio["seconds"]} x seconds, {ratio["peak_memory"]} x memory')
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f'Results written to {args.output}')
@@ -7,15 +7,26 @@ This script will do:
 3- Upload the file to GCS.
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-from google.cloud import storage
+from email.utils import parsedate_to_datetime
 
 from shutil import rmtree
 
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-import argparse, linecache, gzip, json, os, re, requests, sys, time
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.device_registry import load_registry, save_registry
+
+from pipe_vms_brazil.incremental import (FORMAT_POLL, WATERMARK_FILE, deltas_directory, load_watermark, poll_window,
+                                         save_watermark, split_deltas)
+
+from pipe_vms_brazil.json_stream import JsonChecker, iter_array
+
+from pipe_vms_brazil.storage import exists, upload, upload_file
+
+import argparse, linecache, gzip, json, os, random, sys, threading, time
 
 
 # TOKEN should be removed from here.
@@ -25,67 +36,350 @@ ENDPOINT = 'http://globalfishing.newrastreamentoonline.com.br/Service.svc'
 
 # FORMATS
 FORMAT_DT = '%Y-%m-%d'
+FORMAT_TS = '%Y-%m-%dT%H:%M:%S'
 
 # FOLDER
 DOWNLOAD_PATH = "download"
 
-def query_data(endpoint, wait_time_between_api_calls, file_path, max_retries, query_date=None):
+# STREAM
+CHUNK_SIZE = 1 << 16
+
+# The HTTP OK, requests is only imported when a client is created.
+STATUS_OK = 200
+
+def stream_to_file(response, file_path):
     """
-    Queries the Brazil API.
-    :param endpoint: The API endpoint where to get the info.
-    :type endpoint: str
-    :param wait_time_between_api_calls: Time between API calls, seconds.
-    :type wait_time_between_api_calls: int
+    Streams the body of the response to a GZIP file checking that it is a
+    well-formed JSON. The body is written to a temporary file that replaces
+    the destination only when it is complete.
+    :param response: The streamed response of the API.
+    :type response: requests.Response
     :param file_path: The absolute path where to store locally the data.
     :type file_path: str
-    :param max_retries: The maximum retries to request when an error happens.
-    :type max_retries: int
-    :param query_date: The date to be queried. Default None.
-    :type query_date: datetime.
+    :return: The checker with the bytes and the records received.
+    :rtype: JsonChecker
     """
-    total=0
-    retries=0
-    success=False
-    # 2021-02-25T00:00:00/2021-02-25T23:59:59
-    brazil_positions_date_url = f'{endpoint}/{query_date.strftime("%Y-%m-%dT%H:%M:%S/%Y-%m-%dT23:59:59")}' if (query_date != None) else endpoint
-    parameters={
-    }
-    headers = {
-      'Accept': 'application/json'
-    }
-    while retries < max_retries and not success:
-        try:
-            print('Request to Brazil endpoint {}'.format(brazil_positions_date_url))
-            response = requests.get(brazil_positions_date_url, data=parameters, headers=headers, timeout=(3.05,30))
-            if response.status_code == requests.codes.ok:
-                data = response.json()
-                total += sys.getsizeof(data)
-                print("The total of array data received is <{0} bytes>. Retries <{1}>".format(total, retries))
-
-                print('Saving messages to <{}>.'.format(file_path))
-                with gzip.open(file_path, 'at', compresslevel=9) as outfile:
-                    json.dump(data, outfile)
-                print('All messages were saved.')
-                success=True
-            else:
-                print("Request did not return successful code: {0} retrying.".format(response.status_code))
-                print("Response {0}".format(response))
+    checker = JsonChecker()
+    partial_file_path = f'{file_path}.part'
+    try:
+        with gzip.open(partial_file_path, 'wb', compresslevel=9) as outfile:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                checker.feed(chunk)
+                outfile.write(chunk)
+        checker.close()
+    except:
+        os.remove(partial_file_path)
+        raise
+    os.replace(partial_file_path, file_path)
+    return checker
+
+def save_to_file(data, file_path):
+    """
+    Saves a parsed response to a GZIP file. The content is written to a
+    temporary file that replaces the destination only when it is complete,
+    as stream_to_file does.
+    :param data: The parsed body of the response.
+    :type data: dict
+    :param file_path: The absolute path where to store locally the data.
+    :type file_path: str
+    """
+    partial_file_path = f'{file_path}.part'
+    try:
+        with gzip.open(partial_file_path, 'wt', compresslevel=9) as outfile:
+            json.dump(data, outfile)
+    except:
+        os.remove(partial_file_path)
+        raise
+    os.replace(partial_file_path, file_path)
+
+class RateLimiter(object):
+    """Spaces the requests shared by several threads to a maximum per second."""
+
+    def __init__(self, max_requests_per_second=None):
+        """
+        Constructs the limiter.
+
+        :param max_requests_per_second: The maximum requests per second.
+        Default None, unlimited.
+        :type max_requests_per_second: float
+        """
+        self.interval = 1.0 / max_requests_per_second if max_requests_per_second else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a new request is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+def messages_url(endpoint, start, end):
+    """
+    Builds the url of the messages between two timestamps.
+    :param endpoint: The API endpoint of the messages.
+    :type endpoint: str
+    :param start: The start of the window, inclusive.
+    :type start: datetime
+    :param end: The end of the window, inclusive.
+    :type end: datetime
+    :return: The url, ex. endpoint/2021-02-25T00:00:00/2021-02-25T23:59:59
+    :rtype: str
+    """
+    return f'{endpoint}/{start.strftime(FORMAT_TS)}/{end.strftime(FORMAT_TS)}'
+
+def day_windows(query_date, windows):
+    """
+    Splits the day in consecutive windows of whole seconds.
+    :param query_date: The day to split.
+    :type query_date: datetime
+    :param windows: The amount of windows.
+    :type windows: int
+    :return: The start and end, both inclusive, of each window.
+    :rtype: list of tuple
+    """
+    start = datetime(query_date.year, query_date.month, query_date.day)
+    seconds = 24 * 60 * 60
+    bounds = [start + timedelta(seconds=seconds * i // windows) for i in range(windows + 1)]
+    return [(bounds[i], bounds[i + 1] - timedelta(seconds=1)) for i in range(windows)]
+
+class BrazilApiClient(object):
+    """
+    Client of the Brazil API. All the requests share a pooled session with
+    keep-alive and are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, endpoint, token, max_retries=3, backoff_base=5.0, backoff_cap=300.0,
+                 connect_timeout=3.05, read_timeout=30.0, pool_size=10, max_requests_per_second=None):
+        """
+        Constructs the client.
+
+        :param endpoint: The API endpoint.
+        :type endpoint: str
+        :param token: The token to access the API.
+        :type token: str
+        :param max_retries: The maximum retries to request when an error
+        happens. Default 3.
+        :type max_retries: int
+        :param backoff_base: The seconds to wait after the first error,
+        doubled after each retry. Default 5.
+        :type backoff_base: float
+        :param backoff_cap: The maximum seconds to wait between retries.
+        Default 300.
+        :type backoff_cap: float
+        :param connect_timeout: The seconds to wait to connect. Default 3.05.
+        :type connect_timeout: float
+        :param read_timeout: The seconds to wait between bytes of the
+        response. Default 30.
+        :type read_timeout: float
+        :param pool_size: The maximum connections kept alive. Default 10.
+        :type pool_size: int
+        :param max_requests_per_second: The maximum requests per second.
+        Default None, unlimited.
+        :type max_requests_per_second: float
+        """
+        self.endpoint = endpoint
+        self.token = token
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = (connect_timeout, read_timeout)
+        self.rate_limiter = RateLimiter(max_requests_per_second)
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff(self, retries, response=None):
+        """
+        The seconds to wait before the next retry. Honors the Retry-After of
+        the response, otherwise a full jitter exponential backoff, never more
+        than the backoff_cap.
+        :param retries: The amount of retries done.
+        :type retries: int
+        :param response: The failed response if any. Default None.
+        :type response: requests.Response
+        :return: The seconds to wait.
+        :rtype: float
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_cap, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                    return min(self.backoff_cap, max(0.0, wait))
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** retries))
+
+    def get(self, url, stream=False):
+        """
+        Requests the url once through the pooled session.
+        :param url: The url to request.
+        :type url: str
+        :param stream: Defers the download of the body. Default False.
+        :type stream: bool
+        :return: The response, whatever its status.
+        :rtype: requests.Response
+        """
+        self.rate_limiter.acquire()
+        metrics.count('requests')
+        print('Request to Brazil endpoint {}'.format(url))
+        return self.session.get(url, timeout=self.timeout, stream=stream)
+
+    def download(self, url, file_path, stream=False):
+        """
+        Requests the url of the Brazil API and saves the response.
+        :param url: The url to request.
+        :type url: str
+        :param file_path: The absolute path where to store locally the data.
+        :type file_path: str
+        :param stream: Streams the body straight to the file instead of
+        loading it in memory. Default False.
+        :type stream: bool
+        :return: If the response could be saved.
+        :rtype: bool
+        """
+        total=0
+        retries=0
+        success=False
+        while retries < self.max_retries and not success:
+            response=None
+            try:
+                response = self.get(url, stream)
+                if response.status_code == STATUS_OK and stream:
+                    print('Streaming messages to <{}>.'.format(file_path))
+                    received = stream_to_file(response, file_path)
+                    metrics.count('bytes_received', received.size)
+                    metrics.count('records_received', received.records)
+                    print("The total of data received is <{0} bytes> in <{1}> records. Retries <{2}>".format(received.size, received.records, retries))
+                    print('All messages were saved.')
+                    success=True
+                elif response.status_code == STATUS_OK:
+                    data = response.json()
+                    total += len(response.content)
+                    metrics.count('bytes_received', len(response.content))
+                    print("The total of array data received is <{0} bytes>. Retries <{1}>".format(total, retries))
+
+                    print('Saving messages to <{}>.'.format(file_path))
+                    save_to_file(data, file_path)
+                    print('All messages were saved.')
+                    success=True
+                else:
+                    print("Request did not return successful code: {0} retrying.".format(response.status_code))
+                    print("Response {0}".format(response))
+                    response.close()
+            except:
+                print('Unknown error')
+                exc_type, exc_obj, tb = sys.exc_info()
+                f = tb.tb_frame
+                lineno = tb.tb_lineno
+                filename = f.f_code.co_filename
+                linecache.checkcache(filename)
+                line = linecache.getline(filename, lineno, f.f_globals)
+                print('EXCEPTION IN ({}, LINE {} "{}"): {}'.format(filename, lineno, line.strip(), exc_obj))
+            if not success:
                 retries += 1
-        except:
-            print('Unknown error')
-            exc_type, exc_obj, tb = sys.exc_info()
-            f = tb.tb_frame
-            lineno = tb.tb_lineno
-            filename = f.f_code.co_filename
-            linecache.checkcache(filename)
-            line = linecache.getline(filename, lineno, f.f_globals)
-            print('EXCEPTION IN ({}, LINE {} "{}"): {}'.format(filename, lineno, line.strip(), exc_obj))
-            print('Trying to reconnect in {} segs'.format(wait_time_between_api_calls))
-            time.sleep(wait_time_between_api_calls)
-            retries += 1
-    if not success:
-        print('Can not get the Brazil data.')
-        sys.exit(1)
+                if retries < self.max_retries:
+                    metrics.count('retries')
+                    wait = self.backoff(retries - 1, response)
+                    print('Trying to reconnect in {:.2f} segs'.format(wait))
+                    time.sleep(wait)
+        return success
+
+    def get_devices(self, file_path, stream=False):
+        """
+        Downloads the devices.
+        :param file_path: The absolute path where to store locally the data.
+        :type file_path: str
+        :param stream: Streams the body straight to the file. Default False.
+        :type stream: bool
+        :return: If the devices could be saved.
+        :rtype: bool
+        """
+        return self.download(f'{self.endpoint}/GetDevices/{self.token}', file_path, stream)
+
+    def get_messages_between(self, start, end, file_path, stream=False):
+        """
+        Downloads the messages between two timestamps, ex. since the last
+        incremental poll.
+        :param start: The start of the window, inclusive.
+        :type start: datetime
+        :param end: The end of the window, inclusive.
+        :type end: datetime
+        :param file_path: The absolute path where to store locally the data.
+        :type file_path: str
+        :param stream: Streams the body straight to the file. Default False.
+        :type stream: bool
+        :return: If the messages could be saved.
+        :rtype: bool
+        """
+        return self.download(messages_url(f'{self.endpoint}/GetMessages/{self.token}', start, end), file_path, stream)
+
+    def get_messages(self, query_date, file_path, stream=False, windows=1, concurrency=1):
+        """
+        Downloads the messages of a day. The day can be split in windows
+        fetched concurrently, each one retried on its own, that are merged in
+        the same daily file.
+        :param query_date: The date to be queried.
+        :type query_date: datetime.
+        :param file_path: The absolute path where to store locally the data.
+        :type file_path: str
+        :param stream: Streams the body straight to the file. Default False.
+        :type stream: bool
+        :param windows: The amount of windows in which the day is split.
+        Default 1.
+        :type windows: int
+        :param concurrency: The maximum windows requested at the same time.
+        Default 1.
+        :type concurrency: int
+        :return: If the messages could be saved.
+        :rtype: bool
+        """
+        endpoint = f'{self.endpoint}/GetMessages/{self.token}'
+        if windows <= 1:
+            return self.download(messages_url(endpoint, *day_windows(query_date, 1)[0]), file_path, stream)
+
+        window_files = [f'{file_path}.{i}' for i in range(windows)]
+
+        def fetch(window):
+            (start, end), window_file = window
+            return self.download(messages_url(endpoint, start, end), window_file, stream)
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(fetch, zip(day_windows(query_date, windows), window_files)))
+        if not all(results):
+            print('Can not get the Brazil data of the windows {}.'.format([i for i, ok in enumerate(results) if not ok]))
+            return False
+
+        print('Merging the {} windows to <{}>.'.format(windows, file_path))
+        total=0
+        with gzip.open(file_path, 'wt', compresslevel=9) as outfile:
+            outfile.write('{"mensagens": [')
+            for window_file in window_files:
+                with gzip.open(window_file, 'rb') as window_content:
+                    for message in iter_array(window_content, 'mensagens'):
+                        if total:
+                            outfile.write(', ')
+                        json.dump(message, outfile)
+                        total += 1
+                os.remove(window_file)
+            outfile.write(']}')
+        print('All the {} messages of the windows were saved.'.format(total))
+        return True
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.session.close()
 
 
 def create_directory(name):
@@ -97,38 +391,77 @@ def create_directory(name):
     if not os.path.exists(name):
         os.makedirs(name)
 
-def gcs_transfer(pattern_file, gcs_path):
+
+def main(argv=None, prog=None):
     """
-    Uploads the files from file system to a GCS destination.
-    :param pattern_file: The pattern file without wildcard.
-    :type pattern_file: str
-    :param gcs_path: The absolute path of GCS.
-    :type gcs_path: str
+    Fetches the devices and messages of the API, as the fetch command.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    :param prog: The name of the command in the usage. Default None, the
+    module.
+    :type prog: str
     """
-    storage_client = storage.Client()
-    gcs_search = re.search('gs://([^/]*)/(.*)', gcs_path)
-    bucket = storage_client.bucket(gcs_search.group(1))
-    pattern_path = Path(pattern_file)
-    for filename in pattern_path.parent.glob(pattern_path.name + '*'):
-        blob = bucket.blob(gcs_search.group(2) + filename.name)
-        blob.upload_from_filename(filename)
-        print("File from file system <{}> uploaded to <{}>.".format(filename, gcs_path))
-
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Download all positional data of Brazil Vessels for a given day.')
-    parser.add_argument('-d','--query_date', help='The date to be queried. Expects a str in format YYYY-MM-DD',
-                        required=True)
+    parser = argparse.ArgumentParser(prog=prog, description='Download all positional data of Brazil Vessels for a given day.')
+    parser.add_argument('-d','--query_date', help='The date to be queried. Expects a str in format YYYY-MM-DD.'
+                        'Required unless --incremental.', required=False, default=None)
     parser.add_argument('-o','--output_directory', help='The GCS directory'
                         'where the data will be stored. Expected with slash at'
                         'the end.', required=True)
     parser.add_argument('-wt','--wait_time_between_api_calls', help='Time'
-                        'between calls to their API for vessel positions. Measured in'
-                        'seconds.', required=False, default=5.0, type=float)
+                        'to wait after the first error, doubled after each retry'
+                        'with random jitter. Measured in seconds.', required=False, default=5.0, type=float)
     parser.add_argument('-rtr','--max_retries', help='The amount of retries'
                         'after an error got from the API.', required=False, default=3)
-    args = parser.parse_args()
-    query_date = datetime.strptime(args.query_date, FORMAT_DT)
+    parser.add_argument('-bc','--backoff_cap', help='The maximum time to'
+                        'wait between retries. Measured in seconds.', required=False, default=300.0, type=float)
+    parser.add_argument('-ct','--connect_timeout', help='The time to wait to'
+                        'connect to the API. Measured in seconds.', required=False, default=3.05, type=float)
+    parser.add_argument('-rt','--read_timeout', help='The time to wait'
+                        'between bytes of the API response. Measured in seconds.', required=False, default=30.0, type=float)
+    parser.add_argument('-st','--stream', help='Streams the API responses'
+                        'straight to the GZIP files instead of loading them in memory.',
+                        required=False, action='store_true')
+    parser.add_argument('-win','--windows', help='The amount of windows in'
+                        'which the day of messages is split.', required=False, default=1, type=int)
+    parser.add_argument('-c','--concurrency', help='The maximum windows'
+                        'requested at the same time.', required=False, default=1, type=int)
+    parser.add_argument('-rps','--max_requests_per_second', help='The maximum'
+                        'requests per second to the API. Default unlimited.', required=False, default=None, type=float)
+    parser.add_argument('-dr','--device_registry', help='The path, local or'
+                        'GCS, of the device registry snapshot. Default None, no registry.',
+                        required=False, default=None)
+    parser.add_argument('-drd','--devices_refresh_days', help='The days the'
+                        'device registry is trusted before calling GetDevices again.'
+                        'Default 0, always called.', required=False, default=0, type=int)
+    parser.add_argument('-ep','--endpoint', help='The endpoint of the API,'
+                        'ex. a local pipe_vms_brazil.mock_api.', required=False, default=ENDPOINT)
+    parser.add_argument('-mt','--metrics', help='The path, local or GCS,'
+                        'where the JSON summary of the metrics is saved. Default'
+                        'None, only printed.', required=False, default=None)
+    parser.add_argument('-pf','--profile', help='Adds a cpu (cProfile) or'
+                        'memory (tracemalloc) profile to the metrics.', choices=list(metrics.PROFILES),
+                        required=False, default=None)
+    parser.add_argument('-inc','--incremental', help='Polls the messages'
+                        'since the watermark and saves the new ones as deltas of their day,'
+                        'instead of the whole query_date.', required=False, action='store_true')
+    parser.add_argument('-wm','--watermark', help='The path, local or GCS,'
+                        'of the watermark of the incremental polls. Default'
+                        '<output_directory>messages_deltas/_watermark.json.', required=False, default=None)
+    parser.add_argument('-ov','--overlap_minutes', help='The minutes before'
+                        'the watermark requested again by each incremental poll, for the'
+                        'messages received late.', required=False, default=10, type=int)
+    args = parser.parse_args(argv)
+    if not args.incremental and args.query_date is None:
+        parser.error('the following arguments are required: -d/--query_date')
+    metrics.start('fetch', args.metrics, args.profile)
+    if args.incremental:
+        watermark_path = args.watermark or f'{deltas_directory(args.output_directory)}{WATERMARK_FILE}'
+        watermark = load_watermark(watermark_path)
+        poll_start, poll_end = poll_window(watermark, datetime.utcnow(), timedelta(minutes=args.overlap_minutes))
+        print(f'Polling the messages from {poll_start} to {poll_end}, watermark {watermark}.')
+        query_date = datetime(poll_end.year, poll_end.month, poll_end.day)
+    else:
+        query_date = datetime.strptime(args.query_date, FORMAT_DT)
     output_directory= args.output_directory
     wait_time_between_api_calls = args.wait_time_between_api_calls
     max_retries = int(args.max_retries)
@@ -142,15 +475,66 @@ if __name__ == '__main__':
     create_directory(f'{DOWNLOAD_PATH}/messages')
 
     # Executes the query
-    query_data(f'{ENDPOINT}/GetDevices/{TOKEN}', wait_time_between_api_calls, devices_file_path, max_retries)
-    query_data(f'{ENDPOINT}/GetMessages/{TOKEN}', wait_time_between_api_calls, messages_file_path, max_retries, query_date)
+    registry = load_registry(args.device_registry) if args.device_registry else None
+    # GetDevices returns the current devices whatever the date queried.
+    today = datetime.utcnow().date()
+    fetch_devices = registry is None or not registry.is_fresh(today, args.devices_refresh_days)
+    if args.incremental:
+        # The devices are fetched by the first poll of the day only. Without a
+        # registry its file is always uploaded, the daily DAG waits for it.
+        fetch_devices = fetch_devices and not exists(f'{output_directory}devices/{query_date.strftime(FORMAT_DT)}.json.gz')
+    client = BrazilApiClient(args.endpoint, TOKEN, max_retries, wait_time_between_api_calls, args.backoff_cap,
+                             args.connect_timeout, args.read_timeout, max(args.concurrency, 1),
+                             args.max_requests_per_second)
+    with metrics.stage('api_devices'):
+        success = not fetch_devices or client.get_devices(devices_file_path, args.stream)
+    if success:
+        with metrics.stage('api_messages'):
+            if args.incremental:
+                success = client.get_messages_between(poll_start, poll_end, messages_file_path, args.stream)
+            else:
+                success = client.get_messages(query_date, messages_file_path, args.stream, args.windows, args.concurrency)
+    client.close()
+    if not success:
+        print('Can not get the Brazil data.')
+        sys.exit(1)
+
+    if not fetch_devices and (registry is None or not registry.is_fresh(today, args.devices_refresh_days)):
+        print(f'The devices of {query_date.strftime(FORMAT_DT)} were already fetched, GetDevices skipped.')
+    elif not fetch_devices:
+        print(f'The device registry was checked on {registry.checked}, GetDevices skipped.')
+    elif registry is not None:
+        with gzip.open(devices_file_path, 'rb') as devices_content:
+            diff = registry.update(list(iter_array(devices_content, 'devices')), today)
+        print('Devices without changes.' if diff is None else f'Devices changes applied to the registry {diff}.')
+        save_registry(registry, args.device_registry)
 
     # Saves to GCS
-    gcs_transfer(devices_file_path, f'{output_directory}devices/')
-    gcs_transfer(messages_file_path, f'{output_directory}messages/')
+    with metrics.stage('upload'):
+        if fetch_devices:
+            upload(devices_file_path, f'{output_directory}devices/')
+        if not args.incremental:
+            upload(messages_file_path, f'{output_directory}messages/')
+
+    if args.incremental:
+        poll = poll_end.strftime(FORMAT_POLL)
+        with metrics.stage('split_deltas'):
+            deltas, new_watermark = split_deltas(messages_file_path, watermark, poll_end, f'{DOWNLOAD_PATH}/deltas', poll)
+        with metrics.stage('upload'):
+            for day, (delta_path, messages) in sorted(deltas.items()):
+                upload_file(delta_path, f'{deltas_directory(output_directory, day)}{poll}.json.gz')
+                print(f'{messages} new messages of {day} saved as delta {poll}.')
+                metrics.count('messages_new', messages)
+        # Saved once the deltas are uploaded, a failed poll is requested again.
+        save_watermark(watermark_path, new_watermark)
+        print(f'Watermark moved to {new_watermark}.')
 
     rmtree(DOWNLOAD_PATH)
 
     ### ALL DONE
     print("All done, you can find the output file here: {0}".format(output_directory))
     print("Execution time {0} minutes".format((time.time()-start_time)/60))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+The command line of the pipeline, a subcommand per step.
+
+Only the module of the step that runs is imported, and the steps import their
+heavy dependencies (requests, the GCS client, numpy, pyarrow...) only when
+they use them, so a pod starts the step, or prints its help, without paying
+for the rest of the pipeline.
+
+Ex.
+pipe-vms-brazil prepare -d 2021-02-25 -i gs://bucket/brazil/raw/ -o gs://bucket/brazil/merged/
+pipe-vms-brazil load --help
+"""
+
+from collections import OrderedDict
+
+import argparse, importlib, sys
+
+
+PROG = 'pipe-vms-brazil'
+
+COMMANDS = OrderedDict([
+    ('fetch', ('pipe_vms_brazil.brazil_api_client', 'Downloads the devices and messages of the API to GCS.')),
+    ('prepare', ('pipe_vms_brazil.prepares_data', 'Merges the devices and messages of the days.')),
+    ('fetch-prepare', ('pipe_vms_brazil.fetch_prepare', 'Fetches and prepares a day streaming the API.')),
+    ('historical', ('pipe_vms_brazil.historical_data', 'Splits a historical year by day.')),
+    ('backfill', ('pipe_vms_brazil.backfill', 'Backfills the historical years of a date range.')),
+    ('load', ('pipe_vms_brazil.load', 'Loads the prepared days to BigQuery.')),
+])
+
+
+def main(argv=None):
+    """
+    Runs the step of the subcommand with the rest of the arguments.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog=PROG, description='Runs a step of'
+                                     ' the Brazil VMS pipeline.', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='commands:\n' + '\n'.join(f'  {command:<15}{description}'
+                                                                      for command, (_, description) in COMMANDS.items()))
+    parser.add_argument('command', help='The step, see the commands. Its'
+                        ' arguments follow it, ex. prepare --help.', choices=list(COMMANDS), metavar='command')
+    # Only the command is parsed here, the step parses the rest.
+    args = parser.parse_args(argv[:1])
+    module, _ = COMMANDS[args.command]
+    importlib.import_module(module).main(argv[1:], f'{PROG} {args.command}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Deduplicates and sorts the merged messages before the load.
+
+Overlapping fetches and retries can repeat messages. The merged rows are
+sorted by `ID, datahora, mID`, so the repeated `(ID, mID, datahora)` are
+consecutive and only the first is kept. The rows are written in the order
+BigQuery clusters them, which keeps each vessel track together.
+
+The memory is bounded by `max_rows`: the rows are kept as a compact
+`RecordBatch` and when it is full it is sorted and spilled to a temporary
+run, the runs are merged at the end. A day that fits in memory is never
+spilled.
+"""
+
+from heapq import merge
+
+from operator import itemgetter
+
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.records import RecordBatch
+
+import gzip, json, os, shutil, tempfile, time
+
+
+KEY_FIELDS = ('ID', 'datahora', 'mID')
+
+# About 70 bytes each as a RecordBatch, plus 100 while sorting them.
+MAX_ROWS = 2000000
+
+_OFFSET = 1 << 63
+
+
+class ExternalSorter(object):
+    """Sorts the merged messages by ID, datahora and mID without duplicates."""
+
+    def __init__(self, max_rows=MAX_ROWS, directory=None):
+        """
+        Constructs the sorter.
+
+        :param max_rows: The maximum rows kept in memory before spilling a
+        sorted run to disk. Default 2000000.
+        :type max_rows: int
+        :param directory: The local directory of the runs. Default None, the
+        temporary directory of the system.
+        :type directory: str
+        """
+        self.max_rows = max(1, max_rows)
+        self.directory = directory
+        self.duplicates = 0
+        self.runs = 0
+
+    def _sorted_keys(self, batch):
+        """The key and position of the rows of a batch, in order."""
+        columns, exceptions = batch.columns, batch.exceptions
+        ids, epochs, mids = columns['ID'], columns['datahora'], columns['mID']
+        typed, untyped = [], []
+        for index in range(len(batch)):
+            if exceptions and any((index, field) in exceptions for field in KEY_FIELDS):
+                untyped.append(index)
+            else:
+                typed.append(index)
+        # The typed keys packed in a single int, far smaller than a tuple per row.
+        typed.sort(key=lambda index: ((ids[index] + _OFFSET) << 128) | ((epochs[index] + _OFFSET) << 64)
+                                     | (mids[index] + _OFFSET))
+        for index in typed:
+            yield (0, ids[index], epochs[index], mids[index]), index
+        # A key of other types sorts after the typed ones.
+        untyped_keys = sorted(((1,) + tuple(str(batch.value(index, field)) for field in KEY_FIELDS), index)
+                              for index in untyped)
+        for key, index in untyped_keys:
+            yield key, index
+
+    def _spill(self, batch, directory):
+        """Writes a batch sorted, without duplicates, as a run."""
+        path = os.path.join(directory, f'run_{self.runs}.json.gz')
+        self.runs += 1
+        last = None
+        with gzip.open(path, 'wt', compresslevel=1) as run:
+            for key, index in self._sorted_keys(batch):
+                if key == last:
+                    self.duplicates += 1
+                    continue
+                last = key
+                run.write(json.dumps([key, batch.row(index)]) + '\n')
+        return path
+
+    @staticmethod
+    def _read(path):
+        with gzip.open(path, 'rt') as run:
+            for line in run:
+                key, row = json.loads(line)
+                yield tuple(key), row
+
+    def sort_batch(self, batch):
+        """
+        Sorts the rows of a batch already in memory by ID, datahora and mID,
+        dropping the repeated ones, without copying them into another batch.
+        The time spent sorting is added to the sort stage.
+        :param batch: The merged messages.
+        :type batch: RecordBatch
+        :return: The rows sorted, without duplicates.
+        :rtype: generator
+        """
+        clock = time.perf_counter
+        sorting = 0.0
+        ordered = self._sorted_keys(batch)
+        last = None
+        try:
+            while True:
+                start = clock()
+                try:
+                    key, index = next(ordered)
+                except StopIteration:
+                    break
+                finally:
+                    sorting += clock() - start
+                if key == last:
+                    self.duplicates += 1
+                    continue
+                last = key
+                yield batch.row(index)
+        finally:
+            metrics.add_time('sort', sorting)
+
+    def sort_unique(self, rows):
+        """
+        Sorts the rows by ID, datahora and mID, dropping the repeated ones.
+        The time spent sorting and spilling is added to the sort stage.
+        :param rows: The merged messages.
+        :type rows: iterable of dict
+        :return: The rows sorted, without duplicates.
+        :rtype: generator
+        """
+        clock = time.perf_counter
+        sorting = 0.0
+        directory = None
+        runs = []
+        batch = RecordBatch()
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.max_rows:
+                    start = clock()
+                    if directory is None:
+                        directory = tempfile.mkdtemp(prefix='sort_', dir=self.directory)
+                    runs.append(self._spill(batch, directory))
+                    batch = RecordBatch()
+                    sorting += clock() - start
+            start = clock()
+            if runs and len(batch):
+                runs.append(self._spill(batch, directory))
+                batch = RecordBatch()
+            if runs:
+                ordered = merge(*[self._read(path) for path in runs], key=itemgetter(0))
+            else:
+                ordered = ((key, batch.row(index)) for key, index in self._sorted_keys(batch))
+            last = None
+            while True:
+                try:
+                    key, row = next(ordered)
+                except StopIteration:
+                    break
+                if key == last:
+                    self.duplicates += 1
+                    continue
+                last = key
+                sorting += clock() - start
+                yield row
+                start = clock()
+            sorting += clock() - start
+        finally:
+            metrics.add_time('sort', sorting)
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
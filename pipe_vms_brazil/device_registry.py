@@ -0,0 +1,186 @@
+"""
+Registry of the Brazil devices.
+
+Keeps a compact snapshot of the devices got from the API together with the
+content hash of the last device list applied, so an unchanged list is
+detected without comparing it, and the history of the `codMarinha` and `nome`
+of each device, so the messages of old dates are joined with the device info
+valid at that date.
+
+The snapshot is a GZIP JSON stored locally or in GCS.
+"""
+
+from datetime import date
+
+from pipe_vms_brazil.storage import download, exists, upload_file
+
+import gzip, hashlib, json, os, tempfile
+
+
+TRACKED_FIELDS = ('codMarinha', 'nome')
+
+FORMAT_DT = '%Y-%m-%d'
+
+
+def content_hash(devices):
+    """
+    Hashes the content of a device list, regardless its order.
+    :param devices: The devices as they come from the API.
+    :type devices: list of dict
+    :return: The SHA-256 hex digest.
+    :rtype: str
+    """
+    canonical = sorted(json.dumps(device, sort_keys=True) for device in devices)
+    return hashlib.sha256('\n'.join(canonical).encode('utf-8')).hexdigest()
+
+
+class DeviceRegistry(object):
+    """The devices known and the history of their tracked fields."""
+
+    def __init__(self, devices=None, history=None, content_hash=None, checked=None):
+        """
+        Constructs the registry.
+
+        :param devices: The last known record of each device keyed by ID.
+        Default None, empty.
+        :type devices: dict
+        :param history: The changes of each device keyed by ID, sorted by the
+        date since they are valid. Default None, empty.
+        :type history: dict
+        :param content_hash: The hash of the last device list applied.
+        :type content_hash: str
+        :param checked: The date of the last device list applied, YYYY-mm-dd.
+        :type checked: str
+        """
+        self.devices = devices or {}
+        self.history = history or {}
+        self.content_hash = content_hash
+        self.checked = checked
+
+    def is_fresh(self, day, max_age_days):
+        """
+        If the registry was checked recently enough to skip the API.
+        :param day: The day being processed.
+        :type day: date
+        :param max_age_days: The maximum days since the last check.
+        :type max_age_days: int
+        :return: True if it was checked in the last max_age_days days.
+        :rtype: bool
+        """
+        if self.checked is None or max_age_days <= 0:
+            return False
+        checked = date.fromisoformat(self.checked)
+        return 0 <= (day - checked).days < max_age_days
+
+    def update(self, devices, day):
+        """
+        Applies a new device list, only the differences are recorded.
+        :param devices: The devices as they come from the API.
+        :type devices: list of dict
+        :param day: The date of the device list.
+        :type day: date
+        :return: The amount of devices added, changed and removed, or None if
+        the list is the same than the last one applied.
+        :rtype: dict
+        """
+        # The history is kept sorted, a list can not be older than the last.
+        day = max(day.strftime(FORMAT_DT), self.checked or '')
+        new_hash = content_hash(devices)
+        first_snapshot = self.content_hash is None
+        self.checked = day
+        if new_hash == self.content_hash:
+            return None
+        self.content_hash = new_hash
+        # Before the first snapshot the device info is assumed to be the same.
+        since = None if first_snapshot else day
+        diff = dict(added=0, changed=0, removed=0)
+        received = set()
+        for device in devices:
+            device_id = device['ID']
+            received.add(device_id)
+            tracked = {field: device.get(field) for field in TRACKED_FIELDS}
+            entries = self.history.setdefault(device_id, [])
+            if not entries or entries[-1].get('removed') or any(entries[-1].get(field) != value for field, value in tracked.items()):
+                diff['changed' if entries else 'added'] += 1
+                entries.append(dict(since=since, **tracked))
+            self.devices[device_id] = device
+        for device_id, entries in self.history.items():
+            if device_id not in received and not entries[-1].get('removed'):
+                diff['removed'] += 1
+                entries.append(dict(since=day, removed=True))
+        return diff
+
+    def devices_at(self, day):
+        """
+        The devices with the info valid at a date, to join the messages.
+        :param day: The date of the messages.
+        :type day: date
+        :return: The devices keyed by ID.
+        :rtype: dict
+        """
+        day = day.strftime(FORMAT_DT)
+        index = {}
+        for device_id, entries in self.history.items():
+            valid = entries[0]
+            for entry in entries:
+                if entry['since'] is None or entry['since'] <= day:
+                    valid = entry
+            if valid.get('removed'):
+                continue
+            index[device_id] = dict(self.devices[device_id], **{field: valid[field] for field in TRACKED_FIELDS})
+        return index
+
+    def to_dict(self):
+        """
+        The JSON representation of the registry. The IDs are kept inside
+        the records as JSON keys are always strings.
+        :return: The snapshot.
+        :rtype: dict
+        """
+        return dict(content_hash=self.content_hash, checked=self.checked,
+                    devices=list(self.devices.values()),
+                    history=[dict(ID=device_id, entries=entries) for device_id, entries in self.history.items()])
+
+    @classmethod
+    def from_dict(cls, snapshot):
+        """
+        Builds the registry from its JSON representation.
+        :param snapshot: The snapshot, see to_dict.
+        :type snapshot: dict
+        :return: The registry.
+        :rtype: DeviceRegistry
+        """
+        return cls(devices={device['ID']: device for device in snapshot['devices']},
+                   history={item['ID']: item['entries'] for item in snapshot['history']},
+                   content_hash=snapshot['content_hash'], checked=snapshot['checked'])
+
+
+def load_registry(path):
+    """
+    Loads the registry from the local file system or GCS.
+    :param path: The path of the snapshot, gs://, file:// or local.
+    :type path: str
+    :return: The registry, empty if the snapshot does not exist yet.
+    :rtype: DeviceRegistry
+    """
+    if not exists(path):
+        return DeviceRegistry()
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'registry.json.gz')
+        download(path, local_path)
+        with gzip.open(local_path, 'rt') as snapshot:
+            return DeviceRegistry.from_dict(json.load(snapshot))
+
+def save_registry(registry, path):
+    """
+    Saves the registry to the local file system or GCS.
+    :param registry: The registry.
+    :type registry: DeviceRegistry
+    :param path: The path of the snapshot, gs://, file:// or local.
+    :type path: str
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'registry.json.gz')
+        with gzip.open(local_path, 'wt', compresslevel=9) as snapshot:
+            json.dump(registry.to_dict(), snapshot, separators=(',', ':'))
+        upload_file(local_path, path)
@@ -0,0 +1,165 @@
+"""
+Enriches the merged messages with columns of the track of each vessel.
+
+The merged messages come grouped by `ID` and sorted by `datahora`, as the
+`ExternalSorter` writes them. They are taken in chunks and the columns are
+computed with NumPy over the whole chunk at once, comparing each ping with
+the previous one of its vessel, also across chunks:
+- `seconds_since_previous`, the seconds since the previous ping.
+- `distance_km`, the haversine distance from the previous position.
+- `implied_speed_kmh`, the distance over the time between both pings.
+- `impossible_jump`, if the implied speed is over `max_speed_kmh`, or the
+  vessel moved without any time between both pings.
+
+The first ping of each vessel has null columns, as the ones next to a lat or
+lon that is not a valid position or a message without an integer `ID` or a
+valid `datahora`. It needs the optional dependency `numpy`.
+"""
+
+from pipe_vms_brazil import metrics
+
+import time
+
+
+TRACK_FIELDS = ('seconds_since_previous', 'distance_km', 'implied_speed_kmh', 'impossible_jump')
+
+EARTH_RADIUS_KM = 6371.0088
+
+# About 54 knots, faster than any fishing vessel.
+MAX_SPEED_KMH = 100.0
+
+CHUNK_ROWS = 100000
+
+
+def import_numpy():
+    """
+    Imports numpy, the optional dependency of the enrichment.
+    :return: The numpy module.
+    :raise: An ImportError telling how to install it.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('The track enrichment needs numpy, install it with the enrich extra:'
+                          ' pip install pipe-vms-brazil[enrich].') from None
+    return numpy
+
+def _column(numpy, values, dtype, missing):
+    """
+    Converts the values of a field at once, or one by one when some of them
+    can not be converted.
+    :return: The converted values and if each one could be converted.
+    :rtype: tuple
+    """
+    try:
+        return numpy.array(values, dtype=dtype), numpy.ones(len(values), dtype=bool)
+    except (TypeError, ValueError, OverflowError):
+        pass
+    converted = numpy.full(len(values), missing, dtype=dtype)
+    valid = numpy.ones(len(values), dtype=bool)
+    for index, value in enumerate(values):
+        try:
+            converted[index] = value
+        except (TypeError, ValueError, OverflowError):
+            valid[index] = False
+    return converted, valid
+
+
+class TrackEnricher(object):
+    """Computes the track columns of consecutive chunks of merged messages."""
+
+    def __init__(self, max_speed_kmh=MAX_SPEED_KMH):
+        """
+        Constructs the enricher.
+
+        :param max_speed_kmh: The highest plausible implied speed, a faster
+        one is an impossible jump. Default 100.
+        :type max_speed_kmh: float
+        """
+        numpy = import_numpy()
+        self.numpy = numpy
+        self.max_speed_kmh = max_speed_kmh
+        # The last ping of the previous chunk: ID, epoch, lat, lon, keyed.
+        self._last = (0, 0, numpy.nan, numpy.nan, False)
+
+    def columns(self, rows):
+        """
+        The track columns of a chunk of merged messages.
+        :param rows: The merged messages that follow the previous chunk.
+        :type rows: list of dict
+        :return: The values of each of the TRACK_FIELDS, None where they do
+        not apply.
+        :rtype: tuple of list
+        """
+        numpy = self.numpy
+        last_id, last_epoch, last_lat, last_lon, last_keyed = self._last
+        ids, valid_ids = _column(numpy, [last_id] + [row['ID'] for row in rows], numpy.int64, 0)
+        epochs, valid_epochs = _column(numpy, [last_epoch] + [row['datahora'] for row in rows], 'datetime64[s]', 0)
+        epochs = epochs.astype(numpy.int64)
+        lats, _ = _column(numpy, [last_lat] + [row['lat'] for row in rows], numpy.float64, numpy.nan)
+        lons, _ = _column(numpy, [last_lon] + [row['lon'] for row in rows], numpy.float64, numpy.nan)
+        keyed = valid_ids & valid_epochs & ~numpy.isnat(epochs.view('datetime64[s]'))
+        keyed[0] = last_keyed
+        located = (numpy.abs(lats) <= 90) & (numpy.abs(lons) <= 180)
+        self._last = (ids[-1], epochs[-1], lats[-1], lons[-1], keyed[-1])
+
+        # Each ping against the previous one, the first of a vessel has none.
+        previous = keyed[1:] & keyed[:-1] & (ids[1:] == ids[:-1])
+        seconds = numpy.diff(epochs)
+        lats = numpy.radians(numpy.where(located, lats, numpy.nan))
+        lons = numpy.radians(numpy.where(located, lons, numpy.nan))
+        half_lat = numpy.sin(numpy.diff(lats) / 2)
+        half_lon = numpy.sin(numpy.diff(lons) / 2)
+        chord = half_lat ** 2 + numpy.cos(lats[:-1]) * numpy.cos(lats[1:]) * half_lon ** 2
+        distance = 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(chord, 1.0)))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            speed = distance * 3600 / seconds
+        measured = previous & ~numpy.isnan(distance)
+        impossible = ((seconds > 0) & (speed > self.max_speed_kmh)) | ((seconds == 0) & (distance > 0))
+
+        def nullable(values, mask):
+            return [value if valid else None for value, valid in zip(values.tolist(), mask.tolist())]
+
+        return (nullable(seconds, previous),
+                nullable(numpy.round(distance, 3), measured),
+                nullable(numpy.round(speed, 2), measured & (seconds > 0)),
+                nullable(impossible, measured))
+
+
+def enrich_tracks(rows, max_speed_kmh=MAX_SPEED_KMH, chunk_rows=CHUNK_ROWS):
+    """
+    Adds the TRACK_FIELDS to the merged messages. The time spent is added to
+    the enrich stage.
+    :param rows: The merged messages sorted by ID and datahora.
+    :type rows: iterable of dict
+    :param max_speed_kmh: The highest plausible implied speed, a faster one
+    is an impossible jump. Default 100.
+    :type max_speed_kmh: float
+    :param chunk_rows: The amount of rows computed at once. Default 100000.
+    :type chunk_rows: int
+    :return: The merged messages with the TRACK_FIELDS, in the same order.
+    :rtype: generator
+    """
+    clock = time.perf_counter
+    enriching = 0.0
+    enricher = TrackEnricher(max_speed_kmh)
+    chunk = []
+    rows = iter(rows)
+    try:
+        while True:
+            chunk.clear()
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    break
+            if not chunk:
+                break
+            start = clock()
+            track = enricher.columns(chunk)
+            for field, values in zip(TRACK_FIELDS, track):
+                for row, value in zip(chunk, values):
+                    row[field] = value
+            enriching += clock() - start
+            yield from chunk
+    finally:
+        metrics.add_time('enrich', enriching)
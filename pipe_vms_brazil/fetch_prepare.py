@@ -0,0 +1,319 @@
+"""
+Fetches and prepares the Brazil data in a single step.
+
+This script will do:
+1- Request the devices to the ENDPOINT, or load them from the device registry.
+2- Stream the messages of the day from the ENDPOINT through the join.
+3- Save the merged file and upload it to GCS, unless the messages, the
+devices and the options did not change since the last run of the day.
+4- Optionally archive the raw GZIP files to GCS in background.
+
+It skips the raw files round trip of running fetch and prepare apart.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from datetime import datetime
+
+from shutil import rmtree
+
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.brazil_api_client import (BrazilApiClient, ENDPOINT, STATUS_OK, TOKEN, CHUNK_SIZE, day_windows,
+                                               messages_url)
+
+from pipe_vms_brazil.dedup import MAX_ROWS
+
+from pipe_vms_brazil.device_registry import content_hash, load_registry, save_registry
+
+from pipe_vms_brazil.enrich import MAX_SPEED_KMH, import_numpy
+
+from pipe_vms_brazil.gzip_writer import ParallelGzipWriter
+
+from pipe_vms_brazil.join import index_devices
+
+from pipe_vms_brazil.json_stream import JsonChecker, iter_array
+
+from pipe_vms_brazil.ndjson import BACKENDS
+
+from pipe_vms_brazil.output import EXTENSIONS
+
+from pipe_vms_brazil.prepares_data import create_directory, merge_to_file
+
+from pipe_vms_brazil.stage_manifest import is_unchanged, load_manifest, manifest_path, save_manifest
+
+from pipe_vms_brazil.storage import upload
+
+import argparse, gzip, hashlib, os, sys, time
+
+
+# FORMATS
+FORMAT_DT = '%Y-%m-%d'
+
+# FOLDER
+LOCAL_PATH = "fetch_prepare_data"
+
+
+class _TeeReader(object):
+    """
+    Reads the response body copying it to the raw archive, the checker and
+    the digest.
+    """
+
+    def __init__(self, raw, archive, checker):
+        self.raw = raw
+        self.archive = archive
+        self.checker = checker
+        self.digest = hashlib.md5()
+
+    def read(self, size=CHUNK_SIZE):
+        data = self.raw.read(size)
+        if data:
+            self.checker.feed(data)
+            self.digest.update(data)
+            if self.archive is not None:
+                self.archive.write(data)
+        return data
+
+
+def stream_merge(client, url, devices, merged_file_path, raw_file_path=None, output_format='ndjson',
+                 compresslevel=9, workers=1, dedup=False, max_sort_rows=MAX_ROWS, json_backend='json',
+                 enrich=False, max_speed_kmh=MAX_SPEED_KMH):
+    """
+    Streams the messages from the API through the join to the merged file.
+    The whole day is requested again after an error. The raw archive is
+    compressed in a background thread, out of the reading loop.
+    :param client: The Brazil API client.
+    :type client: BrazilApiClient
+    :param url: The url of the messages.
+    :type url: str
+    :param devices: The devices keyed by ID.
+    :type devices: dict
+    :param merged_file_path: The local path of the merged file.
+    :type merged_file_path: str
+    :param raw_file_path: The local path where to keep the raw GZIP. Default
+    None, it is not kept.
+    :type raw_file_path: str
+    :param output_format: The format, ndjson, parquet or avro. Default ndjson.
+    :type output_format: str
+    :param compresslevel: The GZIP compression level of the merged file and
+    the raw archive. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :param dedup: Sorts the merged messages dropping the duplicates, see
+    merge_to_file. Default False.
+    :type dedup: bool
+    :param max_sort_rows: The maximum rows sorted in memory. Default 2000000.
+    :type max_sort_rows: int
+    :param json_backend: The encoder of ndjson, json or orjson. Default json.
+    :type json_backend: str
+    :param enrich: Adds the track columns, see merge_to_file. Default False.
+    :type enrich: bool
+    :param max_speed_kmh: The highest plausible implied speed. Default 100.
+    :type max_speed_kmh: float
+    :return: The MD5 hex digest of the body received, None if the messages
+    could not be merged.
+    :rtype: str
+    """
+    retries=0
+    while retries < client.max_retries:
+        response=None
+        try:
+            response = client.get(url, stream=True)
+            if response.status_code != STATUS_OK:
+                raise IOError('Request did not return successful code: {0}.'.format(response.status_code))
+            response.raw.decode_content = True
+            checker = JsonChecker()
+            archiver = ThreadPoolExecutor(1) if raw_file_path else None
+            archive = ParallelGzipWriter(raw_file_path, 'wb', compresslevel, 1, archiver) if raw_file_path else None
+            try:
+                reader = _TeeReader(response.raw, archive, checker)
+                merge_to_file(devices, iter_array(reader, 'mensagens'), merged_file_path, output_format,
+                              compresslevel, workers, dedup, max_sort_rows, json_backend, enrich, max_speed_kmh)
+                # Reads what remains after the messages to check and archive it.
+                while reader.read():
+                    pass
+            finally:
+                if archive is not None:
+                    archive.close()
+                    archiver.shutdown()
+            checker.close()
+            metrics.count('bytes_received', checker.size)
+            metrics.count('records_received', checker.records)
+            print("The total of data received is <{0} bytes> in <{1}> records. Retries <{2}>".format(checker.size, checker.records, retries))
+            return reader.digest.hexdigest()
+        except Exception as error:
+            print('Error streaming the messages: {}'.format(error))
+            if response is not None:
+                response.close()
+            retries += 1
+            if retries < client.max_retries:
+                metrics.count('retries')
+                wait = client.backoff(retries - 1, response)
+                print('Trying to reconnect in {:.2f} segs'.format(wait))
+                time.sleep(wait)
+    return None
+
+
+def main(argv=None, prog=None):
+    """
+    Fetches and prepares a day streaming the API, as the fetch-prepare command.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    :param prog: The name of the command in the usage. Default None, the
+    module.
+    :type prog: str
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Fetches the Brazil data of a'
+                                     'day and merges the devices and messages'
+                                     'in a single step.')
+    parser.add_argument('-d','--query_date', help='The date to be queried. Expects a str in format YYYY-MM-DD',
+                        required=True)
+    parser.add_argument('-o','--output_directory', help='The GCS directory'
+                        'where the merged data will be stored. Expected with slash at'
+                        'the end.', required=True)
+    parser.add_argument('-a','--archive_directory', help='The GCS directory'
+                        'where the raw data is archived in background. Expected with'
+                        'slash at the end. Default None, not archived.', required=False, default=None)
+    parser.add_argument('-wt','--wait_time_between_api_calls', help='Time'
+                        'to wait after the first error, doubled after each retry'
+                        'with random jitter. Measured in seconds.', required=False, default=5.0, type=float)
+    parser.add_argument('-rtr','--max_retries', help='The amount of retries'
+                        'after an error got from the API.', required=False, default=3, type=int)
+    parser.add_argument('-bc','--backoff_cap', help='The maximum time to'
+                        'wait between retries. Measured in seconds.', required=False, default=300.0, type=float)
+    parser.add_argument('-ct','--connect_timeout', help='The time to wait to'
+                        'connect to the API. Measured in seconds.', required=False, default=3.05, type=float)
+    parser.add_argument('-rt','--read_timeout', help='The time to wait'
+                        'between bytes of the API response. Measured in seconds.', required=False, default=30.0, type=float)
+    parser.add_argument('-dr','--device_registry', help='The path, local or'
+                        'GCS, of the device registry snapshot. Default None, no registry.',
+                        required=False, default=None)
+    parser.add_argument('-drd','--devices_refresh_days', help='The days the'
+                        'device registry is trusted before calling GetDevices again.'
+                        'Default 0, always called.', required=False, default=0, type=int)
+    parser.add_argument('-cl','--compresslevel', help='The GZIP compression'
+                        'level of the output, from 1 (fastest) to 9 (smallest).', required=False, default=9, type=int)
+    parser.add_argument('-w','--workers', help='The amount of processes'
+                        'compressing the output in parallel blocks.', required=False, default=1, type=int)
+    parser.add_argument('-of','--output_format', help='The format of the'
+                        'merged file, ndjson (GZIP), parquet or avro.', choices=list(EXTENSIONS),
+                        required=False, default='ndjson')
+    parser.add_argument('-nd','--no_dedup', help='Writes the merged messages'
+                        'in the order received, without sorting them by ID and datahora'
+                        'and dropping the duplicates.', required=False, action='store_true')
+    parser.add_argument('-msr','--max_sort_rows', help='The maximum merged'
+                        'messages sorted in memory, the rest are spilled to disk.',
+                        required=False, default=MAX_ROWS, type=int)
+    parser.add_argument('-jb','--json_backend', help='The encoder of the '
+                        'ndjson lines, json or orjson (faster, compact lines) when installed.',
+                        choices=list(BACKENDS), required=False, default='json')
+    parser.add_argument('-en','--enrich', help='Adds the track columns of each'
+                        'vessel, seconds since the previous ping, distance, implied speed'
+                        'and impossible jumps. Needs numpy.', required=False, action='store_true')
+    parser.add_argument('-msk','--max_speed_kmh', help='The highest plausible'
+                        'implied speed of the track, a faster one is an impossible jump.',
+                        required=False, default=MAX_SPEED_KMH, type=float)
+    parser.add_argument('-f','--force', help='Uploads the day even when its'
+                        'messages, devices and options did not change since the last run.',
+                        required=False, action='store_true')
+    parser.add_argument('-ep','--endpoint', help='The endpoint of the API,'
+                        'ex. a local pipe_vms_brazil.mock_api.', required=False, default=ENDPOINT)
+    parser.add_argument('-mt','--metrics', help='The path, local or GCS,'
+                        'where the JSON summary of the metrics is saved. Default'
+                        'None, only printed.', required=False, default=None)
+    parser.add_argument('-pf','--profile', help='Adds a cpu (cProfile) or'
+                        'memory (tracemalloc) profile to the metrics.', choices=list(metrics.PROFILES),
+                        required=False, default=None)
+    args = parser.parse_args(argv)
+    if args.enrich:
+        # Fails before processing anything when numpy is not installed.
+        try:
+            import_numpy()
+        except ImportError as error:
+            parser.error(str(error))
+    metrics.start('fetch_prepare', args.metrics, args.profile)
+    query_date = datetime.strptime(args.query_date, FORMAT_DT)
+    day = query_date.strftime(FORMAT_DT)
+    output_directory= args.output_directory
+    archive_directory= args.archive_directory
+
+    devices_file_path = f'{LOCAL_PATH}/devices/{day}.json.gz'
+    messages_file_path = f'{LOCAL_PATH}/messages/{day}.json.gz'
+    merged_file_path = f'{LOCAL_PATH}/{day}{EXTENSIONS[args.output_format]}'
+
+    start_time = time.time()
+
+    create_directory(f'{LOCAL_PATH}/devices')
+    create_directory(f'{LOCAL_PATH}/messages')
+
+    client = BrazilApiClient(args.endpoint, TOKEN, args.max_retries, args.wait_time_between_api_calls, args.backoff_cap,
+                             args.connect_timeout, args.read_timeout)
+    archiver = ThreadPoolExecutor(1)
+    archives = []
+
+    # Gets the devices.
+    registry = load_registry(args.device_registry) if args.device_registry else None
+    today = datetime.utcnow().date()
+    if registry is not None and registry.is_fresh(today, args.devices_refresh_days):
+        print(f'The device registry was checked on {registry.checked}, GetDevices skipped.')
+    else:
+        with metrics.stage('api_devices'):
+            fetched = client.get_devices(devices_file_path, stream=True)
+        if not fetched:
+            print('Can not get the Brazil devices.')
+            sys.exit(1)
+        if archive_directory:
+            archives.append(archiver.submit(upload, devices_file_path, f'{archive_directory}devices/'))
+        with gzip.open(devices_file_path, 'rb') as devices_content:
+            devices_list = list(iter_array(devices_content, 'devices'))
+        if registry is not None:
+            diff = registry.update(devices_list, today)
+            print('Devices without changes.' if diff is None else f'Devices changes applied to the registry {diff}.')
+            save_registry(registry, args.device_registry)
+    devices = registry.devices_at(query_date.date()) if registry is not None else index_devices(devices_list)
+
+    # Streams the messages through the join.
+    url = messages_url(f'{args.endpoint}/GetMessages/{TOKEN}', *day_windows(query_date, 1)[0])
+    with metrics.stage('stream_merge'):
+        merged = stream_merge(client, url, devices, merged_file_path, messages_file_path if archive_directory else None,
+                              args.output_format, args.compresslevel, args.workers, not args.no_dedup,
+                              args.max_sort_rows, args.json_backend, args.enrich, args.max_speed_kmh)
+    if not merged:
+        print('Can not get the Brazil data.')
+        sys.exit(1)
+    client.close()
+    if archive_directory:
+        archives.append(archiver.submit(upload, messages_file_path, f'{archive_directory}messages/'))
+
+    # Skips the upload when the day did not change since the last run.
+    with metrics.stage('manifest'):
+        manifest = manifest_path(output_directory, 'fetch_prepare', day)
+        inputs = dict(messages=merged, devices=content_hash(devices.values()))
+        options = dict(output_format=args.output_format, compresslevel=args.compresslevel, dedup=not args.no_dedup,
+                       json_backend=args.json_backend, enrich=args.enrich, max_speed_kmh=args.max_speed_kmh)
+        unchanged = not args.force and is_unchanged(load_manifest(manifest), inputs, options)
+    if unchanged:
+        print(f'The messages of {day} did not change since the last run, see <{manifest}>. Use --force to upload them again.')
+        metrics.count('days_skipped')
+    else:
+        # Saves to GCS while the raw files are archived.
+        with metrics.stage('upload'):
+            upload(merged_file_path, output_directory)
+        save_manifest(manifest, 'fetch_prepare', day, inputs,
+                      [f'{output_directory}{os.path.basename(merged_file_path)}'], options)
+    with metrics.stage('archive'):
+        for archive in archives:
+            archive.result()
+    archiver.shutdown()
+
+    rmtree(LOCAL_PATH)
+
+    ### ALL DONE
+    print("All done, you can find the output file here: {0}".format(output_directory))
+    print("Execution time {0} minutes".format((time.time()-start_time)/60))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Writes GZIP files compressing independent blocks in parallel.
+
+The content is split in blocks that are compressed on a process pool and
+written in order, each one as a GZIP member. A file with several members is a
+valid GZIP, `gzip -d` and the BigQuery loads decompress it as the
+concatenation of the members.
+
+The GZIP headers do not carry the time of writing, so the same content always
+gives the same bytes and checksum.
+"""
+
+from collections import deque
+
+from concurrent.futures import ProcessPoolExecutor
+
+import gzip, io
+
+
+BLOCK_SIZE = 4 << 20
+
+
+def compress(data, compresslevel=9):
+    """
+    Compresses a block as a GZIP member without the time of writing.
+    :param data: The content.
+    :type data: bytes
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :return: The GZIP member.
+    :rtype: bytes
+    """
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=compresslevel, mtime=0) as member:
+        member.write(data)
+    return output.getvalue()
+
+def open_gzip(path, mode='wt', compresslevel=9, workers=1, executor=None):
+    """
+    Opens a GZIP file to write text, or bytes with a binary mode.
+    :param path: The path of the file.
+    :type path: str
+    :param mode: The mode, wt to truncate or at to append. Default wt.
+    :type mode: str
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1, a plain
+    single member GZIP.
+    :type workers: int
+    :param executor: A shared process pool, instead of creating one per file.
+    Default None.
+    :type executor: concurrent.futures.Executor
+    :return: The file object.
+    """
+    if workers <= 1 and executor is None:
+        binary = gzip.GzipFile(path, mode.replace('t', '').replace('b', '') + 'b', compresslevel, mtime=0)
+        return binary if 'b' in mode else io.TextIOWrapper(binary, encoding='utf-8')
+    return ParallelGzipWriter(path, mode, compresslevel, workers, executor)
+
+
+class ParallelGzipWriter(object):
+    """File object compressing its content in blocks on a process pool."""
+
+    def __init__(self, path, mode='wt', compresslevel=9, workers=2, executor=None, block_size=BLOCK_SIZE):
+        """
+        Constructs the writer.
+
+        :param path: The path of the file.
+        :type path: str
+        :param mode: The mode, wt to truncate or at to append. Default wt.
+        :type mode: str
+        :param compresslevel: The GZIP compression level. Default 9.
+        :type compresslevel: int
+        :param workers: The amount of processes compressing. Default 2.
+        :type workers: int
+        :param executor: A shared process pool, it is not shut down when the
+        file is closed. Default None, a pool of workers is created.
+        :type executor: concurrent.futures.Executor
+        :param block_size: The size in bytes of each compressed block.
+        Default 4MiB.
+        :type block_size: int
+        """
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.max_pending = 2 * workers
+        self._owns_executor = executor is None
+        self._executor = ProcessPoolExecutor(workers) if executor is None else executor
+        self._append = mode.startswith('a')
+        self._file = open(path, 'ab' if self._append else 'wb')
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+
+    def write(self, data):
+        """
+        Writes text or bytes.
+        :param data: The content.
+        :type data: str or bytes
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            self._submit()
+
+    def _submit(self):
+        if self._buffered:
+            block = b''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._pending.append(self._executor.submit(compress, block, self.compresslevel))
+        while len(self._pending) > self.max_pending:
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        """Compresses the remaining content and closes the file."""
+        if self._file.closed:
+            return
+        try:
+            self._submit()
+            while self._pending:
+                self._file.write(self._pending.popleft().result())
+            # An empty file is not a valid GZIP, an empty member is.
+            if not self._append and not self._file.tell():
+                self._file.write(compress(b'', self.compresslevel))
+        finally:
+            self._file.close()
+            if self._owns_executor:
+                self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -12,15 +12,31 @@ Ex.
 python -m pipe_vms_brazil.historical_data -d 2012 -i ./downloads/output -o gs://vms-gfw/brazil/historical/v20210321/2012/
 """
 
-from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
-from google.cloud import storage
+from datetime import date, datetime, timedelta
 
 from shutil import rmtree
 
-from pathlib import Path
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.dedup import ExternalSorter
+
+from pipe_vms_brazil.gzip_writer import open_gzip
+
+from pipe_vms_brazil.join import UnmatchedCounter, index_devices, join_messages
+
+from pipe_vms_brazil.json_stream import iter_array
 
-import argparse, gzip, json, os, re, time, sys
+from pipe_vms_brazil.ndjson import BACKENDS, NdjsonEncoder
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+from pipe_vms_brazil.partition_writer import PartitionWriter, PARTITIONS
+
+from pipe_vms_brazil.storage import upload
+
+import argparse, gzip, json, os, time, sys
 
 
 # FORMATS
@@ -31,6 +47,16 @@ LOCAL_MERGER_PATH = "prepare_data"
 
 PROJECT_ID = "world-fishing-827"
 
+# The shards of the out-of-core mode, inside the year folder.
+SHARDS_FOLDER = "_shards"
+
+# The memory of a message buffered or sorted, a RecordBatch row and its sort key plus
+# the overhead of the allocator.
+BYTES_PER_ROW = 400
+
+# The default memory of the split of a year, in MiB.
+MEMORY_BUDGET_MB = 1024
+
 
 def create_directory(name):
     """
@@ -41,30 +67,204 @@ def create_directory(name):
     if not os.path.exists(name):
         os.makedirs(name)
 
-def gcs_transfer(pattern_file, gcs_path):
-    """
-    Uploads the files from file system to a GCS destination.
-    :param pattern_file: The pattern file without wildcard.
-    :type pattern_file: str
-    :param gcs_path: The absolute path of GCS.
-    :type gcs_path: str
-    """
-    storage_client = storage.Client(PROJECT_ID)
-    gcs_search = re.search('gs://([^/]*)/(.*)', gcs_path)
-    bucket = storage_client.bucket(gcs_search.group(1))
-    pattern_path = Path(pattern_file)
-    for filename in pattern_path.parent.glob(pattern_path.name + '*'):
-        blob = bucket.blob(gcs_search.group(2) + filename.name)
-        blob.upload_from_filename(filename)
-        print("File from file system <{}> uploaded to <{}>.".format(filename, gcs_path))
-
 def daterange(start, end):
     for n in range(int((end - start).days)):
         yield start + timedelta(n)
 
+def merge_shard(shard_path, output_path, max_sort_rows, compresslevel=9, workers=1, executor=None,
+                json_backend='json'):
+    """
+    Writes a shard sorted by ID and datahora, without duplicates.
+    :param shard_path: The local path of the shard, NEWLINEJSON GZIP.
+    :type shard_path: str
+    :param output_path: The local path of the partition file.
+    :type output_path: str
+    :param max_sort_rows: The maximum rows sorted in memory.
+    :type max_sort_rows: int
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :param executor: The process pool compressing, shared between shards.
+    Default None.
+    :type executor: ProcessPoolExecutor
+    :param json_backend: The encoder of the lines, json or orjson. Default
+    json.
+    :type json_backend: str
+    :return: The amount of messages written and of duplicates dropped.
+    :rtype: tuple
+    """
+    sorter = ExternalSorter(max_sort_rows, os.path.dirname(shard_path))
+    total = 0
+    with gzip.open(shard_path, 'rt') as shard, open_gzip(output_path, 'wb', compresslevel, workers, executor) as output:
+        encoder = NdjsonEncoder(output, json_backend)
+        for message in sorter.sort_unique(json.loads(line) for line in shard):
+            encoder.write(message)
+            total += 1
+        encoder.flush()
+    return total, sorter.duplicates
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Merges the data comming from'
+def split_year(year, input_directory, first_day=None, last_day=None, skip_days=(), partition_by='day',
+               compresslevel=9, workers=1, max_open_files=32, memory_budget_mb=MEMORY_BUDGET_MB, json_backend='json',
+               year_path=None):
+    """
+    Splits the messages of a year in the GZIP files of their days, adding the
+    info of their devices in a single pass.
+    :param year: The year to split.
+    :type year: int
+    :param input_directory: The local directory with the Devices.txt and the
+    <year>.json files.
+    :type input_directory: str
+    :param first_day: The first day to keep, inclusive. Default None, Jan 1.
+    :type first_day: date
+    :param last_day: The last day to keep, inclusive. Default None, Dec 31.
+    :type last_day: date
+    :param skip_days: The days, YYYY-mm-dd, not written. Default none.
+    :type skip_days: set
+    :param partition_by: The partition of the files, day or hour. Default day.
+    :type partition_by: str
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :param max_open_files: The maximum of GZIP files opened at the same time.
+    Default 32.
+    :type max_open_files: int
+    :param memory_budget_mb: Splits the year out of core, in MiB. The
+    messages are spilled to a shard per partition on local disk, then each
+    shard is sorted by ID and datahora without duplicates, in memory up to
+    the budget. Default 1024. None keeps all the messages of the year in
+    memory and sorts each partition the same way, with the same output.
+    :type memory_budget_mb: int
+    :param json_backend: The encoder of the lines, json or orjson. Default
+    json.
+    :type json_backend: str
+    :param year_path: The local directory of the day files, one per range
+    of days split at the same time. Default None, <input_directory>/<year>.
+    :type year_path: str
+    :return: The local directory of the day files and the amount of messages
+    of each day written, including the empty ones.
+    :rtype: tuple
+    """
+    first_day = (first_day or date(year,1,1)).strftime('%Y-%m-%d')
+    last_day = (last_day or date(year,12,31)).strftime('%Y-%m-%d')
+    devices_file_path = f'{input_directory}/Devices.txt'
+    messages_file_path = f'{input_directory}/{year}.json'
+
+    # Reads the JSON files.
+    print(f'Reads the original JSON files <{devices_file_path},{messages_file_path}>')
+    with open(devices_file_path,'r') as devices_original:
+        devices = index_devices(iter_array(devices_original, 'devices'))
+
+    # Per each message will add the info of its device and route it to the
+    # GZIP of its day in a single pass.
+    print(f'Run the year {year}, routing each message to the GZIP of its day.')
+    year_path = year_path or f'{input_directory}/{year}'
+    create_directory(year_path)
+    timestamps=TimestampConverter()
+    total_merged=0
+    daily_counts={}
+    if memory_budget_mb:
+        # Half of the budget buffers the shards, half sorts each of them.
+        budget_rows = max(1000, (memory_budget_mb << 20) // 2 // BYTES_PER_ROW)
+        unmatched = UnmatchedCounter()
+        writer = PartitionWriter(f'{year_path}/{SHARDS_FOLDER}', partition_by=partition_by,
+                                 max_open_files=max_open_files, compresslevel=1, buffer_rows=budget_rows,
+                                 json_backend=json_backend)
+        create_directory(writer.directory)
+    else:
+        unmatched = []
+        writer = PartitionWriter(year_path, partition_by=partition_by, max_open_files=max_open_files,
+                                 compresslevel=compresslevel, workers=workers, json_backend=json_backend,
+                                 sort_unique=True)
+    with metrics.stage('split'), open(messages_file_path,'r') as messages_original, writer:
+        for message in join_messages(devices, iter_array(messages_original, 'mensagens'), unmatched, timestamps):
+            total_merged += 1
+            day = message['datahora'][:10]
+            if first_day <= day <= last_day and day not in skip_days:
+                writer.write(message)
+                daily_counts[day] = daily_counts.get(day, 0) + 1
+    print(f'Total of devices read {len(devices)}')
+    print(f'Total of messages read {total_merged + len(unmatched) + timestamps.malformed}')
+    print(f'Total of merged results  {total_merged}')
+    print(f'Total of messages without a known device {len(unmatched)}')
+    print(f'Total of messages with a malformed datahora {timestamps.malformed}, samples {timestamps.malformed_samples}')
+    metrics.count('devices', len(devices))
+    metrics.count('messages_in', total_merged + len(unmatched) + timestamps.malformed)
+    metrics.count('unmatched', len(unmatched))
+    metrics.count('malformed', timestamps.malformed)
+
+    daily_counts = {day: 0 for day in daily_counts}
+    if memory_budget_mb:
+        print(f'Sorts the {len(writer.counts)} shards of the year without duplicates.')
+        duplicates = 0
+        executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            with metrics.stage('merge_shards'):
+                for key in sorted(writer.counts):
+                    shard_path = writer.path(key)
+                    total, shard_duplicates = merge_shard(shard_path, f'{year_path}/{key}.json.gz', budget_rows,
+                                                          compresslevel, workers, executor, json_backend)
+                    os.remove(shard_path)
+                    daily_counts[key[:10]] += total
+                    duplicates += shard_duplicates
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        rmtree(writer.directory, ignore_errors=True)
+    else:
+        for key, total in writer.counts.items():
+            daily_counts[key[:10]] += total
+        duplicates = writer.duplicates
+    print(f'Total of duplicated messages dropped {duplicates}')
+    metrics.count('duplicates', duplicates)
+    metrics.count('rows_out', sum(daily_counts.values()))
+
+    # The days without messages are written empty.
+    for single_day in daterange(date.fromisoformat(first_day), date.fromisoformat(last_day) + timedelta(1)):
+        single_day_formated = single_day.strftime('%Y-%m-%d')
+        if single_day_formated in skip_days:
+            continue
+        if single_day_formated not in daily_counts:
+            daily_counts[single_day_formated] = 0
+            if partition_by == 'day':
+                open_gzip(f'{year_path}/{single_day_formated}.json.gz', 'wb', compresslevel).close()
+    return year_path, daily_counts
+
+def upload_day(year_path, day, output_directory, project=PROJECT_ID, remove=False):
+    """
+    Uploads the files of a day, one per day or one per hour.
+    :param year_path: The local directory of the day files.
+    :type year_path: str
+    :param day: The day, YYYY-mm-dd.
+    :type day: str
+    :param output_directory: The directory where to upload them, gs://,
+    file:// or local. Expected with slash at the end.
+    :type output_directory: str
+    :param project: The GCP project. Default world-fishing-827.
+    :type project: str
+    :param remove: If the local files are removed once uploaded. Default False.
+    :type remove: bool
+    :return: The local files uploaded.
+    :rtype: list
+    """
+    filenames = upload(f'{year_path}/{day}', output_directory, project)
+    if remove:
+        for filename in filenames:
+            os.remove(filename)
+    return filenames
+
+
+def main(argv=None, prog=None):
+    """
+    Splits a historical year by day, as the historical command.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    :param prog: The name of the command in the usage. Default None, the
+    module.
+    :type prog: str
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Merges the data comming from'
                                      'devices and messages and generate a new'
                                      'GZIP to compress.')
     parser.add_argument('-d','--query_date', help='The date to be queried. Expects a str in format YYYY-MM-DD',
@@ -77,70 +277,61 @@ if __name__ == '__main__':
                         'the end.', required=True)
     parser.add_argument('-x','--date_stop', help='The date to stop the'
                         'iteration for years. Date inclusive.', default=None, required=False)
-    args = parser.parse_args()
+    parser.add_argument('-p','--partition_by', help='The partition of the'
+                        'output files, day or hour.', choices=list(PARTITIONS), default='day', required=False)
+    parser.add_argument('-cl','--compresslevel', help='The GZIP compression'
+                        'level of the output, from 1 (fastest) to 9 (smallest).', required=False, default=9, type=int)
+    parser.add_argument('-w','--workers', help='The amount of processes'
+                        'compressing the output in parallel blocks.', required=False, default=1, type=int)
+    parser.add_argument('-mb','--memory_budget_mb', help='Splits the year'
+                        'out of core within this memory, in MiB, through a shard per day on'
+                        'local disk sorted without duplicates.',
+                        required=False, default=MEMORY_BUDGET_MB, type=int)
+    parser.add_argument('-im','--in_memory', help='Sorts the year in memory'
+                        'instead, faster but the memory grows with the messages of the year.',
+                        required=False, action='store_true')
+    parser.add_argument('-jb','--json_backend', help='The encoder of the '
+                        'ndjson lines, json or orjson (faster, compact lines) when installed.',
+                        choices=list(BACKENDS), required=False, default='json')
+    parser.add_argument('-mt','--metrics', help='The path, local or GCS,'
+                        'where the JSON summary of the metrics is saved. Default'
+                        'None, only printed.', required=False, default=None)
+    parser.add_argument('-pf','--profile', help='Adds a cpu (cProfile) or'
+                        'memory (tracemalloc) profile to the metrics.', choices=list(metrics.PROFILES),
+                        required=False, default=None)
+    args = parser.parse_args(argv)
+    metrics.start('historical_data', args.metrics, args.profile)
     query_date = datetime.strptime(args.query_date, FORMAT_DT)
     input_directory= args.input_directory
     LOCAL_MERGER_PATH= args.input_directory
     DATE_TO_CUT= args.date_stop
     output_directory= args.output_directory
 
-    devices_file_path = f'{LOCAL_MERGER_PATH}/Devices.txt'
-    messages_file_path = f'{LOCAL_MERGER_PATH}/{query_date.strftime(FORMAT_DT)}.json'
-
     start_time = time.time()
 
-    # Decompresses the GZIP.
-    print(f'Decompresses the original GZIP files <{devices_file_path},{messages_file_path}>')
-    devices=[]
-    messages=[]
-    with open(devices_file_path,'r') as devices_original:
-        content = json.loads(devices_original.read())
-        for device in content['devices']:
-            devices.append(device)
-
-    with open(messages_file_path,'r') as messages_original:
-        content = json.loads(messages_original.read())
-        for message in content['mensagens']:
-            messages.append(message)
-
-    # Per each device ID will list all the messages ID.
-    merge=[]
-    for device in devices:
-        merge += [dict(ID=message['ID'], curso=message['curso'],
-                       datahora=datetime.strptime(message['datahora'],'%d-%m-%Y %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S'),
-                       lat=message['lat'], lon=message['lon'], mID=message['mID'], speed=message['speed'],
-                       codMarinha=device['codMarinha'], nome=device['nome'])
-                  for message in messages
-                  if message['ID'] == device['ID']]
-        print(f'== device {device["ID"]} DONE.')
-    print(f'Total of devices read {len(devices)}')
-    print(f'Total of messages read {len(messages)}')
-    print(f'Total of merged results  {len(merge)}')
+    last_day = date.fromisoformat(DATE_TO_CUT) if DATE_TO_CUT != None else None
+    year_path, daily_counts = split_year(query_date.year, LOCAL_MERGER_PATH, last_day=last_day,
+                                         partition_by=args.partition_by, compresslevel=args.compresslevel,
+                                         workers=args.workers,
+                                         memory_budget_mb=None if args.in_memory else args.memory_budget_mb,
+                                         json_backend=args.json_backend)
 
-    # Compress
-    print(f'Run the whole year, day by day and compress each day result with GZIP.')
-    create_directory(f'{LOCAL_MERGER_PATH}/{query_date.year}')
     acum=0
-    for single_day in daterange(date(query_date.year,1,1),date(query_date.year+1,1,1)):
-        single_day_formated = single_day.strftime('%Y-%m-%d')
-        merged_file_path = f'{LOCAL_MERGER_PATH}/{query_date.year}/{single_day_formated}.json.gz'
-
-        daily_msg = [msg for msg in merge if msg['datahora'].startswith(single_day_formated)]
-        acum += len(daily_msg)
-        print(f'Day {single_day_formated} amount of messages {len(daily_msg)}, output: {merged_file_path}')
-        with gzip.open(merged_file_path,'wt', compresslevel=9) as merged:
-            for message in daily_msg:
-                json.dump(message, merged)
-                merged.write("\n")
-        if DATE_TO_CUT != None and single_day_formated == DATE_TO_CUT:
-            break
-
-        # Saves to GCS
-        gcs_transfer(merged_file_path, output_directory)
-
-    print(f'Total of merged results  {len(merge)} vs daily messages acum  {acum}')
+    for single_day_formated in sorted(daily_counts):
+        acum += daily_counts[single_day_formated]
+        print(f'Day {single_day_formated} amount of messages {daily_counts[single_day_formated]}, output: {year_path}/{single_day_formated}')
+
+        # Saves to GCS, the DATE_TO_CUT included.
+        with metrics.stage('upload'):
+            upload_day(year_path, single_day_formated, output_directory)
+
+    print(f'Total of daily messages acum  {acum}')
     # rmtree(LOCAL_MERGER_PATH)
 
     ### ALL DONE
     print("All done, you can find the output file here: {0}".format(output_directory))
     print("Execution time {0} minutes".format((time.time()-start_time)/60))
+
+
+if __name__ == '__main__':
+    main()
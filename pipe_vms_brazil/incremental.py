@@ -0,0 +1,187 @@
+"""
+Incremental fetch of the Brazil messages.
+
+Instead of requesting the whole day once, the messages are polled several
+times a day since a persisted watermark, the last `datahora` and the highest
+`mID` seen. Only the messages with a higher `mID` are kept, as the API
+assigns them increasingly when it receives them, and they are saved as small
+delta files per day of their `datahora`:
+
+    <output_directory>messages_deltas/<day>/<poll>.json.gz
+
+The window of each poll starts some minutes before the watermark, so the
+messages received late are not lost. The daily prepare compacts the deltas of
+the day in the usual `messages/<day>.json.gz`, without duplicates.
+"""
+
+from datetime import datetime, timedelta
+
+from pipe_vms_brazil.json_stream import iter_array
+
+from pipe_vms_brazil.storage import download, exists, upload_file
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+import gzip, json, os, tempfile
+
+
+DELTAS_FOLDER = 'messages_deltas'
+WATERMARK_FILE = '_watermark.json'
+
+FORMAT_DT = '%Y-%m-%d'
+FORMAT_TS = '%Y-%m-%dT%H:%M:%S'
+FORMAT_POLL = '%Y%m%dT%H%M%S'
+
+
+def deltas_directory(directory, day=None):
+    """
+    The directory of the deltas.
+    :param directory: The directory of the raw data, expected with slash at
+    the end.
+    :type directory: str
+    :param day: The day, YYYY-mm-dd. Default None, the root of the deltas.
+    :type day: str
+    :return: The directory, with slash at the end.
+    :rtype: str
+    """
+    return f'{directory}{DELTAS_FOLDER}/' + (f'{day}/' if day else '')
+
+def load_watermark(path):
+    """
+    Loads the watermark.
+    :param path: The path of the watermark, gs://, file:// or local.
+    :type path: str
+    :return: The last datahora, YYYY-mm-ddTHH:MM:SS, and mID seen, None if
+    it does not exist yet.
+    :rtype: dict
+    """
+    if not exists(path):
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, WATERMARK_FILE)
+        download(path, local_path)
+        with open(local_path, 'r') as watermark:
+            return json.load(watermark)
+
+def save_watermark(path, watermark):
+    """
+    Saves the watermark.
+    :param path: The path of the watermark, gs://, file:// or local.
+    :type path: str
+    :param watermark: The watermark, see load_watermark.
+    :type watermark: dict
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, WATERMARK_FILE)
+        with open(local_path, 'w') as output:
+            json.dump(watermark, output)
+        upload_file(local_path, path)
+
+def poll_window(watermark, now, overlap=timedelta(minutes=10)):
+    """
+    The window to request since the watermark.
+    :param watermark: The watermark or None on the first poll.
+    :type watermark: dict
+    :param now: The end of the window.
+    :type now: datetime
+    :param overlap: The time requested again before the watermark. Default
+    10 minutes.
+    :type overlap: timedelta
+    :return: The start and end, both inclusive. The first poll starts at the
+    midnight of now.
+    :rtype: tuple
+    """
+    end = now.replace(microsecond=0)
+    if watermark is None:
+        return datetime(end.year, end.month, end.day), end
+    return min(datetime.strptime(watermark['datahora'], FORMAT_TS) - overlap, end), end
+
+def split_deltas(messages_file_path, watermark, end, local_directory, poll):
+    """
+    Writes the messages newer than the watermark in a delta file per day.
+    :param messages_file_path: The GZIP with the messages of the window.
+    :type messages_file_path: str
+    :param watermark: The watermark or None on the first poll.
+    :type watermark: dict
+    :param end: The end of the window. The watermark datahora is not moved
+    after it.
+    :type end: datetime
+    :param local_directory: The local directory where to write the deltas,
+    <day>/<poll>.json.gz.
+    :type local_directory: str
+    :param poll: The name of the delta files.
+    :type poll: str
+    :return: The path and amount of messages of the delta of each day, and the
+    new watermark.
+    :rtype: tuple
+    """
+    last_mid = watermark['mID'] if watermark else None
+    last_datahora = watermark['datahora'] if watermark else None
+    max_mid, max_datahora = last_mid, last_datahora
+    end_datahora = end.strftime(FORMAT_TS)
+    timestamps = TimestampConverter()
+    deltas, files = {}, {}
+    try:
+        with gzip.open(messages_file_path, 'rb') as messages:
+            for message in iter_array(messages, 'mensagens'):
+                mid = message.get('mID')
+                has_mid = isinstance(mid, int) and not isinstance(mid, bool)
+                if has_mid and last_mid is not None and mid <= last_mid:
+                    continue
+                datahora = timestamps.to_datahora(message.get('datahora'))
+                # The malformed ones go with the day of the poll, the prepare reports them.
+                day = datahora[:10] if datahora else end.strftime(FORMAT_DT)
+                delta = files.get(day)
+                if delta is None:
+                    path = os.path.join(local_directory, day, f'{poll}.json.gz')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    delta = files[day] = gzip.open(path, 'wt', compresslevel=9)
+                    delta.write('{"mensagens": [')
+                    deltas[day] = [path, 0]
+                elif deltas[day][1]:
+                    delta.write(', ')
+                json.dump(message, delta)
+                deltas[day][1] += 1
+                if has_mid and (max_mid is None or mid > max_mid):
+                    max_mid = mid
+                if datahora:
+                    datahora = datahora.replace(' ', 'T')
+                    if datahora <= end_datahora and (max_datahora is None or datahora > max_datahora):
+                        max_datahora = datahora
+    finally:
+        for delta in files.values():
+            delta.write(']}')
+            delta.close()
+    new_watermark = dict(datahora=max_datahora or end_datahora, mID=max_mid, polled=end_datahora)
+    return {day: tuple(delta) for day, delta in deltas.items()}, new_watermark
+
+def compact_deltas(delta_paths, messages_file_path):
+    """
+    Compacts the deltas of a day in a single messages file, without
+    duplicated mID.
+    :param delta_paths: The local paths of the deltas, in the order polled.
+    :type delta_paths: list of str
+    :param messages_file_path: The local path of the GZIP of the day.
+    :type messages_file_path: str
+    :return: The amount of messages and of duplicates discarded.
+    :rtype: tuple
+    """
+    seen = set()
+    total = duplicates = 0
+    with gzip.open(messages_file_path, 'wt', compresslevel=9) as output:
+        output.write('{"mensagens": [')
+        for delta_path in delta_paths:
+            with gzip.open(delta_path, 'rb') as delta:
+                for message in iter_array(delta, 'mensagens'):
+                    mid = message.get('mID')
+                    if isinstance(mid, int) and not isinstance(mid, bool):
+                        if mid in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(mid)
+                    if total:
+                        output.write(', ')
+                    json.dump(message, output)
+                    total += 1
+        output.write(']}')
+    return total, duplicates
@@ -0,0 +1,94 @@
+"""
+Joins the Brazil devices with their messages.
+
+The devices are indexed by ID once and the messages are streamed through the
+index in a single pass, so the cost is linear in the amount of messages
+instead of devices x messages.
+"""
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+
+class UnmatchedCounter(object):
+    """
+    Side output of join_messages counting the unmatched messages and keeping
+    only some samples, so they do not grow the memory.
+    """
+
+    def __init__(self, max_samples=10):
+        """
+        Constructs the counter.
+
+        :param max_samples: The amount of messages kept as samples. Default 10.
+        :type max_samples: int
+        """
+        self.max_samples = max_samples
+        self.samples = []
+        self._count = 0
+
+    def append(self, message):
+        self._count += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append(message)
+
+    def __len__(self):
+        return self._count
+
+
+def index_devices(devices):
+    """
+    Indexes the devices by their ID.
+    :param devices: The devices as they come from the API.
+    :type devices: iterable of dict
+    :return: The devices keyed by ID.
+    :rtype: dict
+    """
+    index = {}
+    for device in devices:
+        index.setdefault(device['ID'], device)
+    return index
+
+def merge_message(message, device, datahora):
+    """
+    Builds the merged row of a message with the info of its device.
+    :param message: The message as it comes from the API.
+    :type message: dict
+    :param device: The device that sent the message.
+    :type device: dict
+    :param datahora: The datahora of the message already normalised.
+    :type datahora: str
+    :return: The merged row.
+    :rtype: dict
+    """
+    return dict(ID=message['ID'], curso=message['curso'], datahora=datahora,
+                lat=message['lat'], lon=message['lon'], mID=message['mID'], speed=message['speed'],
+                codMarinha=device['codMarinha'], nome=device['nome'])
+
+def join_messages(devices_index, messages, unmatched=None, timestamps=None):
+    """
+    Streams the messages through the devices index and yields the merged rows.
+    :param devices_index: The devices keyed by ID, see index_devices.
+    :type devices_index: dict
+    :param messages: The messages as they come from the API.
+    :type messages: iterable of dict
+    :param unmatched: Side output where to append the messages whose device
+    is unknown. Default None, those messages are discarded.
+    :type unmatched: list
+    :param timestamps: The converter of the datahora, where the messages with
+    a malformed datahora are reported and skipped. Default None, a new one.
+    :type timestamps: TimestampConverter
+    :return: The merged rows, in the order of the messages.
+    :rtype: generator of dict
+    """
+    if timestamps is None:
+        timestamps = TimestampConverter()
+    for message in messages:
+        device = devices_index.get(message['ID'])
+        if device is None:
+            if unmatched is not None:
+                unmatched.append(message)
+            continue
+        datahora = timestamps.to_datahora(message['datahora'])
+        if datahora is None:
+            continue
+        yield merge_message(message, device, datahora)
@@ -0,0 +1,209 @@
+"""
+Incremental parser for the Brazil API payloads.
+
+The payloads are a single JSON object holding big arrays, like
+`{"devices": [...]}` or `{"mensagens": [...]}`. Instead of loading the whole
+document, the file is read in chunks and the elements of the requested array
+are decoded and yielded one at a time, so memory stays flat no matter the size
+of the input.
+"""
+
+import codecs, json, re
+
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader(object):
+    """Keeps a text buffer over a file object and decodes values from it."""
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def fill(self):
+        """
+        Reads more content from the file. Reads at least as much as it is
+        already buffered, so values bigger than a chunk are retried a
+        logarithmic amount of times.
+        :return: False if the file is exhausted.
+        :rtype: bool
+        """
+        if self.eof:
+            return False
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.fileobj.read(max(self.chunk_size, len(self.buffer)))
+        if not chunk:
+            self.eof = True
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character without consuming it.
+        :return: The next character or None at the end of the file.
+        :rtype: str
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        """
+        Consumes the next character, that must be the given one.
+        :param char: The expected character.
+        :type char: str
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Malformed JSON, expected <{char}> but found <{found}> at offset {self.pos}.')
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the next JSON value.
+        :return: The decoded value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer could continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_array(fileobj, key, chunk_size=CHUNK_SIZE):
+    """
+    Yields the elements of an array of the top level JSON object.
+    :param fileobj: The file opened in text or binary mode.
+    :type fileobj: file object
+    :param key: The key of the array, ex. devices or mensagens.
+    :type key: str
+    :param chunk_size: The amount of characters to read each time.
+    :type chunk_size: int
+    :return: The elements of the array.
+    :rtype: generator
+    :raise: A KeyError if the object has no such key.
+    """
+    reader = _Reader(fileobj, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        raise KeyError(key)
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key:
+            reader.expect('[')
+            if reader.peek() == ']':
+                return
+            while True:
+                yield reader.value()
+                if reader.peek() == ']':
+                    return
+                reader.expect(',')
+        reader.value()
+        if reader.peek() == '}':
+            raise KeyError(key)
+        reader.expect(',')
+
+
+_STRUCTURE = re.compile(rb'[{}\[\]"]')
+_STRING_END = re.compile(rb'["\\]')
+_CLOSING = {ord('}'): ord('{'), ord(']'): ord('[')}
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+_WHITESPACE_BYTES = b' \t\n\r'
+
+
+class JsonChecker(object):
+    """
+    Checks incrementally that a JSON document is well-formed in its structure,
+    balanced brackets and closed strings, without decoding it. Counts the
+    bytes and the records, the elements of the arrays of the top level object.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.records = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self._ended = False
+
+    def feed(self, chunk):
+        """
+        Checks the next chunk of the document.
+        :param chunk: The next bytes of the document.
+        :type chunk: bytes
+        :raise: A ValueError if the document is malformed.
+        """
+        self.size += len(chunk)
+        pos = 0
+        end = len(chunk)
+        while pos < end:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    pos += 1
+                    continue
+                found = _STRING_END.search(chunk, pos)
+                if found is None:
+                    return
+                pos = found.end()
+                if chunk[found.start()] == _BACKSLASH:
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                continue
+            found = _STRUCTURE.search(chunk, pos)
+            if self._ended and chunk[pos:end if found is None else found.start()].strip(_WHITESPACE_BYTES):
+                raise ValueError(f'Malformed JSON, content after the end of the document at byte {self.size - end + pos}.')
+            if found is None:
+                return
+            char = chunk[found.start()]
+            pos = found.end()
+            if self._ended:
+                raise ValueError(f'Malformed JSON, content after the end of the document at byte {self.size - end + pos}.')
+            if char == _QUOTE:
+                self._in_string = True
+            elif char in _CLOSING:
+                if not self._stack or self._stack.pop() != _CLOSING[char]:
+                    raise ValueError(f'Malformed JSON, unbalanced <{chr(char)}> at byte {self.size - end + pos}.')
+                self._ended = not self._stack
+            else:
+                if len(self._stack) == 2 and self._stack[1] == ord('['):
+                    self.records += 1
+                self._stack.append(char)
+                self._started = True
+
+    def close(self):
+        """
+        Checks that the document is complete.
+        :raise: A ValueError if the document is truncated.
+        """
+        if not self._started or self._stack or self._in_string:
+            raise ValueError(f'Malformed JSON, truncated document after {self.size} bytes.')
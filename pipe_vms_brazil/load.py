@@ -0,0 +1,146 @@
+"""
+Loads the prepared files of a date range to BigQuery.
+
+Runs the `gcs2bq.sh` asset for each day of the range in the same container, a
+few days at the same time, so a backfill pays the start of a single pod
+instead of one per day. Each day keeps the checks of the script, it is
+skipped when its prepared file did not change since its last load.
+
+Ex.
+python -m pipe_vms_brazil.load -d 2021-01-01 -de 2021-01-31 -i gs://bucket/brazil/merged -t project:dataset.table -P 4
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from datetime import datetime
+
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.assets import LOAD_SCRIPT, asset_path
+
+from pipe_vms_brazil.output import EXTENSIONS
+
+from pipe_vms_brazil.prepares_data import FORMAT_DT, day_range
+
+import argparse, subprocess, sys, threading, time
+
+
+_print_lock = threading.Lock()
+
+
+def load_day(query_date, gcs_path, table, output_format=None, force=False):
+    """
+    Loads the prepared file of a day to its partition.
+    :param query_date: The day.
+    :type query_date: datetime
+    :param gcs_path: The GCS directory of the prepared files, without slash
+    at the end.
+    :type gcs_path: str
+    :param table: The table, project:dataset.table.
+    :type table: str
+    :param output_format: The format of the prepared file, ndjson, parquet or
+    avro. Default None, detected from GCS.
+    :type output_format: str
+    :param force: Loads the day even when it did not change. Default False.
+    :type force: bool
+    :return: The exit code of the load, 0 when it succeeded.
+    :rtype: int
+    """
+    day = query_date.strftime(FORMAT_DT)
+    start = time.perf_counter()
+    # Run with bash, the package data may not keep the executable bit.
+    with asset_path(LOAD_SCRIPT) as script:
+        arguments = ['bash', str(script), day, gcs_path, table, output_format or ''] + (['force'] if force else [])
+        process = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    metrics.add_time('load', time.perf_counter() - start)
+    # The output of each day together, not mixed with the other days.
+    with _print_lock:
+        for line in process.stdout.splitlines():
+            print(f'[{day}] {line}')
+    return process.returncode
+
+def load_days(days, gcs_path, table, output_format=None, force=False, parallel_days=1):
+    """
+    Loads the prepared files of several days.
+    :param days: The days.
+    :type days: list of datetime
+    :param gcs_path: The GCS directory of the prepared files.
+    :type gcs_path: str
+    :param table: The table, project:dataset.table.
+    :type table: str
+    :param output_format: The format of the prepared files. Default None,
+    detected from GCS.
+    :type output_format: str
+    :param force: Loads the days even when they did not change. Default False.
+    :type force: bool
+    :param parallel_days: The amount of days loaded at the same time.
+    Default 1.
+    :type parallel_days: int
+    :return: The days that failed, with their exit code.
+    :rtype: dict
+    """
+    failed = {}
+    with ThreadPoolExecutor(max(1, parallel_days)) as executor:
+        results = [(query_date, executor.submit(load_day, query_date, gcs_path, table, output_format, force))
+                   for query_date in days]
+        for query_date, result in results:
+            code = result.result()
+            if code:
+                failed[query_date.strftime(FORMAT_DT)] = code
+            else:
+                metrics.count('days_loaded')
+    return failed
+
+
+def main(argv=None, prog=None):
+    """
+    Loads the days to BigQuery, as the load command.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    :param prog: The name of the command in the usage. Default None, the
+    module.
+    :type prog: str
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Loads the prepared files'
+                                     'of a date range to the partitions of'
+                                     'the BigQuery table.')
+    parser.add_argument('-d','--query_date', help='The first date to be'
+                        'loaded. Expects a str in format YYYY-MM-DD', required=True)
+    parser.add_argument('-de','--date_end', help='The last date to be'
+                        'loaded, inclusive. Expects a str in format YYYY-MM-DD.'
+                        'Default None, only the query_date.', required=False, default=None)
+    parser.add_argument('-i','--input_directory', help='The GCS directory'
+                        'of the prepared files, without slash at the end.', required=True)
+    parser.add_argument('-t','--table', help='The BigQuery table,'
+                        'project:dataset.table.', required=True)
+    parser.add_argument('-of','--output_format', help='The format of the'
+                        'prepared files, ndjson, parquet or avro. Default detected from GCS.',
+                        choices=list(EXTENSIONS), required=False, default=None)
+    parser.add_argument('-P','--parallel_days', help='The amount of days'
+                        'loaded at the same time.', required=False, default=1, type=int)
+    parser.add_argument('-f','--force', help='Loads the days even when their'
+                        'prepared file did not change since the last load.',
+                        required=False, action='store_true')
+    parser.add_argument('-mt','--metrics', help='The path, local or GCS,'
+                        'where the JSON summary of the metrics is saved. Default'
+                        'None, only printed.', required=False, default=None)
+    args = parser.parse_args(argv)
+    metrics.start('load', args.metrics)
+    query_date = datetime.strptime(args.query_date, FORMAT_DT)
+    date_end = datetime.strptime(args.date_end, FORMAT_DT) if args.date_end else None
+
+    start_time = time.time()
+
+    failed = load_days(day_range(query_date, date_end), args.input_directory.rstrip('/'), args.table,
+                       args.output_format, args.force, args.parallel_days)
+    if failed:
+        print(f'{len(failed)} days failed, run them again: {failed}')
+        sys.exit(1)
+
+    ### ALL DONE
+    print("All done, the days are loaded in: {0}".format(args.table))
+    print("Execution time {0} minutes".format((time.time()-start_time)/60))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+Metrics of the pipeline steps.
+
+Each step times its stages (API, GCS, parse, join, write...) and counts what
+it processes (messages, rows, bytes, retries, unmatched...) in the module
+level metrics, which are safe to update from several threads. When the step
+exits a JSON summary is printed in a single line starting with `METRICS` and
+optionally saved to a file, local or GCS, so the throughput and the memory of
+the runs can be monitored.
+
+A profile can be added to the summary, `cpu` runs the step under cProfile and
+`memory` under tracemalloc.
+
+Ex.
+metrics.start('prepares_data', 'gs://bucket/metrics/prepares_data/2021-02-25.json', profile='memory')
+with metrics.stage('download'):
+    ...
+metrics.count('unmatched', len(unmatched))
+"""
+
+from collections import OrderedDict
+
+from contextlib import contextmanager
+
+from datetime import datetime
+
+import atexit, json, os, resource, sys, tempfile, threading, time, tracemalloc
+
+
+PROFILES = ('cpu', 'memory')
+
+# The functions or allocation sites reported by the profiles.
+PROFILE_TOP = 20
+
+
+class Metrics(object):
+    """The times of the stages and the counters of a step."""
+
+    def __init__(self, step):
+        """
+        Constructs the metrics.
+
+        :param step: The name of the step, ex. prepares_data.
+        :type step: str
+        """
+        self.step = step
+        self.started = time.time()
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, calls=1):
+        """
+        Adds time to a stage.
+        :param name: The name of the stage.
+        :type name: str
+        :param seconds: The seconds spent.
+        :type seconds: float
+        :param calls: The times the stage ran. Default 1.
+        :type calls: int
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, dict(seconds=0.0, calls=0))
+            stage['seconds'] += seconds
+            stage['calls'] += calls
+
+    def seconds(self, name):
+        """
+        The seconds spent in a stage so far.
+        :param name: The name of the stage.
+        :type name: str
+        :return: The seconds, 0 if it did not run.
+        :rtype: float
+        """
+        with self._lock:
+            return self.stages.get(name, {}).get('seconds', 0.0)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a block as a stage, the times of a stage are added up.
+        :param name: The name of the stage.
+        :type name: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def count(self, name, amount=1):
+        """
+        Increments a counter.
+        :param name: The name of the counter.
+        :type name: str
+        :param amount: The increment. Default 1.
+        :type amount: int
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """
+        The summary of the step.
+        :return: The seconds of the step and its stages, the counters, the
+        rows per second and the maximum resident memory.
+        :rtype: dict
+        """
+        seconds = time.time() - self.started
+        with self._lock:
+            stages = OrderedDict((name, dict(seconds=round(stage['seconds'], 4), calls=stage['calls']))
+                                 for name, stage in self.stages.items())
+            counters = OrderedDict(self.counters)
+        rows = counters.get('rows_out', 0)
+        # ru_maxrss is in KiB on Linux and in bytes on macOS.
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return OrderedDict(step=self.step, started=datetime.utcfromtimestamp(self.started).isoformat(),
+                           seconds=round(seconds, 4), stages=stages, counters=counters,
+                           rows_per_second=round(rows / seconds, 2) if seconds else None,
+                           max_rss_bytes=max_rss)
+
+
+_metrics = Metrics('pipe_vms_brazil')
+
+
+def get_metrics():
+    """
+    The metrics of the current step.
+    :return: The metrics.
+    :rtype: Metrics
+    """
+    return _metrics
+
+def stage(name):
+    """Times a block as a stage of the current step, see Metrics.stage."""
+    return _metrics.stage(name)
+
+def add_time(name, seconds, calls=1):
+    """Adds time to a stage of the current step, see Metrics.add_time."""
+    _metrics.add_time(name, seconds, calls)
+
+def count(name, amount=1):
+    """Increments a counter of the current step, see Metrics.count."""
+    _metrics.count(name, amount)
+
+def timed(iterable, name):
+    """
+    Times the production of the items of an iterable as a stage, ex. the
+    parse of a stream, without the time its consumer spends on them.
+    :param iterable: The items.
+    :type iterable: iterable
+    :param name: The name of the stage.
+    :type name: str
+    :return: The same items.
+    :rtype: generator
+    """
+    clock = time.perf_counter
+    iterator = iter(iterable)
+    seconds = 0.0
+    try:
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                seconds += clock() - start
+            yield item
+    finally:
+        add_time(name, seconds)
+
+def _save(summary, path):
+    from pipe_vms_brazil.storage import upload_file
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'metrics.json')
+        with open(local_path, 'w') as output:
+            json.dump(summary, output, indent=2)
+        upload_file(local_path, path)
+
+def _cpu_profile(profiler):
+    import pstats
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+    return dict(type='cpu', top=[dict(function=f'{filename}:{line}({name})', calls=calls,
+                                      own_seconds=round(own, 4), cumulative_seconds=round(cumulative, 4))
+                                 for (filename, line, name), (_, calls, own, cumulative, _) in functions])
+
+def _memory_profile():
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(type='memory', peak_bytes=peak,
+                top=[dict(location=str(statistic.traceback), size_bytes=statistic.size, count=statistic.count)
+                     for statistic in snapshot.statistics('lineno')[:PROFILE_TOP]])
+
+def reset(step):
+    """
+    Replaces the metrics of the current step without reporting them, ex. in
+    the worker processes whose metrics are sent back to the parent.
+    :param step: The name of the step.
+    :type step: str
+    :return: The new metrics.
+    :rtype: Metrics
+    """
+    global _metrics
+    _metrics = Metrics(step)
+    return _metrics
+
+def start(step, path=None, profile=None):
+    """
+    Starts the metrics of a step, its summary is reported at exit.
+    :param step: The name of the step.
+    :type step: str
+    :param path: Where to save the JSON summary, gs://, file:// or local.
+    Default None, only printed.
+    :type path: str
+    :param profile: The profile added to the summary, cpu or memory. Default
+    None, no profile.
+    :type profile: str
+    :return: The metrics of the step.
+    :rtype: Metrics
+    """
+    if profile is not None and profile not in PROFILES:
+        raise ValueError(f'Unsupported profile {profile}, expected one of {list(PROFILES)}')
+    step_metrics = reset(step)
+    profiler = None
+    if profile == 'cpu':
+        # Imported only when profiling, as pstats, they slow down the start.
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == 'memory':
+        tracemalloc.start()
+
+    def report():
+        summary = step_metrics.summary()
+        if profile == 'cpu':
+            summary['profile'] = _cpu_profile(profiler)
+        elif profile == 'memory':
+            summary['profile'] = _memory_profile()
+        print('METRICS {}'.format(json.dumps(summary)))
+        if path:
+            try:
+                _save(summary, path)
+            except Exception as error:
+                print(f'Can not save the metrics to <{path}>: {error}')
+
+    atexit.register(report)
+    return step_metrics
@@ -0,0 +1,335 @@
+"""
+Local mock of the Brazil API.
+
+Serves `GetDevices/{token}` and `GetMessages/{token}/{start}/{end}` like the
+real endpoint, so the fetch steps can be tested and benchmarked on an
+isolated machine. The payloads are synthetic, see `pipe_vms_brazil.synthetic`,
+or recorded from the raw bucket, `devices/<day>.json.gz` and
+`messages/<day>.json.gz` in `--payload_directory`. The bodies are generated
+while they are sent, in chunks, so very large days do not use memory.
+
+The faults are configurable, drawn from a seeded generator so a run can be
+repeated:
+- `--latency` before the first byte.
+- `--bytes_per_second` limiting the throughput of each response.
+- `--error_rate` of responses with a 500, 503 or a 429 with Retry-After.
+- `--truncate_rate` of bodies cut in the middle, the connection is closed.
+
+Ex.
+python -m pipe_vms_brazil.mock_api -p 8080 -f 15000 -pd 96 -l 0.5 -e 0.1 -t 0.05
+python -m pipe_vms_brazil.brazil_api_client -d 2021-02-25 -o file:///tmp/raw/ -ep http://localhost:8080/Service.svc
+"""
+
+from datetime import date, datetime, timedelta
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipe_vms_brazil.json_stream import iter_array
+
+from pipe_vms_brazil.synthetic import BASE_FLEET_SIZE, BASE_PINGS_PER_DAY, generate_devices, generate_messages
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+import argparse, glob, gzip, json, os, random, threading, time
+
+
+# FORMATS
+FORMAT_DT = '%Y-%m-%d'
+FORMAT_TS = '%Y-%m-%dT%H:%M:%S'
+
+# The messages of a chunk of the body.
+CHUNK_ITEMS = 1000
+
+ERRORS = (500, 503, 429)
+
+
+class MockApiServer(ThreadingHTTPServer):
+    """The mock API, a thread per request."""
+
+    daemon_threads = True
+
+    def __init__(self, address, token=None, fleet_size=BASE_FLEET_SIZE, pings_per_day=BASE_PINGS_PER_DAY,
+                 seed=0, unknown_rate=0.0, payload_directory=None, latency=0.0, bytes_per_second=None,
+                 error_rate=0.0, truncate_rate=0.0):
+        """
+        Constructs the server, listening but not serving yet.
+
+        :param address: The host and port, port 0 picks a free one.
+        :type address: tuple
+        :param token: The token expected in the routes. Default None, any.
+        :type token: str
+        :param fleet_size: The amount of synthetic devices. Default 1500.
+        :type fleet_size: int
+        :param pings_per_day: The synthetic messages of each device in a day.
+        Default 24.
+        :type pings_per_day: int
+        :param seed: The seed of the payloads and the faults. Default 0.
+        :type seed: int
+        :param unknown_rate: The ratio of synthetic messages from unknown
+        devices. Default 0.
+        :type unknown_rate: float
+        :param payload_directory: The local directory of the recorded
+        payloads, used for the days it has. Default None, synthetic only.
+        :type payload_directory: str
+        :param latency: The seconds before the first byte. Default 0.
+        :type latency: float
+        :param bytes_per_second: The maximum throughput of a response.
+        Default None, unlimited.
+        :type bytes_per_second: int
+        :param error_rate: The ratio of responses with an error. Default 0.
+        :type error_rate: float
+        :param truncate_rate: The ratio of bodies cut in the middle.
+        Default 0.
+        :type truncate_rate: float
+        """
+        super(MockApiServer, self).__init__(address, MockApiHandler)
+        self.token = token
+        self.pings_per_day = pings_per_day
+        self.seed = seed
+        self.unknown_rate = unknown_rate
+        self.payload_directory = payload_directory
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.devices = generate_devices(fleet_size, seed)
+        self.stats = dict(requests=0, errors=0, truncated=0, messages=0, bytes=0)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        """The endpoint to configure in the client."""
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/Service.svc'
+
+    def draw(self):
+        """
+        Draws the fault of a response.
+        :return: The error status, 0 if none, and if the body is truncated.
+        :rtype: tuple
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            if self._random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return self._random.choice(ERRORS), False
+            truncated = self._random.random() < self.truncate_rate
+            if truncated:
+                self.stats['truncated'] += 1
+            return 0, truncated
+
+    def count(self, name, amount):
+        with self._lock:
+            self.stats[name] += amount
+
+    def recorded(self, folder, day):
+        """The path of a recorded payload of a day, None if there is none."""
+        if self.payload_directory is None:
+            return None
+        path = os.path.join(self.payload_directory, folder, f'{day.strftime(FORMAT_DT)}.json.gz')
+        return path if os.path.exists(path) else None
+
+    def iter_devices(self):
+        """The devices, the last recorded ones or the synthetic ones."""
+        paths = sorted(glob.glob(os.path.join(self.payload_directory, 'devices', '*.json.gz'))) \
+            if self.payload_directory else []
+        if not paths:
+            return iter(self.devices)
+        return _iter_recorded(paths[-1], 'devices')
+
+    def iter_messages(self, start, end):
+        """
+        The messages between two timestamps, both inclusive.
+        :param start: The start of the window.
+        :type start: datetime
+        :param end: The end of the window.
+        :type end: datetime
+        :return: The messages of each day of the window in it.
+        :rtype: generator of dict
+        """
+        timestamps = TimestampConverter()
+        start_epoch, end_epoch = _epoch(start), _epoch(end)
+        per_day = len(self.devices) * self.pings_per_day
+        day = start.date()
+        while day <= end.date():
+            path = self.recorded('messages', day)
+            if path is not None:
+                messages = _iter_recorded(path, 'mensagens')
+            else:
+                # The mID keep increasing from a day to the next.
+                messages = generate_messages(self.devices, day, self.pings_per_day, self.seed, self.unknown_rate,
+                                             1 + (day - date(2000, 1, 1)).days * per_day)
+            # The malformed ones are sent with the window where their day starts.
+            midnight = _epoch(datetime(day.year, day.month, day.day))
+            for message in messages:
+                epoch = timestamps.to_epoch(message.get('datahora'))
+                if start_epoch <= (midnight if epoch is None else epoch) <= end_epoch:
+                    yield message
+            day += timedelta(1)
+
+
+def _epoch(moment):
+    return int((moment - datetime(1970, 1, 1)).total_seconds())
+
+def _iter_recorded(path, key):
+    with gzip.open(path, 'rb') as payload:
+        yield from iter_array(payload, key)
+
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    """Answers the routes of the Brazil API."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def route(self):
+        """
+        Parses the route of the request.
+        :return: GetDevices or GetMessages with the window, None if it is not
+        a route of the API or the token is wrong.
+        :rtype: tuple
+        """
+        parts = self.path.split('?')[0].strip('/').split('/')
+        for index, part in enumerate(parts):
+            arguments = parts[index + 1:]
+            if part == 'GetDevices' and len(arguments) == 1:
+                token = arguments[0]
+                window = None
+            elif part == 'GetMessages' and len(arguments) == 3:
+                token = arguments[0]
+                try:
+                    window = tuple(datetime.strptime(moment, FORMAT_TS) for moment in arguments[1:])
+                except ValueError:
+                    return None
+            else:
+                continue
+            if self.server.token is not None and token != self.server.token:
+                return None
+            return part, window
+        return None
+
+    def send_error_status(self, status):
+        body = json.dumps(dict(error=self.responses[status][0])).encode('utf-8')
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            self.send_error_status(404)
+            return
+        status, truncated = self.server.draw()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if status:
+            self.send_error_status(status)
+            return
+        name, window = route
+        if name == 'GetDevices':
+            key, items = 'devices', self.server.iter_devices()
+        else:
+            key, items = 'mensagens', self.server.iter_messages(*window)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.send_body(key, items, truncated)
+
+    def send_body(self, key, items, truncated):
+        """
+        Sends the payload in chunks, throttled to the bytes per second. A
+        truncated body stops in the middle of one of its first chunks, at the
+        latest the closing one, and the connection is closed.
+        """
+        started = time.perf_counter()
+        sent = messages = 0
+        chunks = 0
+        cut = random.Random(self.path).randint(1, 4) if truncated else None
+        for chunk in _chunks(key, items):
+            data = chunk[0].encode('utf-8')
+            if cut is not None and (chunks == cut or data == b']}'):
+                data = data[:len(data) // 2]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                sent += len(data)
+                self.close_connection = True
+                break
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            sent += len(data)
+            messages += chunk[1]
+            chunks += 1
+            if self.server.bytes_per_second:
+                wait = sent / self.server.bytes_per_second - (time.perf_counter() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        else:
+            self.wfile.write(b'0\r\n\r\n')
+        self.server.count('messages', messages)
+        self.server.count('bytes', sent)
+
+
+def _chunks(key, items):
+    """The payload as text chunks with their amount of items."""
+    yield f'{{"{key}": [', 0
+    first = True
+    lines = []
+    for item in items:
+        lines.append(json.dumps(item))
+        if len(lines) >= CHUNK_ITEMS:
+            yield ('' if first else ', ') + ', '.join(lines), len(lines)
+            first = False
+            lines = []
+    if lines:
+        yield ('' if first else ', ') + ', '.join(lines), len(lines)
+    yield ']}', 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves a local mock of the'
+                                     'Brazil API with synthetic or recorded'
+                                     'payloads and configurable faults.')
+    parser.add_argument('-H','--host', help='The host where to listen.',
+                        required=False, default='127.0.0.1')
+    parser.add_argument('-p','--port', help='The port where to listen.',
+                        required=False, default=8080, type=int)
+    parser.add_argument('-tk','--token', help='The token expected in the'
+                        'routes. Default any.', required=False, default=None)
+    parser.add_argument('-f','--fleet_size', help='The amount of synthetic'
+                        'devices.', required=False, default=BASE_FLEET_SIZE, type=int)
+    parser.add_argument('-pd','--pings_per_day', help='The synthetic messages'
+                        'of each device per day.', required=False, default=BASE_PINGS_PER_DAY, type=int)
+    parser.add_argument('-u','--unknown_rate', help='The ratio of synthetic'
+                        'messages from devices not in the list.', required=False, default=0.0, type=float)
+    parser.add_argument('-s','--seed', help='The seed of the payloads and'
+                        'the faults.', required=False, default=0, type=int)
+    parser.add_argument('-i','--payload_directory', help='The local directory'
+                        'with recorded devices/<day>.json.gz and messages/<day>.json.gz,'
+                        'served instead of the synthetic ones.', required=False, default=None)
+    parser.add_argument('-l','--latency', help='The seconds before the first'
+                        'byte of each response.', required=False, default=0.0, type=float)
+    parser.add_argument('-b','--bytes_per_second', help='The maximum'
+                        'throughput of each response. Default unlimited.', required=False, default=None, type=int)
+    parser.add_argument('-e','--error_rate', help='The ratio of responses'
+                        'with a 500, 503 or 429 error.', required=False, default=0.0, type=float)
+    parser.add_argument('-t','--truncate_rate', help='The ratio of bodies'
+                        'cut in the middle.', required=False, default=0.0, type=float)
+    args = parser.parse_args()
+
+    server = MockApiServer((args.host, args.port), args.token, args.fleet_size, args.pings_per_day, args.seed,
+                           args.unknown_rate, args.payload_directory, args.latency, args.bytes_per_second,
+                           args.error_rate, args.truncate_rate)
+    print(f'Serving the mock Brazil API at {server.endpoint}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'Stats of the mock API {server.stats}')
@@ -0,0 +1,281 @@
+"""
+Writers of the merged messages.
+
+The merged messages can be written as NEWLINEJSON GZIP, the default, or as
+typed Parquet or Avro files following the `brazil_schema.json` asset,
+where `datahora` is a real TIMESTAMP. The columnar formats are smaller and
+BigQuery loads them in parallel. They need the optional dependencies
+`pyarrow` for Parquet and `fastavro` for Avro.
+"""
+
+from abc import ABC, abstractmethod
+
+from pipe_vms_brazil.assets import SCHEMA, asset_path
+
+from pipe_vms_brazil.gzip_writer import open_gzip
+
+from pipe_vms_brazil.ndjson import NdjsonEncoder
+
+import calendar, json
+
+
+EXTENSIONS = {
+    'ndjson': '.json.gz',
+    'parquet': '.parquet',
+    'avro': '.avro',
+}
+
+ROW_GROUP_SIZE = 100000
+
+
+def load_schema(path=None):
+    """
+    Loads the BigQuery schema of the merged messages.
+    :param path: The path of the JSON schema. Default None, the brazil_schema
+    asset.
+    :type path: str
+    :return: The fields of the schema.
+    :rtype: list of dict
+    """
+    if path is None:
+        with asset_path(SCHEMA) as path:
+            return load_schema(path)
+    with open(path, 'r') as schema:
+        return json.load(schema)
+
+
+class _TimestampParser(object):
+    """Converts the merged datahora, YYYY-mm-dd HH:MM:SS, to epoch micros."""
+
+    def __init__(self):
+        self._dates = {}
+
+    def __call__(self, value):
+        midnight = self._dates.get(value[:10])
+        if midnight is None:
+            midnight = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]), 0, 0, 0))
+            self._dates[value[:10]] = midnight
+        seconds = int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+        return (midnight + seconds) * 1000000
+
+
+def _converter(bq_type):
+    if bq_type == 'TIMESTAMP':
+        convert = _TimestampParser()
+    elif bq_type == 'INTEGER':
+        convert = int
+    elif bq_type == 'FLOAT':
+        convert = float
+    elif bq_type == 'BOOLEAN':
+        convert = bool
+    else:
+        convert = str
+    return lambda value: None if value is None or value == '' else convert(value)
+
+
+class NdjsonWriter(object):
+    """Writes the merged messages as NEWLINEJSON GZIP."""
+
+    def __init__(self, path, compresslevel=9, workers=1, schema=None, json_backend='json'):
+        """
+        Constructs the writer.
+
+        :param path: The path of the file.
+        :type path: str
+        :param compresslevel: The GZIP compression level. Default 9.
+        :type compresslevel: int
+        :param workers: The amount of processes compressing. Default 1.
+        :type workers: int
+        :param schema: Unused, kept for a common interface.
+        :type schema: list of dict
+        :param json_backend: The encoder of the lines, json or orjson.
+        Default json.
+        :type json_backend: str
+        """
+        self._file = open_gzip(path, 'wb', compresslevel, workers)
+        self._encoder = NdjsonEncoder(self._file, json_backend)
+
+    def write(self, message):
+        """
+        Writes a merged message as a line, in blocks.
+        :param message: The merged message.
+        :type message: dict
+        """
+        self._encoder.write(message)
+
+    def close(self):
+        """Writes the last block and closes the file."""
+        self._encoder.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ColumnarWriter(ABC):
+    """
+    Buffers the merged messages in typed columns and writes them in row
+    groups. Subclasses write the row groups.
+    """
+
+    def __init__(self, path, compresslevel=9, workers=1, schema=None, json_backend=None,
+                 row_group_size=ROW_GROUP_SIZE):
+        """
+        Constructs the writer.
+
+        :param path: The path of the file.
+        :type path: str
+        :param compresslevel: Unused, kept for a common interface.
+        :type compresslevel: int
+        :param workers: Unused, kept for a common interface.
+        :type workers: int
+        :param schema: The BigQuery fields. Default None, the brazil_schema.
+        :type schema: list of dict
+        :param json_backend: Unused, kept for a common interface.
+        :type json_backend: str
+        :param row_group_size: The amount of rows of each group. Default
+        100000.
+        :type row_group_size: int
+        """
+        self.path = path
+        self.schema = schema if schema is not None else load_schema()
+        self.row_group_size = row_group_size
+        self._converters = [(field['name'], _converter(field['type'])) for field in self.schema]
+        self._columns = {name: [] for name, _ in self._converters}
+        self._rows = 0
+
+    def write(self, message):
+        """
+        Buffers a merged message converting its fields to the schema types.
+        :param message: The merged message.
+        :type message: dict
+        """
+        for name, convert in self._converters:
+            self._columns[name].append(convert(message.get(name)))
+        self._rows += 1
+        if self._rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows as a row group."""
+        if self._rows:
+            self.write_row_group(self._columns)
+            self._columns = {name: [] for name, _ in self._converters}
+            self._rows = 0
+
+    @abstractmethod
+    def write_row_group(self, columns):
+        """
+        Writes a group of rows to the file.
+        :param columns: The values of each field of the schema, converted to
+        its type, all of the same length.
+        :type columns: dict of list
+        """
+
+    def close(self):
+        """Writes the remaining rows and closes the file."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ParquetWriter(ColumnarWriter):
+    """Writes the merged messages as a Parquet file."""
+
+    TYPES = {
+        'TIMESTAMP': lambda pa: pa.timestamp('us', tz='UTC'),
+        'INTEGER': lambda pa: pa.int64(),
+        'FLOAT': lambda pa: pa.float64(),
+        'BOOLEAN': lambda pa: pa.bool_(),
+        'STRING': lambda pa: pa.string(),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(ParquetWriter, self).__init__(*args, **kwargs)
+        import pyarrow, pyarrow.parquet
+        self._pa = pyarrow
+        self._arrow_schema = pyarrow.schema([
+            pyarrow.field(field['name'], self.TYPES[field['type']](pyarrow),
+                          nullable=field.get('mode', 'nullable').lower() != 'required')
+            for field in self.schema])
+        self._writer = pyarrow.parquet.ParquetWriter(self.path, self._arrow_schema, compression='snappy')
+
+    def write_row_group(self, columns):
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._arrow_schema))
+
+    def close(self):
+        super(ParquetWriter, self).close()
+        self._writer.close()
+
+
+class AvroWriter(ColumnarWriter):
+    """Writes the merged messages as an Avro file."""
+
+    TYPES = {
+        'TIMESTAMP': {'type': 'long', 'logicalType': 'timestamp-micros'},
+        'INTEGER': 'long',
+        'FLOAT': 'double',
+        'BOOLEAN': 'boolean',
+        'STRING': 'string',
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(AvroWriter, self).__init__(*args, **kwargs)
+        from fastavro import parse_schema
+        from fastavro.write import Writer
+        fields = []
+        for field in self.schema:
+            avro_type = self.TYPES[field['type']]
+            if field.get('mode', 'nullable').lower() != 'required':
+                avro_type = ['null', avro_type]
+            fields.append({'name': field['name'], 'type': avro_type})
+        self._file = open(self.path, 'wb')
+        self._writer = Writer(self._file, parse_schema({'type': 'record', 'name': 'BrazilMessage', 'fields': fields}),
+                              codec='deflate')
+
+    def write_row_group(self, columns):
+        names = list(columns)
+        for values in zip(*columns.values()):
+            self._writer.write(dict(zip(names, values)))
+        self._writer.flush()
+
+    def close(self):
+        super(AvroWriter, self).close()
+        self._file.close()
+
+
+WRITERS = {
+    'ndjson': NdjsonWriter,
+    'parquet': ParquetWriter,
+    'avro': AvroWriter,
+}
+
+
+def open_output(path, output_format='ndjson', compresslevel=9, workers=1, schema=None, json_backend='json'):
+    """
+    Opens the writer of the merged messages.
+    :param path: The path of the file, see EXTENSIONS.
+    :type path: str
+    :param output_format: The format, ndjson, parquet or avro. Default ndjson.
+    :type output_format: str
+    :param compresslevel: The GZIP compression level of ndjson. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing ndjson. Default 1.
+    :type workers: int
+    :param schema: The BigQuery fields of the columnar formats. Default None,
+    the brazil_schema.
+    :type schema: list of dict
+    :param json_backend: The encoder of ndjson, json or orjson. Default json.
+    :type json_backend: str
+    :return: The writer, with write(message) and close().
+    """
+    if output_format not in WRITERS:
+        raise ValueError(f'Unsupported output format {output_format}, expected one of {list(WRITERS)}')
+    return WRITERS[output_format](path, compresslevel, workers, schema, json_backend)
@@ -0,0 +1,169 @@
+"""
+Writes the merged messages partitioned by day in a single pass.
+
+Each message is routed to the NEWLINEJSON GZIP of its partition. The messages
+are buffered as compact record batches per partition and written a partition
+after another through an `NdjsonEncoder`, so the files are written in big
+blocks. Only a bounded amount of GZIP files are kept open, the least recently
+used is closed when the limit is reached and reopened in append mode when
+needed again, which adds a new GZIP member to the file. The partitions whose
+file is open are written first, so a flush only opens the partitions it
+needs that were not open, instead of cycling through all of them.
+
+With `sort_unique` the messages are buffered until the writer is closed and
+each partition is written once, its batch sorted in place by `ID`, `datahora`
+and `mID` without duplicates as the `ExternalSorter` does. The memory grows
+with all the messages written, so it is only for what fits in memory.
+"""
+
+from collections import OrderedDict
+
+from concurrent.futures import ProcessPoolExecutor
+
+from pipe_vms_brazil.dedup import ExternalSorter
+
+from pipe_vms_brazil.gzip_writer import open_gzip
+
+from pipe_vms_brazil.ndjson import NdjsonEncoder, available_backend
+
+from pipe_vms_brazil.records import RecordBatch
+
+import os
+
+
+PARTITIONS = {
+    'day': lambda datahora: datahora[:10],
+    'hour': lambda datahora: f'{datahora[:10]}T{datahora[11:13]}',
+}
+
+
+class PartitionWriter(object):
+    """Routes each merged message to the GZIP file of its partition."""
+
+    def __init__(self, directory, partition_by='day', max_open_files=32, compresslevel=9, workers=1,
+                 buffer_rows=100000, json_backend='json', sort_unique=False):
+        """
+        Constructs the writer.
+
+        :param directory: The local directory where to write the partitions.
+        :type directory: str
+        :param partition_by: The partition of the files, day or hour.
+        Default day.
+        :type partition_by: str
+        :param max_open_files: The maximum of GZIP files opened at the same
+        time. Default 32.
+        :type max_open_files: int
+        :param compresslevel: The GZIP compression level. Default 9.
+        :type compresslevel: int
+        :param workers: The amount of processes compressing, shared by all
+        the partitions. Default 1.
+        :type workers: int
+        :param buffer_rows: The messages buffered before writing them. Default
+        100000.
+        :type buffer_rows: int
+        :param json_backend: The encoder of the lines, json or orjson.
+        Default json.
+        :type json_backend: str
+        :param sort_unique: Sorts each partition without duplicates, keeping
+        all the messages buffered until the writer is closed. Default False.
+        :type sort_unique: bool
+        """
+        if partition_by not in PARTITIONS:
+            raise ValueError(f'Unsupported partition {partition_by}, expected one of {list(PARTITIONS)}')
+        self.directory = directory
+        self.partition = PARTITIONS[partition_by]
+        self.max_open_files = max_open_files
+        self.compresslevel = compresslevel
+        self.counts = {}
+        self.buffer_rows = buffer_rows
+        self.sort_unique = sort_unique
+        self.duplicates = 0
+        self.json_backend = available_backend(json_backend)
+        self._buffers = {}
+        self._buffered = 0
+        self._handles = OrderedDict()
+        self._executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        self._workers = workers
+
+    def path(self, key):
+        """
+        The path of the file of a partition.
+        :param key: The partition key, ex. 2012-01-01 or 2012-01-01T05.
+        :type key: str
+        :return: The path of the partition.
+        :rtype: str
+        """
+        return os.path.join(self.directory, f'{key}.json.gz')
+
+    def _handle(self, key):
+        handle = self._handles.get(key)
+        if handle is not None:
+            self._handles.move_to_end(key)
+            return handle
+        if len(self._handles) >= self.max_open_files:
+            _, oldest = self._handles.popitem(last=False)
+            oldest.close()
+        # The first time the partition is truncated, after that appended.
+        mode = 'ab' if key in self.counts else 'wb'
+        handle = open_gzip(self.path(key), mode, self.compresslevel, self._workers, self._executor)
+        self._handles[key] = handle
+        self.counts.setdefault(key, 0)
+        return handle
+
+    def write(self, message):
+        """
+        Writes the message in the file of its partition.
+        :param message: The merged message.
+        :type message: dict
+        :return: The partition key where the message was written.
+        :rtype: str
+        """
+        key = self.partition(message['datahora'])
+        batch = self._buffers.get(key)
+        if batch is None:
+            batch = self._buffers[key] = RecordBatch()
+        batch.append(message)
+        self._buffered += 1
+        if self._buffered >= self.buffer_rows and not self.sort_unique:
+            self.flush()
+        return key
+
+    def flush(self):
+        """
+        Writes the buffered messages, a partition after another. The ones
+        whose file is open go first, from the least recently used, so none of
+        them is closed to open another and reopened in the same flush.
+        """
+        opened = [key for key in self._handles if key in self._buffers]
+        for key in opened + sorted(key for key in self._buffers if key not in self._handles):
+            # Released a partition after another.
+            rows = self._buffers.pop(key)
+            if self.sort_unique:
+                sorter = ExternalSorter()
+                rows = sorter.sort_batch(rows)
+            encoder = NdjsonEncoder(self._handle(key), self.json_backend)
+            written = 0
+            for row in rows:
+                encoder.write(row)
+                written += 1
+            encoder.flush()
+            self.counts[key] += written
+            if self.sort_unique:
+                self.duplicates += sorter.duplicates
+        self._buffered = 0
+
+    def close(self):
+        """Writes the buffered messages and closes all the opened files."""
+        self.flush()
+        while self._handles:
+            _, handle = self._handles.popitem()
+            handle.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
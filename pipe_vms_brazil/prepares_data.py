@@ -8,49 +8,44 @@ This script will do:
 4- Compress again in a separate folder.
 """
 
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
-from google.cloud import storage
+from datetime import datetime, timedelta
 
 from shutil import rmtree
 
-from pathlib import Path
+from pipe_vms_brazil import metrics
 
-import argparse, gzip, json, os, re, time
+from pipe_vms_brazil.dedup import MAX_ROWS, ExternalSorter
 
+from pipe_vms_brazil.device_registry import content_hash, load_registry
 
-# FORMATS
-FORMAT_DT = '%Y-%m-%d'
+from pipe_vms_brazil.enrich import MAX_SPEED_KMH, enrich_tracks, import_numpy
 
-# FOLDER
-LOCAL_MERGER_PATH = "prepare_data"
+from pipe_vms_brazil.incremental import compact_deltas, deltas_directory
 
-def copy_blob(gcs_path, blob_name, original_file):
-    """
-    Copies a blob from one bucket to another with a new name.
-    :param gcs_path: The gcs path to the original file.
-    :type gcs_path: str
-    :param blob_name: The name of the file.
-    :type blob_name: str
-    :param original_file: The file to download.
-    :type original_file: str
-    """
-    storage_client = storage.Client()
+from pipe_vms_brazil.join import index_devices, join_messages
 
-    prefix = ''
-    bucket_name = ''
-    if gcs_path.startswith("gs:"):
-        bucket_name = re.search('(?<=gs://)[^/]*', gcs_path).group(0)
-        prefix = re.search('(?<=gs://)[^/]*/(.*)', gcs_path).group(1)
+from pipe_vms_brazil.json_stream import iter_array
 
-    print(f'bucket {bucket_name}, prefix: {prefix}')
+from pipe_vms_brazil.ndjson import BACKENDS
 
-    source_bucket = storage_client.bucket(bucket_name)
-    print(f'{prefix}{blob_name}')
-    source_blob = source_bucket.blob(f'{prefix}{blob_name}')
+from pipe_vms_brazil.output import EXTENSIONS, open_output
 
-    source_blob.download_to_filename(original_file.name)
+from pipe_vms_brazil.stage_manifest import checksums, is_unchanged, load_manifest, manifest_path, save_manifest
+
+from pipe_vms_brazil.storage import download_many, list_files, upload, upload_file
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+import argparse, gzip, os, sys, time
+
+
+# FORMATS
+FORMAT_DT = '%Y-%m-%d'
 
+# FOLDER
+LOCAL_MERGER_PATH = "prepare_data"
 
 def create_directory(name):
     """
@@ -61,96 +56,373 @@ def create_directory(name):
     if not os.path.exists(name):
         os.makedirs(name)
 
-def gcs_transfer(pattern_file, gcs_path):
+def merge_to_file(devices, messages, merged_file_path, output_format='ndjson', compresslevel=9, workers=1,
+                  dedup=False, max_sort_rows=MAX_ROWS, json_backend='json', enrich=False,
+                  max_speed_kmh=MAX_SPEED_KMH):
     """
-    Uploads the files from file system to a GCS destination.
-    :param pattern_file: The pattern file without wildcard.
-    :type pattern_file: str
-    :param gcs_path: The absolute path of GCS.
-    :type gcs_path: str
+    Adds the info of its device to each message and saves the merged file.
+    :param devices: The devices keyed by ID.
+    :type devices: dict
+    :param messages: The messages as they come from the API.
+    :type messages: iterable of dict
+    :param merged_file_path: The local path of the merged file.
+    :type merged_file_path: str
+    :param output_format: The format, ndjson, parquet or avro. Default ndjson.
+    :type output_format: str
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :param dedup: Sorts the merged messages by ID and datahora dropping the
+    repeated ID, mID and datahora. Default False, in the order received.
+    :type dedup: bool
+    :param max_sort_rows: The maximum rows sorted in memory, the rest are
+    spilled to disk. Default 2000000.
+    :type max_sort_rows: int
+    :param json_backend: The encoder of ndjson, json or orjson. Default json.
+    :type json_backend: str
+    :param enrich: Adds the track columns of each vessel, sorting the merged
+    messages as dedup does. Default False.
+    :type enrich: bool
+    :param max_speed_kmh: The highest plausible implied speed of the track,
+    a faster one is an impossible jump. Default 100.
+    :type max_speed_kmh: float
+    :return: The amount of merged messages.
+    :rtype: int
     """
-    storage_client = storage.Client()
-    gcs_search = re.search('gs://([^/]*)/(.*)', gcs_path)
-    bucket = storage_client.bucket(gcs_search.group(1))
-    pattern_path = Path(pattern_file)
-    for filename in pattern_path.parent.glob(pattern_path.name + '*'):
-        blob = bucket.blob(gcs_search.group(2) + filename.name)
-        blob.upload_from_filename(filename)
-        print("File from file system <{}> uploaded to <{}>.".format(filename, gcs_path))
+    print(f'Saves the merged file {merged_file_path} as {output_format}.')
+    unmatched=[]
+    timestamps=TimestampConverter()
+    # The tracks need the messages sorted, which drops the duplicates too.
+    sorter=ExternalSorter(max_sort_rows, os.path.dirname(merged_file_path) or None) if dedup or enrich else None
+    total_merged=0
+    # The join is what remains of the merge after parsing and writing.
+    clock=time.perf_counter
+    writing=0.0
+    start=clock()
+    parsed=metrics.get_metrics().seconds('parse')
+    sorting=metrics.get_metrics().seconds('sort')
+    enriching=metrics.get_metrics().seconds('enrich')
+    with open_output(merged_file_path, output_format, compresslevel, workers, json_backend=json_backend) as merged:
+        rows = join_messages(devices, metrics.timed(messages, 'parse'), unmatched, timestamps)
+        if sorter:
+            rows = sorter.sort_unique(rows)
+        if enrich:
+            rows = enrich_tracks(rows, max_speed_kmh)
+        for message in rows:
+            write_start=clock()
+            merged.write(message)
+            writing += clock() - write_start
+            total_merged += 1
+        # Closing flushes the last rows.
+        write_start=clock()
+    writing += clock() - write_start
+    parsed=metrics.get_metrics().seconds('parse') - parsed
+    sorting=metrics.get_metrics().seconds('sort') - sorting
+    enriching=metrics.get_metrics().seconds('enrich') - enriching
+    metrics.add_time('write', writing)
+    metrics.add_time('join', clock() - start - parsed - sorting - enriching - writing)
+    metrics.count('devices', len(devices))
+    duplicates = sorter.duplicates if sorter else 0
+    metrics.count('messages_in', total_merged + duplicates + len(unmatched) + timestamps.malformed)
+    metrics.count('rows_out', total_merged)
+    metrics.count('unmatched', len(unmatched))
+    metrics.count('malformed', timestamps.malformed)
+    metrics.count('bytes_written', os.path.getsize(merged_file_path))
+    print(f'Total of devices read {len(devices)}')
+    print(f'Total of messages read {total_merged + duplicates + len(unmatched) + timestamps.malformed}')
+    print(f'Total of merged results  {total_merged}')
+    if sorter:
+        metrics.count('duplicates', duplicates)
+        print(f'Total of duplicated messages dropped {duplicates}, sorted in {max(sorter.runs, 1)} runs')
+    print(f'Total of messages without a known device {len(unmatched)}')
+    print(f'Total of messages with a malformed datahora {timestamps.malformed}, samples {timestamps.malformed_samples}')
+    return total_merged
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Merges the data comming from'
+def day_range(date_start, date_end=None):
+    """
+    The days of a date range.
+    :param date_start: The first day.
+    :type date_start: datetime
+    :param date_end: The last day, inclusive. Default None, only the first.
+    :type date_end: datetime
+    :return: The days.
+    :rtype: list of datetime
+    """
+    return [date_start + timedelta(days=offset) for offset in range(((date_end or date_start) - date_start).days + 1)]
+
+_registries = {}
+
+def _registry(path):
+    """The device registry, loaded once per process and shared by its days."""
+    registry = _registries.get(path)
+    if registry is None:
+        registry = _registries[path] = load_registry(path)
+    return registry
+
+def prepare_day(query_date, input_directory, output_directory, output_format='ndjson', compresslevel=9, workers=1,
+                dedup=True, max_sort_rows=MAX_ROWS, json_backend='json', enrich=False, max_speed_kmh=MAX_SPEED_KMH,
+                device_registry=None, compact=False, force=False):
+    """
+    Prepares the merged file of a day and uploads it, skipped when its inputs
+    and options did not change since the last run.
+    :param query_date: The day.
+    :type query_date: datetime
+    :param input_directory: The directory of the devices and messages,
+    expected with slash at the end.
+    :type input_directory: str
+    :param output_directory: The directory of the merged files, expected with
+    slash at the end.
+    :type output_directory: str
+    :param output_format: The format, ndjson, parquet or avro. Default ndjson.
+    :type output_format: str
+    :param compresslevel: The GZIP compression level. Default 9.
+    :type compresslevel: int
+    :param workers: The amount of processes compressing. Default 1.
+    :type workers: int
+    :param dedup: Sorts the merged messages dropping the duplicates, see
+    merge_to_file. Default True.
+    :type dedup: bool
+    :param max_sort_rows: The maximum rows sorted in memory. Default 2000000.
+    :type max_sort_rows: int
+    :param json_backend: The encoder of ndjson, json or orjson. Default json.
+    :type json_backend: str
+    :param enrich: Adds the track columns, see merge_to_file. Default False.
+    :type enrich: bool
+    :param max_speed_kmh: The highest plausible implied speed. Default 100.
+    :type max_speed_kmh: float
+    :param device_registry: The path of the device registry used instead of
+    the devices file. Default None, no registry.
+    :type device_registry: str
+    :param compact: Compacts the deltas of the incremental polls of the day
+    in its messages file first, it fails when there are none. The deltas are
+    the inputs of the manifest, so a day is prepared again when a later poll
+    adds one. Default False.
+    :type compact: bool
+    :param force: Prepares the day even when it did not change. Default False.
+    :type force: bool
+    :return: If the day was prepared, False when it was skipped.
+    :rtype: bool
+    """
+    day = query_date.strftime(FORMAT_DT)
+    local_directory = f'{LOCAL_MERGER_PATH}/{day}'
+    devices_file_path = f'{local_directory}/devices_{day}.json.gz'
+    messages_file_path = f'{local_directory}/messages_{day}.json.gz'
+    merged_file_path = f'{local_directory}/{day}{EXTENSIONS[output_format]}'
+
+    if compact:
+        deltas = list_files(deltas_directory(input_directory, day))
+        if not deltas:
+            # Never replaces the messages of the day with an empty compaction.
+            raise FileNotFoundError(f'No deltas of {day} in <{deltas_directory(input_directory, day)}>, the'
+                                    ' incremental polls did not save any yet.')
+        delta_paths = [f'{local_directory}/deltas/{os.path.basename(delta)}' for delta in deltas]
+        transfers = list(zip(deltas, delta_paths))
+    else:
+        transfers = [(f'{input_directory}messages/{day}.json.gz', messages_file_path)]
+    if device_registry is None:
+        transfers.append((f'{input_directory}devices/{day}.json.gz', devices_file_path))
+    else:
+        print(f'Loads the devices valid at {day} from the registry <{device_registry}>')
+        with metrics.stage('registry'):
+            devices = _registry(device_registry).devices_at(query_date.date())
+
+    # Skips the day when its inputs did not change since the last run.
+    with metrics.stage('manifest'):
+        manifest = manifest_path(output_directory, 'prepares_data', day)
+        inputs = checksums([source for source, _ in transfers])
+        if device_registry is not None:
+            inputs['devices'] = content_hash(devices.values())
+        options = dict(output_format=output_format, compresslevel=compresslevel, dedup=dedup,
+                       json_backend=json_backend, enrich=enrich, max_speed_kmh=max_speed_kmh)
+        unchanged = not force and is_unchanged(load_manifest(manifest), inputs, options)
+    if unchanged:
+        print(f'The inputs of {day} did not change since the last run, see <{manifest}>. Use --force to prepare it again.')
+        metrics.count('days_skipped')
+        return False
+
+    create_directory(local_directory)
+    if compact:
+        create_directory(f'{local_directory}/deltas')
+
+    try:
+        # Copies the original GZIP files to local.
+        print('Copies the original GZIP files to local.')
+        with metrics.stage('download'):
+            download_many(transfers)
+
+        if compact:
+            print(f'Compacts the {len(delta_paths)} deltas of the day in <{messages_file_path}>')
+            with metrics.stage('compact_deltas'):
+                total, duplicates = compact_deltas(delta_paths, messages_file_path)
+                if not total:
+                    raise ValueError(f'The {len(delta_paths)} deltas of {day} have no messages, its messages'
+                                     ' file is not replaced.')
+                upload_file(messages_file_path, f'{input_directory}messages/{day}.json.gz')
+            print(f'{total} messages compacted, {duplicates} duplicates discarded.')
+            metrics.count('delta_duplicates', duplicates)
+
+        if device_registry is None:
+            # Decompresses the GZIP.
+            print(f'Decompresses the original GZIP files <{devices_file_path},{messages_file_path}>')
+            with metrics.stage('parse_devices'), gzip.open(devices_file_path,'rb') as devices_original:
+                devices = index_devices(iter_array(devices_original, 'devices'))
+
+        # Per each message will add the info of its device and compress.
+        with gzip.open(messages_file_path,'rb') as messages_original:
+            merge_to_file(devices, iter_array(messages_original, 'mensagens'), merged_file_path,
+                          output_format, compresslevel, workers, dedup, max_sort_rows, json_backend, enrich,
+                          max_speed_kmh)
+
+        # Saves to GCS
+        with metrics.stage('upload'):
+            upload(merged_file_path, output_directory)
+        save_manifest(manifest, 'prepares_data', day, inputs,
+                      [f'{output_directory}{os.path.basename(merged_file_path)}'], options)
+    finally:
+        rmtree(local_directory, ignore_errors=True)
+    metrics.count('days_prepared')
+    return True
+
+def _prepare_task(task):
+    query_date, options = task
+    # The metrics of the process are sent back to be added up.
+    day_metrics = metrics.reset(f'prepares_data_{query_date.strftime(FORMAT_DT)}')
+    try:
+        prepared = prepare_day(query_date, **options)
+        return query_date, prepared, None, day_metrics.stages, day_metrics.counters
+    except Exception as error:
+        return query_date, None, f'{type(error).__name__}: {error}', day_metrics.stages, day_metrics.counters
+
+def prepare_days(days, parallel_days=1, **options):
+    """
+    Prepares several days in a single run, sharing the clients and the device
+    registry between them.
+    :param days: The days.
+    :type days: list of datetime
+    :param parallel_days: The amount of days prepared at the same time, each
+    one in a process. Default 1, one after the other in this process.
+    :type parallel_days: int
+    :param options: The options of prepare_day.
+    :type options: dict
+    :return: The days that failed, with their error.
+    :rtype: dict
+    """
+    failed = {}
+    if parallel_days <= 1 or len(days) <= 1:
+        for query_date in days:
+            try:
+                prepare_day(query_date, **options)
+            except Exception as error:
+                print(f'Day {query_date.strftime(FORMAT_DT)} failed: {type(error).__name__}: {error}')
+                failed[query_date.strftime(FORMAT_DT)] = f'{type(error).__name__}: {error}'
+        return failed
+    # Processes, not daemonic, so each one can still compress with workers.
+    with ProcessPoolExecutor(min(parallel_days, len(days))) as executor:
+        for query_date, prepared, error, stages, counters in executor.map(
+                _prepare_task, [(query_date, options) for query_date in days]):
+            for name, stage in stages.items():
+                metrics.add_time(name, stage['seconds'], stage['calls'])
+            for name, amount in counters.items():
+                metrics.count(name, amount)
+            if error is not None:
+                print(f'Day {query_date.strftime(FORMAT_DT)} failed: {error}')
+                failed[query_date.strftime(FORMAT_DT)] = error
+    return failed
+
+
+def main(argv=None, prog=None):
+    """
+    Prepares the days, as the prepare command.
+    :param argv: The arguments. Default None, the ones of the process.
+    :type argv: list of str
+    :param prog: The name of the command in the usage. Default None, the
+    module.
+    :type prog: str
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Merges the data comming from'
                                      'devices and messages and generate a new'
                                      'GZIP to compress.')
     parser.add_argument('-d','--query_date', help='The date to be queried. Expects a str in format YYYY-MM-DD',
                         required=True)
+    parser.add_argument('-de','--date_end', help='The last date to be'
+                        'prepared, inclusive, with the same run. Expects a str in format'
+                        'YYYY-MM-DD. Default None, only the query_date.', required=False, default=None)
+    parser.add_argument('-P','--parallel_days', help='The amount of days'
+                        'of the range prepared at the same time.', required=False, default=1, type=int)
     parser.add_argument('-i','--input_directory', help='The GCS directory'
                         'where the data is stored. Expected with slash at'
                         'the end.', required=True)
     parser.add_argument('-o','--output_directory', help='The GCS directory'
                         'where the data will be stored. Expected with slash at'
                         'the end.', required=True)
-    args = parser.parse_args()
+    parser.add_argument('-cl','--compresslevel', help='The GZIP compression'
+                        'level of the output, from 1 (fastest) to 9 (smallest).', required=False, default=9, type=int)
+    parser.add_argument('-w','--workers', help='The amount of processes'
+                        'compressing the output in parallel blocks.', required=False, default=1, type=int)
+    parser.add_argument('-dr','--device_registry', help='The path, local or'
+                        'GCS, of the device registry snapshot used instead'
+                        'of the devices file. Default None, no registry.',
+                        required=False, default=None)
+    parser.add_argument('-of','--output_format', help='The format of the'
+                        'merged file, ndjson (GZIP), parquet or avro.', choices=list(EXTENSIONS),
+                        required=False, default='ndjson')
+    parser.add_argument('-mt','--metrics', help='The path, local or GCS,'
+                        'where the JSON summary of the metrics is saved. Default'
+                        'None, only printed.', required=False, default=None)
+    parser.add_argument('-pf','--profile', help='Adds a cpu (cProfile) or'
+                        'memory (tracemalloc) profile to the metrics.', choices=list(metrics.PROFILES),
+                        required=False, default=None)
+    parser.add_argument('-f','--force', help='Prepares the day even when its'
+                        'inputs and options did not change since the last run.',
+                        required=False, action='store_true')
+    parser.add_argument('-nd','--no_dedup', help='Writes the merged messages'
+                        'in the order received, without sorting them by ID and datahora'
+                        'and dropping the duplicates.', required=False, action='store_true')
+    parser.add_argument('-msr','--max_sort_rows', help='The maximum merged'
+                        'messages sorted in memory, the rest are spilled to disk.',
+                        required=False, default=MAX_ROWS, type=int)
+    parser.add_argument('-jb','--json_backend', help='The encoder of the '
+                        'ndjson lines, json or orjson (faster, compact lines) when installed.',
+                        choices=list(BACKENDS), required=False, default='json')
+    parser.add_argument('-en','--enrich', help='Adds the track columns of each'
+                        'vessel, seconds since the previous ping, distance, implied speed'
+                        'and impossible jumps. Needs numpy.', required=False, action='store_true')
+    parser.add_argument('-msk','--max_speed_kmh', help='The highest plausible'
+                        'implied speed of the track, a faster one is an impossible jump.',
+                        required=False, default=MAX_SPEED_KMH, type=float)
+    parser.add_argument('-cd','--compact_deltas', help='Compacts the deltas'
+                        'of the incremental polls of the day, without duplicates, in its'
+                        'messages file before preparing it.', required=False, action='store_true')
+    args = parser.parse_args(argv)
+    if args.enrich:
+        # Fails before processing anything when numpy is not installed.
+        try:
+            import_numpy()
+        except ImportError as error:
+            parser.error(str(error))
+    metrics.start('prepares_data', args.metrics, args.profile)
     query_date = datetime.strptime(args.query_date, FORMAT_DT)
-    input_directory= args.input_directory
-    output_directory= args.output_directory
-
-    devices_file_path = f'{LOCAL_MERGER_PATH}/devices_{query_date.strftime(FORMAT_DT)}.json.gz'
-    messages_file_path = f'{LOCAL_MERGER_PATH}/messages_{query_date.strftime(FORMAT_DT)}.json.gz'
-    merged_file_path = f'{LOCAL_MERGER_PATH}/{query_date.strftime(FORMAT_DT)}.json.gz'
+    date_end = datetime.strptime(args.date_end, FORMAT_DT) if args.date_end else None
 
     start_time = time.time()
 
-    create_directory(LOCAL_MERGER_PATH)
-
-    # Copies the original GZIP files to local.
-    print('Copies the original GZIP files to local.')
-    with open(devices_file_path, 'wb') as devices_original_file:
-        copy_blob(input_directory, f'devices/{query_date.strftime(FORMAT_DT)}.json.gz', devices_original_file)
-    with open(messages_file_path, 'wb') as messages_original_file:
-        copy_blob(input_directory, f'messages/{query_date.strftime(FORMAT_DT)}.json.gz', messages_original_file)
-
-    # Decompresses the GZIP.
-    print(f'Decompresses the original GZIP files <{devices_file_path},{messages_file_path}>')
-    devices=[]
-    messages=[]
-    with gzip.open(devices_file_path,'rb') as devices_original:
-        content = json.loads(devices_original.read().decode())
-        for device in content['devices']:
-            devices.append(device)
-
-    with gzip.open(messages_file_path,'rb') as messages_original:
-        content = json.loads(messages_original.read().decode())
-        for message in content['mensagens']:
-            messages.append(message)
-
-    # Per each device ID will list all the messages ID.
-    merge=[]
-    for device in devices:
-        merge += [dict(ID=message['ID'], curso=message['curso'],
-                       datahora=datetime.strptime(message['datahora'],'%d-%m-%Y %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S'),
-                       lat=message['lat'], lon=message['lon'], mID=message['mID'], speed=message['speed'],
-                       codMarinha=device['codMarinha'], nome=device['nome'])
-                  for message in messages
-                  if message['ID'] == device['ID']]
-        print(f'== device {device["ID"]} DONE.')
-    print(f'Total of devices read {len(devices)}')
-    print(f'Total of messages read {len(messages)}')
-    print(f'Total of merged results  {len(merge)}')
-
-    # Compress
-    print(f'Saves the merged file {merged_file_path} and compress with GZIP.')
-    with gzip.open(merged_file_path,'wt', compresslevel=9) as merged:
-        for message in merge:
-            json.dump(message, merged)
-            merged.write("\n")
-
-    # Saves to GCS
-    gcs_transfer(merged_file_path, output_directory)
-
-    rmtree(LOCAL_MERGER_PATH)
+    failed = prepare_days(day_range(query_date, date_end), args.parallel_days,
+                          input_directory=args.input_directory, output_directory=args.output_directory,
+                          output_format=args.output_format, compresslevel=args.compresslevel,
+                          workers=args.workers, dedup=not args.no_dedup, max_sort_rows=args.max_sort_rows,
+                          json_backend=args.json_backend, enrich=args.enrich, max_speed_kmh=args.max_speed_kmh,
+                          device_registry=args.device_registry, compact=args.compact_deltas, force=args.force)
+    if failed:
+        print(f'{len(failed)} days failed, run them again: {failed}')
+        sys.exit(1)
+    rmtree(LOCAL_MERGER_PATH, ignore_errors=True)
 
     ### ALL DONE
-    print("All done, you can find the output file here: {0}".format(output_directory))
+    print("All done, you can find the output file here: {0}".format(args.output_directory))
     print("Execution time {0} minutes".format((time.time()-start_time)/60))
+
+
+if __name__ == '__main__':
+    main()
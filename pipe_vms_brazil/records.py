@@ -0,0 +1,260 @@
+"""
+Compact typed records of the merged messages.
+
+A merged message as a `dict` costs hundreds of bytes. The `RecordBatch` keeps
+the merged messages in typed column arrays instead, around 70 bytes each:
+- `ID`, `mID`, `curso` and `speed` as 64 bits integers.
+- `datahora` as the seconds since epoch.
+- `lat` and `lon` as doubles plus the amount of decimals of their text.
+- `codMarinha` and `nome` interned in a table of strings shared by the rows.
+
+The rows are rebuilt exactly as they were appended, same keys, values and
+types, so the NEWLINEJSON written from a batch is the same as from the dicts.
+The values that do not fit their column, ex. a lat that is not a decimal text
+or a null ID, are kept apart as exceptions.
+"""
+
+from array import array
+
+from datetime import date, timedelta
+
+
+FIELDS = ('ID', 'curso', 'datahora', 'lat', 'lon', 'mID', 'speed', 'codMarinha', 'nome')
+INTEGER_FIELDS = ('ID', 'curso', 'mID', 'speed')
+DECIMAL_FIELDS = ('lat', 'lon')
+STRING_FIELDS = ('codMarinha', 'nome')
+
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+_EPOCH = date(1970, 1, 1)
+_DIGITS = frozenset('0123456789')
+
+
+def _parse_decimal(value):
+    """
+    The number and decimals of a decimal text, or None if the text can not be
+    rebuilt from them.
+    """
+    if type(value) is not str:
+        return None
+    dot = value.find('.')
+    decimals = len(value) - dot - 1 if dot >= 0 else 0
+    if decimals > 127:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if f'{number:.{decimals}f}' != value:
+        return None
+    return number, decimals
+
+
+class RecordBatch(object):
+    """The merged messages as typed columns."""
+
+    def __init__(self):
+        self.columns = {field: array('q') for field in INTEGER_FIELDS}
+        self.columns['datahora'] = array('q')
+        for field in DECIMAL_FIELDS:
+            self.columns[field] = array('d')
+            self.columns[f'{field}_decimals'] = array('b')
+        for field in STRING_FIELDS:
+            self.columns[field] = array('l')
+        self.strings = []
+        self.exceptions = {}
+        self._exception_rows = set()
+        self._string_index = {}
+        self._midnights = {}
+        self._days = {}
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def _intern(self, value):
+        index = self._string_index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self._string_index[value] = index
+        return index
+
+    def _epoch(self, value):
+        """The seconds since epoch of a YYYY-mm-dd HH:MM:SS, None if it is not."""
+        if type(value) is not str or len(value) != 19 or value[10] != ' ' or value[13] != ':' or value[16] != ':':
+            return None
+        midnight = self._midnights.get(value[:10])
+        if midnight is None:
+            try:
+                day = date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+            except ValueError:
+                return None
+            if day.isoformat() != value[:10]:
+                return None
+            midnight = (day - _EPOCH).days * 86400
+            self._midnights[value[:10]] = midnight
+            self._days[midnight] = value[:10]
+        hours, minutes, seconds = value[11:13], value[14:16], value[17:19]
+        if not _DIGITS.issuperset(hours + minutes + seconds):
+            return None
+        hours, minutes, seconds = int(hours), int(minutes), int(seconds)
+        if hours > 23 or minutes > 59 or seconds > 59:
+            return None
+        return midnight + hours * 3600 + minutes * 60 + seconds
+
+    def _datahora(self, epoch):
+        midnight = epoch - epoch % 86400
+        day = self._days.get(midnight)
+        if day is None:
+            day = (_EPOCH + timedelta(seconds=midnight)).isoformat()
+            self._days[midnight] = day
+        seconds = epoch - midnight
+        return f'{day} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+    def append(self, row):
+        """
+        Appends a merged message.
+        :param row: The merged message, with the keys in FIELDS.
+        :type row: dict
+        """
+        if tuple(row) != FIELDS:
+            # Other keys or order can not be rebuilt from the columns.
+            raise ValueError(f'Unexpected fields {list(row)}, expected {list(FIELDS)}')
+        index = self._length
+        exceptions = len(self.exceptions)
+        columns = self.columns
+        for field in INTEGER_FIELDS:
+            value = row[field]
+            if type(value) is int and _INT64_MIN <= value <= _INT64_MAX:
+                columns[field].append(value)
+            else:
+                columns[field].append(0)
+                self.exceptions[(index, field)] = value
+        epoch = self._epoch(row['datahora'])
+        if epoch is None:
+            columns['datahora'].append(0)
+            self.exceptions[(index, 'datahora')] = row['datahora']
+        else:
+            columns['datahora'].append(epoch)
+        for field in DECIMAL_FIELDS:
+            parsed = _parse_decimal(row[field])
+            if parsed is None:
+                columns[field].append(0.0)
+                columns[f'{field}_decimals'].append(0)
+                self.exceptions[(index, field)] = row[field]
+            else:
+                columns[field].append(parsed[0])
+                columns[f'{field}_decimals'].append(parsed[1])
+        for field in STRING_FIELDS:
+            value = row[field]
+            if value is None or type(value) is str:
+                columns[field].append(self._intern(value))
+            else:
+                columns[field].append(-1)
+                self.exceptions[(index, field)] = value
+        if len(self.exceptions) > exceptions:
+            self._exception_rows.add(index)
+        self._length += 1
+
+    def extend(self, rows):
+        """
+        Appends several merged messages.
+        :param rows: The merged messages.
+        :type rows: iterable of dict
+        """
+        for row in rows:
+            self.append(row)
+
+    def value(self, index, field):
+        """
+        The value of a field of a row, as it was appended.
+        :param index: The position of the row.
+        :type index: int
+        :param field: The field, one of FIELDS.
+        :type field: str
+        :return: The value.
+        """
+        if self.exceptions and (index, field) in self.exceptions:
+            return self.exceptions[(index, field)]
+        column = self.columns[field]
+        if field in INTEGER_FIELDS:
+            return column[index]
+        if field == 'datahora':
+            return self._datahora(column[index])
+        if field in DECIMAL_FIELDS:
+            return f'{column[index]:.{self.columns[f"{field}_decimals"][index]}f}'
+        return self.strings[column[index]]
+
+    def row(self, index):
+        """
+        Rebuilds a merged message.
+        :param index: The position of the row.
+        :type index: int
+        :return: The merged message, equal to the one appended.
+        :rtype: dict
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('RecordBatch index out of range')
+        return {field: self.value(index, field) for field in FIELDS}
+
+    def __iter__(self):
+        columns = self.columns
+        strings = self.strings
+        datahora = self._datahora
+        # The rows without exceptions are rebuilt straight from the columns.
+        for index, (ID, curso, epoch, lat, lat_decimals, lon, lon_decimals, mID, speed, codMarinha, nome) in enumerate(zip(
+                columns['ID'], columns['curso'], columns['datahora'], columns['lat'], columns['lat_decimals'],
+                columns['lon'], columns['lon_decimals'], columns['mID'], columns['speed'], columns['codMarinha'],
+                columns['nome'])):
+            if index in self._exception_rows:
+                yield self.row(index)
+                continue
+            yield {'ID': ID, 'curso': curso, 'datahora': datahora(epoch), 'lat': f'{lat:.{lat_decimals}f}',
+                   'lon': f'{lon:.{lon_decimals}f}', 'mID': mID, 'speed': speed, 'codMarinha': strings[codMarinha],
+                   'nome': strings[nome]}
+
+    def take(self, indices):
+        """
+        A new batch with some rows, ex. the rows of a group in a given order.
+        :param indices: The positions of the rows.
+        :type indices: iterable of int
+        :return: The new batch.
+        :rtype: RecordBatch
+        """
+        batch = RecordBatch()
+        for index in indices:
+            batch.append(self.row(index))
+        return batch
+
+    def group_by(self, key):
+        """
+        The positions of the rows grouped by a key computed from the columns.
+        :param key: The key of a row from its position, ex.
+        lambda index: batch.columns['datahora'][index] // 86400 for the day.
+        :type key: function
+        :return: The positions of the rows of each key, in order.
+        :rtype: dict
+        """
+        groups = {}
+        for index in range(self._length):
+            groups.setdefault(key(index), array('l')).append(index)
+        return groups
+
+    def to_ndjson(self):
+        """
+        The rows as NEWLINEJSON, the same text as json.dump of each dict, see
+        ndjson.encode_json.
+        :return: A line per row.
+        :rtype: str
+        """
+        # Imported here, the ndjson module imports the FIELDS of this one.
+        from pipe_vms_brazil.ndjson import encode_json
+        return ''.join(map(encode_json, self))
+
+    @property
+    def nbytes(self):
+        """The bytes of the columns and the strings table, approximately."""
+        return (sum(column.itemsize * len(column) for column in self.columns.values())
+                + sum(len(value) for value in self.strings if isinstance(value, str)))
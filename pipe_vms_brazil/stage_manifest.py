@@ -0,0 +1,110 @@
+"""
+Manifests of the stages run for a day.
+
+After a stage runs it saves next to its output, in
+`<directory>_manifests/<stage>/<day>.json`, the checksums of its inputs and
+outputs and the options it ran with. When the stage runs again for the same
+day, ex. a retry of the DAG or a backfill, it is skipped if the checksums and
+the options are the same and its outputs are still there unchanged. The
+checksums come from the GCS metadata, so nothing is downloaded to check it.
+"""
+
+from pipe_vms_brazil import __version__
+
+from pipe_vms_brazil.storage import checksum, download, exists, upload_file
+
+import json, os, tempfile
+
+
+MANIFESTS_FOLDER = '_manifests'
+
+
+def manifest_path(directory, stage, day):
+    """
+    The path of the manifest of a stage and day.
+    :param directory: The output directory of the stage, expected with slash
+    at the end.
+    :type directory: str
+    :param stage: The name of the stage, ex. prepares_data.
+    :type stage: str
+    :param day: The day, YYYY-mm-dd.
+    :type day: str
+    :return: The path of the manifest.
+    :rtype: str
+    """
+    return f'{directory}{MANIFESTS_FOLDER}/{stage}/{day}.json'
+
+def checksums(paths, project=None):
+    """
+    The checksums of several files.
+    :param paths: The paths, gs://, file:// or local.
+    :type paths: list of str
+    :param project: The GCP project. Default None.
+    :type project: str
+    :return: The checksum of each path, None for the missing ones.
+    :rtype: dict
+    """
+    return {path: checksum(path, project) for path in paths}
+
+def load_manifest(path):
+    """
+    Loads a manifest.
+    :param path: The path of the manifest, gs://, file:// or local.
+    :type path: str
+    :return: The manifest or None if it does not exist.
+    :rtype: dict
+    """
+    if not exists(path):
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'manifest.json')
+        download(path, local_path)
+        with open(local_path, 'r') as manifest:
+            return json.load(manifest)
+
+def save_manifest(path, stage, day, inputs, outputs, options):
+    """
+    Saves the manifest of a stage that ran.
+    :param path: The path of the manifest, gs://, file:// or local.
+    :type path: str
+    :param stage: The name of the stage.
+    :type stage: str
+    :param day: The day, YYYY-mm-dd.
+    :type day: str
+    :param inputs: The checksum of each input.
+    :type inputs: dict
+    :param outputs: The paths of the outputs.
+    :type outputs: list of str
+    :param options: The options changing the outputs.
+    :type options: dict
+    :return: The manifest.
+    :rtype: dict
+    """
+    manifest = dict(stage=stage, day=day, version=__version__, inputs=inputs, outputs=checksums(outputs),
+                    options=options)
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'manifest.json')
+        with open(local_path, 'w') as output:
+            json.dump(manifest, output, indent=2, sort_keys=True)
+        upload_file(local_path, path)
+    return manifest
+
+def is_unchanged(manifest, inputs, options):
+    """
+    If a stage can be skipped, it ran with the same inputs and options and
+    its outputs did not change since.
+    :param manifest: The manifest of the last run, None if it never ran.
+    :type manifest: dict
+    :param inputs: The checksum of each input now.
+    :type inputs: dict
+    :param options: The options now.
+    :type options: dict
+    :return: True if the stage can be skipped.
+    :rtype: bool
+    """
+    if manifest is None or None in inputs.values():
+        return False
+    if manifest.get('version') != __version__ or manifest.get('inputs') != inputs or manifest.get('options') != options:
+        return False
+    outputs = manifest.get('outputs') or {}
+    return bool(outputs) and checksums(list(outputs)) == outputs
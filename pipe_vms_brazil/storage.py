@@ -0,0 +1,200 @@
+"""
+Storage of the pipeline files.
+
+The paths can be GCS, `gs://bucket/prefix`, or the local file system,
+`file:///directory` or a plain path, so the whole pipeline can run without
+GCS. The GCS client is created once per project and reused, and the
+transfers of several files run concurrently on a thread pool. Big files are
+transferred in chunks with resumable uploads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pathlib import Path
+
+from pipe_vms_brazil import metrics
+
+import base64, hashlib, os, re, shutil, threading
+
+
+# Multiple of 256KiB as required by GCS.
+CHUNK_SIZE = 32 << 20
+
+WORKERS = 8
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(project=None):
+    """
+    The GCS client of a project, created only once.
+    :param project: The GCP project. Default None, the one of the environment.
+    :type project: str
+    :return: The client.
+    :rtype: google.cloud.storage.Client
+    """
+    with _clients_lock:
+        client = _clients.get(project)
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client(project) if project else storage.Client()
+            _clients[project] = client
+        return client
+
+def parse_path(path):
+    """
+    Splits a storage path.
+    :param path: The path, gs://bucket/prefix, file:///directory or local.
+    :type path: str
+    :return: The scheme, gs or file, the bucket, None for file, and the path
+    inside it.
+    :rtype: tuple
+    """
+    gcs_search = re.search('gs://([^/]*)/?(.*)', path)
+    if gcs_search:
+        return 'gs', gcs_search.group(1), gcs_search.group(2)
+    if path.startswith('file://'):
+        path = path[len('file://'):]
+    return 'file', None, path
+
+def _blob(path, project=None, chunk_size=CHUNK_SIZE):
+    _, bucket, name = parse_path(path)
+    return get_client(project).bucket(bucket).blob(name, chunk_size=chunk_size)
+
+def exists(path, project=None):
+    """
+    If a file exists.
+    :param path: The path of the file, gs://, file:// or local.
+    :type path: str
+    :param project: The GCP project. Default None.
+    :type project: str
+    :return: True if it exists.
+    :rtype: bool
+    """
+    scheme, _, name = parse_path(path)
+    if scheme == 'gs':
+        return _blob(path, project).exists()
+    return os.path.exists(name)
+
+def checksum(path, project=None):
+    """
+    The checksum of the content of a file, read from the GCS metadata
+    without downloading it.
+    :param path: The path of the file, gs://, file:// or local.
+    :type path: str
+    :param project: The GCP project. Default None.
+    :type project: str
+    :return: The base64 MD5 as GCS reports it, or the CRC32C of the composite
+    objects, None if the file does not exist.
+    :rtype: str
+    """
+    scheme, bucket, name = parse_path(path)
+    if scheme == 'gs':
+        blob = get_client(project).bucket(bucket).get_blob(name)
+        if blob is None:
+            return None
+        return blob.md5_hash or f'crc32c:{blob.crc32c}'
+    if not os.path.exists(name):
+        return None
+    digest = hashlib.md5()
+    with open(name, 'rb') as content:
+        for chunk in iter(lambda: content.read(1 << 20), b''):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode('ascii')
+
+def list_files(directory, project=None):
+    """
+    Lists the files inside a directory, recursively.
+    :param directory: The directory, gs://, file:// or local. Expected with
+    slash at the end.
+    :type directory: str
+    :param project: The GCP project. Default None.
+    :type project: str
+    :return: The paths of the files, with the scheme of the directory, sorted.
+    :rtype: list
+    """
+    scheme, bucket, name = parse_path(directory)
+    if scheme == 'gs':
+        return sorted(f'gs://{bucket}/{blob.name}' for blob in get_client(project).list_blobs(bucket, prefix=name)
+                      if not blob.name.endswith('/'))
+    if not os.path.isdir(name):
+        return []
+    prefix = directory[:len(directory) - len(name)]
+    return sorted(prefix + os.path.join(root, filename) for root, _, filenames in os.walk(name)
+                  for filename in filenames)
+
+def download(source, local_path, project=None):
+    """
+    Downloads a file.
+    :param source: The path of the file, gs://, file:// or local.
+    :type source: str
+    :param local_path: The local path where to save it.
+    :type local_path: str
+    :param project: The GCP project. Default None.
+    :type project: str
+    """
+    scheme, _, name = parse_path(source)
+    if scheme == 'gs':
+        _blob(source, project).download_to_filename(local_path)
+    else:
+        shutil.copyfile(name, local_path)
+    metrics.count('bytes_downloaded', os.path.getsize(local_path))
+    print("File <{}> downloaded to <{}>.".format(source, local_path))
+
+def download_many(transfers, project=None, workers=WORKERS):
+    """
+    Downloads several files concurrently.
+    :param transfers: The source and the local path of each file.
+    :type transfers: list of tuple
+    :param project: The GCP project. Default None.
+    :type project: str
+    :param workers: The maximum transfers at the same time. Default 8.
+    :type workers: int
+    """
+    with ThreadPoolExecutor(max(1, min(workers, len(transfers)))) as executor:
+        for _ in executor.map(lambda transfer: download(*transfer, project=project), transfers):
+            pass
+
+def upload_file(local_path, destination, project=None):
+    """
+    Uploads a file.
+    :param local_path: The local path of the file.
+    :type local_path: str
+    :param destination: The path where to save it, gs://, file:// or local.
+    :type destination: str
+    :param project: The GCP project. Default None.
+    :type project: str
+    """
+    scheme, _, name = parse_path(destination)
+    if scheme == 'gs':
+        _blob(destination, project).upload_from_filename(str(local_path))
+    else:
+        if os.path.dirname(name):
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+        shutil.copyfile(local_path, name)
+    metrics.count('bytes_uploaded', os.path.getsize(local_path))
+    print("File from file system <{}> uploaded to <{}>.".format(local_path, destination))
+
+def upload(pattern_file, directory, project=None, workers=WORKERS):
+    """
+    Uploads concurrently the files starting with a pattern to a directory.
+    :param pattern_file: The pattern file without wildcard.
+    :type pattern_file: str
+    :param directory: The destination directory, gs://, file:// or local.
+    Expected with slash at the end.
+    :type directory: str
+    :param project: The GCP project. Default None.
+    :type project: str
+    :param workers: The maximum transfers at the same time. Default 8.
+    :type workers: int
+    :return: The local files uploaded.
+    :rtype: list
+    """
+    pattern_path = Path(pattern_file)
+    filenames = sorted(pattern_path.parent.glob(pattern_path.name + '*'))
+    if filenames:
+        with ThreadPoolExecutor(max(1, min(workers, len(filenames)))) as executor:
+            for _ in executor.map(lambda filename: upload_file(filename, directory + filename.name, project), filenames):
+                pass
+    return filenames
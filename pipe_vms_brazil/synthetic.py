@@ -0,0 +1,207 @@
+"""
+Generates synthetic Brazil VMS payloads.
+
+The devices and messages have the shape the API returns, `{"devices": [...]}`
+and `{"mensagens": [...]}` with the `datahora` as `dd-mm-YYYY HH:MM:SS`, so
+they can feed the prepare and historical steps locally. Each device follows a
+random walk along the Brazilian coast reporting a configurable amount of
+pings per day. The same seed always generates the same payloads.
+
+Ex.
+python -m pipe_vms_brazil.synthetic -d 2021-02-25 -f 1500 -p 24 -o ./synthetic/
+"""
+
+from datetime import date, datetime, timedelta
+
+import argparse, gzip, json, os, random
+
+
+# FORMATS
+FORMAT_DT = '%Y-%m-%d'
+SOURCE_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+# Roughly the current daily volume of the API.
+BASE_FLEET_SIZE = 1500
+BASE_PINGS_PER_DAY = 24
+
+# Latitude, longitude of the coast where the vessels start.
+COAST = [(-3.7, -38.5), (-8.0, -34.9), (-12.9, -38.5), (-20.3, -40.3), (-22.9, -43.2),
+         (-23.9, -46.3), (-26.9, -48.6), (-28.5, -48.8), (-32.0, -52.1), (-1.4, -48.5)]
+
+NAMES = ['ESTRELA', 'MAR', 'SOL', 'ATLANTICO', 'PESCADOR', 'NOSSA SENHORA', 'SAO PEDRO', 'BRISA',
+         'AURORA', 'NETUNO', 'CORAL', 'GAIVOTA', 'TUBARAO', 'SARDINHA', 'DOURADO', 'MARAJO']
+
+
+def generate_devices(fleet_size=BASE_FLEET_SIZE, seed=0):
+    """
+    Generates the devices of a fleet.
+    :param fleet_size: The amount of devices. Default 1500.
+    :type fleet_size: int
+    :param seed: The seed of the random generator. Default 0.
+    :type seed: int
+    :return: The devices as they come from the API.
+    :rtype: list of dict
+    """
+    generator = random.Random(seed)
+    devices = []
+    for device_id in range(1, fleet_size + 1):
+        devices.append(dict(ID=device_id, codMarinha=f'{generator.randrange(10**9, 10**10)}',
+                            nome=f'{generator.choice(NAMES)} {generator.choice(NAMES)} {generator.randint(1, 20)}'))
+    return devices
+
+def generate_messages(devices, day, pings_per_day=BASE_PINGS_PER_DAY, seed=0, unknown_rate=0.0, first_mid=1):
+    """
+    Generates the messages of a day, a round of pings of the fleet after
+    another.
+    :param devices: The devices sending messages.
+    :type devices: list of dict
+    :param day: The day of the messages.
+    :type day: date
+    :param pings_per_day: The messages of each device in the day. Default 24.
+    :type pings_per_day: int
+    :param seed: The seed of the random generator. Default 0.
+    :type seed: int
+    :param unknown_rate: The ratio of messages from devices not in the list.
+    Default 0.
+    :type unknown_rate: float
+    :param first_mid: The mID of the first message. Default 1.
+    :type first_mid: int
+    :return: The messages as they come from the API.
+    :rtype: generator of dict
+    """
+    generator = random.Random(f'{seed}-{day}')
+    midnight = datetime(day.year, day.month, day.day)
+    interval = 86400 / max(1, pings_per_day)
+    unknown_id = max([device['ID'] for device in devices] or [0]) + 1
+    positions = {}
+    for device in devices:
+        lat, lon = generator.choice(COAST)
+        positions[device['ID']] = [lat + generator.uniform(-0.5, 0.5), lon + generator.uniform(0.0, 2.0),
+                                   generator.uniform(0, 360)]
+    mid = first_mid
+    for ping in range(pings_per_day):
+        for device in devices:
+            position = positions[device['ID']]
+            position[2] = (position[2] + generator.gauss(0, 20)) % 360
+            speed = generator.randint(0, 20)
+            position[0] += generator.gauss(0, 0.01) * speed / 10
+            position[1] += generator.gauss(0, 0.01) * speed / 10
+            seconds = min(86399, int(ping * interval + generator.uniform(0, interval)))
+            device_id = unknown_id if generator.random() < unknown_rate else device['ID']
+            yield dict(ID=device_id, mID=mid,
+                       datahora=(midnight + timedelta(seconds=seconds)).strftime(SOURCE_FORMAT),
+                       lat=f'{position[0]:.6f}', lon=f'{position[1]:.6f}',
+                       curso=int(position[2]), speed=speed)
+            mid += 1
+
+def write_payload(path, key, items):
+    """
+    Writes a payload as the API returns it, without keeping it in memory.
+    GZIP compressed if the path ends with .gz.
+    :param path: The path of the file.
+    :type path: str
+    :param key: The key of the list, devices or mensagens.
+    :type key: str
+    :param items: The elements of the list.
+    :type items: iterable of dict
+    :return: The amount of elements written.
+    :rtype: int
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    count = 0
+    with (gzip.open(path, 'wt', compresslevel=6) if path.endswith('.gz') else open(path, 'w')) as payload:
+        payload.write(f'{{"{key}": [')
+        for item in items:
+            if count:
+                payload.write(', ')
+            json.dump(item, payload)
+            count += 1
+        payload.write(']}')
+    return count
+
+def write_day(directory, day, fleet_size=BASE_FLEET_SIZE, pings_per_day=BASE_PINGS_PER_DAY, seed=0, unknown_rate=0.0):
+    """
+    Writes the devices and messages of a day as the fetch step does,
+    devices/<day>.json.gz and messages/<day>.json.gz.
+    :param directory: The local directory.
+    :type directory: str
+    :param day: The day of the messages.
+    :type day: date
+    :param fleet_size: The amount of devices. Default 1500.
+    :type fleet_size: int
+    :param pings_per_day: The messages of each device in the day. Default 24.
+    :type pings_per_day: int
+    :param seed: The seed of the random generator. Default 0.
+    :type seed: int
+    :param unknown_rate: The ratio of messages from unknown devices. Default 0.
+    :type unknown_rate: float
+    :return: The amount of messages written.
+    :rtype: int
+    """
+    devices = generate_devices(fleet_size, seed)
+    write_payload(os.path.join(directory, 'devices', f'{day.strftime(FORMAT_DT)}.json.gz'), 'devices', devices)
+    return write_payload(os.path.join(directory, 'messages', f'{day.strftime(FORMAT_DT)}.json.gz'), 'mensagens',
+                         generate_messages(devices, day, pings_per_day, seed, unknown_rate))
+
+def write_year(directory, first_day, days, fleet_size=BASE_FLEET_SIZE, pings_per_day=BASE_PINGS_PER_DAY, seed=0,
+               unknown_rate=0.0):
+    """
+    Writes the devices and messages of consecutive days as the historical step
+    expects, Devices.txt and <year>.json.
+    :param directory: The local directory.
+    :type directory: str
+    :param first_day: The first day of the messages.
+    :type first_day: date
+    :param days: The amount of days, in the year of the first day.
+    :type days: int
+    :param fleet_size: The amount of devices. Default 1500.
+    :type fleet_size: int
+    :param pings_per_day: The messages of each device in a day. Default 24.
+    :type pings_per_day: int
+    :param seed: The seed of the random generator. Default 0.
+    :type seed: int
+    :param unknown_rate: The ratio of messages from unknown devices. Default 0.
+    :type unknown_rate: float
+    :return: The amount of messages written.
+    :rtype: int
+    """
+    devices = generate_devices(fleet_size, seed)
+    write_payload(os.path.join(directory, 'Devices.txt'), 'devices', devices)
+    per_day = fleet_size * pings_per_day
+    messages = (message
+                for n in range(days) if (first_day + timedelta(n)).year == first_day.year
+                for message in generate_messages(devices, first_day + timedelta(n), pings_per_day, seed,
+                                                 unknown_rate, 1 + n * per_day))
+    return write_payload(os.path.join(directory, f'{first_day.year}.json'), 'mensagens', messages)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates synthetic devices'
+                                     'and messages with the shape returned by'
+                                     'the Brazil API.')
+    parser.add_argument('-d','--query_date', help='The first date to be'
+                        'generated. Expects a str in format YYYY-MM-DD', required=True)
+    parser.add_argument('-o','--output_directory', help='The local directory'
+                        'where the payloads will be written.', required=True)
+    parser.add_argument('-f','--fleet_size', help='The amount of devices.',
+                        required=False, default=BASE_FLEET_SIZE, type=int)
+    parser.add_argument('-p','--pings_per_day', help='The messages of each'
+                        'device per day.', required=False, default=BASE_PINGS_PER_DAY, type=int)
+    parser.add_argument('-u','--unknown_rate', help='The ratio of messages'
+                        'from devices not in the list.', required=False, default=0.0, type=float)
+    parser.add_argument('-s','--seed', help='The seed of the random'
+                        'generator.', required=False, default=0, type=int)
+    parser.add_argument('-y','--historical_days', help='Writes the Devices.txt'
+                        'and <year>.json of the historical step with this amount'
+                        'of days instead of a single fetched day.', required=False, default=None, type=int)
+    args = parser.parse_args()
+    query_date = date.fromisoformat(args.query_date)
+
+    if args.historical_days:
+        total = write_year(args.output_directory, query_date, args.historical_days, args.fleet_size,
+                           args.pings_per_day, args.seed, args.unknown_rate)
+    else:
+        total = write_day(args.output_directory, query_date, args.fleet_size, args.pings_per_day, args.seed,
+                          args.unknown_rate)
+    print(f'Total of messages generated {total} in {args.output_directory}')
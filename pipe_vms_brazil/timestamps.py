@@ -0,0 +1,108 @@
+"""
+Normalises the `datahora` of the Brazil messages.
+
+The API sends `dd-mm-YYYY HH:MM:SS` and the merged output expects
+`YYYY-mm-dd HH:MM:SS`. As the fields have fixed width they are reordered
+directly and the date part is memoised, because all the messages of a day
+share it. Anything out of the fixed width format falls back to strptime, so
+the result is the same as the previous conversion.
+"""
+
+from datetime import date, datetime
+
+import calendar
+
+
+SOURCE_FORMAT = '%d-%m-%Y %H:%M:%S'
+TARGET_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_DIGITS = frozenset('0123456789')
+
+
+class TimestampConverter(object):
+    """Converts the datahora of the messages, reporting the malformed ones."""
+
+    def __init__(self, max_samples=10):
+        """
+        Constructs the converter.
+
+        :param max_samples: The amount of malformed values kept as samples to
+        be reported. Default 10.
+        :type max_samples: int
+        """
+        self.max_samples = max_samples
+        self.malformed = 0
+        self.malformed_samples = []
+        self._dates = {}
+
+    def _date(self, value):
+        """
+        Converts the date part, memoised.
+        :param value: The date part, dd-mm-YYYY.
+        :type value: str
+        :return: The date as YYYY-mm-dd and the epoch of its midnight, or None
+        if it does not have the fixed width format.
+        :rtype: tuple
+        """
+        converted = self._dates.get(value)
+        if converted is None:
+            day, month, year = value[0:2], value[3:5], value[6:10]
+            if (value[2] != '-' or value[5] != '-' or year[0] == '0'
+                    or not _DIGITS.issuperset(day + month + year)):
+                return None
+            try:
+                midnight = date(int(year), int(month), int(day))
+            except ValueError:
+                return None
+            converted = (f'{year}-{month}-{day}', calendar.timegm(midnight.timetuple()))
+            self._dates[value] = converted
+        return converted
+
+    def _split(self, value):
+        """
+        Splits the datahora in its converted date and the time in seconds.
+        :param value: The datahora as it comes from the API.
+        :type value: str
+        :return: The converted date part, the epoch of its midnight, the time
+        part and the seconds of the day. None if it is malformed.
+        :rtype: tuple
+        """
+        if isinstance(value, str) and len(value) == 19 and value[10] == ' ' and value[13] == ':' and value[16] == ':':
+            converted = self._date(value[:10])
+            hours, minutes, seconds = value[11:13], value[14:16], value[17:19]
+            if converted is not None and _DIGITS.issuperset(hours + minutes + seconds):
+                hours, minutes, seconds = int(hours), int(minutes), int(seconds)
+                if hours < 24 and minutes < 60 and seconds < 60:
+                    return converted[0], converted[1], value[11:], hours * 3600 + minutes * 60 + seconds
+        # Out of the fixed width format, ex. without zero padding.
+        try:
+            parsed = datetime.strptime(value, SOURCE_FORMAT)
+        except (TypeError, ValueError):
+            self.malformed += 1
+            if len(self.malformed_samples) < self.max_samples:
+                self.malformed_samples.append(value)
+            return None
+        day, time = parsed.strftime(TARGET_FORMAT).split(' ')
+        return day, calendar.timegm(parsed.date().timetuple()), time, parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+    def to_datahora(self, value):
+        """
+        Converts the datahora from dd-mm-YYYY HH:MM:SS to YYYY-mm-dd HH:MM:SS.
+        :param value: The datahora as it comes from the API.
+        :type value: str
+        :return: The converted datahora or None if it is malformed.
+        :rtype: str
+        """
+        split = self._split(value)
+        return None if split is None else f'{split[0]} {split[2]}'
+
+    def to_epoch(self, value):
+        """
+        Converts the datahora to the seconds since epoch, considered as UTC.
+        :param value: The datahora as it comes from the API.
+        :type value: str
+        :return: The seconds since epoch or None if it is malformed.
+        :rtype: int
+        """
+        split = self._split(value)
+        return None if split is None else split[1] + split[3]
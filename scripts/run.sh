@@ -6,7 +6,9 @@ display_usage() {
   echo "Available Commands"
   echo "  fetch_brazil_vms_data        Download BRAZIL VMS data to GCS."
   echo "  prepares_brazil_vms_data     Prepares the BRAZIL data using devices and messages get from the Brazilian API."
+  echo "  fetch_prepares_brazil_vms_data  Fetches and prepares the BRAZIL data in a single step, streaming the API."
   echo "  load_brazil_vms_data         Load BRAZIL VMS data from GCS to BQ."
+  echo "  load_days_brazil_vms_data    Load BRAZIL VMS data of a date range from GCS to BQ in a single run."
 }
 
 
@@ -19,17 +21,27 @@ fi
 case $1 in
 
   fetch_brazil_vms_data)
-    echo "Running python -m pipe_vms_brazil.brazil_api_client ${@:2}"
-    python -m pipe_vms_brazil.brazil_api_client ${@:2}
+    echo "Running pipe-vms-brazil fetch ${@:2}"
+    pipe-vms-brazil fetch ${@:2}
     ;;
 
   prepares_brazil_vms_data)
-    echo "Running python -m pipe_vms_brazil.prepares_data ${@:2}"
-    python -m pipe_vms_brazil.prepares_data ${@:2}
+    echo "Running pipe-vms-brazil prepare ${@:2}"
+    pipe-vms-brazil prepare ${@:2}
+    ;;
+
+  fetch_prepares_brazil_vms_data)
+    echo "Running pipe-vms-brazil fetch-prepare ${@:2}"
+    pipe-vms-brazil fetch-prepare ${@:2}
     ;;
 
   load_brazil_vms_data)
-    ${THIS_SCRIPT_DIR}/gcs2bq.sh "${@:2}"
+    ${THIS_SCRIPT_DIR}/../pipe_vms_brazil/assets/gcs2bq.sh "${@:2}"
+    ;;
+
+  load_days_brazil_vms_data)
+    echo "Running pipe-vms-brazil load ${@:2}"
+    pipe-vms-brazil load ${@:2}
     ;;
 
   *)
@@ -6,7 +6,7 @@ Setup script for pipe-vms-brazil
 
 from pipe_tools.beam.requirements import requirements as DATAFLOW_PINNED_DEPENDENCIES
 
-from setuptools import setup
+from setuptools import find_packages, setup
 
 import codecs
 
@@ -36,8 +36,19 @@ setup(
     license=package.__license__.strip(),
     long_description=readme,
     name=PACKAGE_NAME,
+    packages=find_packages(include=['pipe_vms_brazil', 'pipe_vms_brazil.*']),
+    package_data={'pipe_vms_brazil.assets': ['*.json', '*.sh']},
     url=package.__source__,
     version=package.__version__,
     zip_safe=True,
-    dependency_links=DEPENDENCY_LINKS
+    dependency_links=DEPENDENCY_LINKS,
+    entry_points={
+        'console_scripts': ['pipe-vms-brazil=pipe_vms_brazil.cli:main'],
+    },
+    extras_require={
+        'parquet': ['pyarrow'],
+        'avro': ['fastavro'],
+        'orjson': ['orjson'],
+        'enrich': ['numpy'],
+    }
 )
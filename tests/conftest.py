@@ -0,0 +1,65 @@
+from datetime import date
+
+from pipe_vms_brazil.join import index_devices, join_messages
+
+from pipe_vms_brazil.mock_api import MockApiServer
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages
+
+import threading
+
+import pytest
+
+
+class _ScriptedServer(MockApiServer):
+    """Answers the faults given in order, then healthy responses."""
+
+    def __init__(self, address, faults=(), **options):
+        super().__init__(address, **options)
+        self.faults = list(faults)
+
+    def draw(self):
+        with self._lock:
+            self.stats['requests'] += 1
+            status, truncated = self.faults.pop(0) if self.faults else (0, False)
+            if status:
+                self.stats['errors'] += 1
+            if truncated:
+                self.stats['truncated'] += 1
+            return status, truncated
+
+
+@pytest.fixture
+def mock_api():
+    """
+    Serves MockApiServers in background threads until the test ends. The
+    faults, (status, truncated) of each response, replace the random ones.
+    """
+    servers = []
+
+    def serve(faults=None, **options):
+        options = dict(dict(token='token', fleet_size=10, pings_per_day=12), **options)
+        if faults is None:
+            server = MockApiServer(('127.0.0.1', 0), **options)
+        else:
+            server = _ScriptedServer(('127.0.0.1', 0), faults, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def merged_rows():
+    """
+    Merges the synthetic messages of a day with their devices, the name of
+    the first device with characters to escape.
+    """
+    def merge(fleet_size=50, pings_per_day=4):
+        devices = generate_devices(fleet_size)
+        devices[0]['nome'] = 'JOÃO "ÇA" \\ 1'
+        return list(join_messages(index_devices(devices), generate_messages(devices, date(2020, 2, 29), pings_per_day)))
+    return merge
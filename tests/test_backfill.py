@@ -0,0 +1,63 @@
+from datetime import date
+
+from pipe_vms_brazil.backfill import BackfillManifest, backfill, day_ranges
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages, write_payload
+
+import json, os
+
+
+def _write_year(directory):
+    devices = generate_devices(15, seed=2)
+    messages = [message for day in range(1, 6) for message in generate_messages(devices, date(2021, 1, day), 4, seed=day)]
+    write_payload(os.path.join(directory, 'Devices.txt'), 'devices', devices)
+    write_payload(os.path.join(directory, '2021.json'), 'mensagens', messages)
+
+
+def test_the_shards_are_ranges_of_days_of_the_same_year():
+    assert day_ranges(date(2020, 12, 30), date(2021, 1, 4), 2) == [
+        (2020, date(2020, 12, 30), date(2020, 12, 31)),
+        (2021, date(2021, 1, 1), date(2021, 1, 2)),
+        (2021, date(2021, 1, 3), date(2021, 1, 4)),
+    ]
+    assert len(day_ranges(date(2021, 1, 1), date(2021, 12, 31), 92)) == 4
+
+
+def test_the_manifest_ignores_a_truncated_line(tmp_path):
+    path = os.path.join(tmp_path, 'manifest.jsonl')
+    manifest = BackfillManifest(path)
+    manifest.record('2021-01-01', 60, 1)
+    with open(path, 'a') as cut:
+        cut.write('{"day": "2021-01-02", "mess')
+    manifest = BackfillManifest(path)
+    assert manifest.done('2021-01-01') and not manifest.done('2021-01-02')
+    assert manifest.days['2021-01-01'] == dict(day='2021-01-01', messages=60, files=1)
+
+
+def test_a_single_year_is_split_in_parallel_shards(tmp_path):
+    input_directory, output_directory = os.path.join(tmp_path, 'input'), os.path.join(tmp_path, 'output')
+    _write_year(input_directory)
+    manifest_path = os.path.join(tmp_path, 'manifest.jsonl')
+
+    failed = backfill(date(2021, 1, 1), date(2021, 1, 5), input_directory, output_directory + '/', manifest_path,
+                      processes=3)
+    assert not failed
+    assert sorted(os.listdir(os.path.join(output_directory, '2021'))) == [f'2021-01-0{day}.json.gz' for day in range(1, 6)]
+    assert {day: entry['messages'] for day, entry in BackfillManifest(manifest_path).days.items()} == {
+        f'2021-01-0{day}': 60 for day in range(1, 6)}
+
+
+def test_a_backfill_resumes_the_days_missing_in_the_manifest(tmp_path):
+    input_directory, output_directory = os.path.join(tmp_path, 'input'), os.path.join(tmp_path, 'output')
+    _write_year(input_directory)
+    manifest_path = os.path.join(tmp_path, 'manifest.jsonl')
+    with open(manifest_path, 'w') as manifest:
+        for day in ('2021-01-01', '2021-01-02'):
+            manifest.write(json.dumps(dict(day=day, messages=60, files=1)) + '\n')
+        manifest.write('{"day": "2021-01-03", "mess')
+
+    failed = backfill(date(2021, 1, 1), date(2021, 1, 5), input_directory, output_directory + '/', manifest_path,
+                      processes=2, days_per_shard=2)
+    assert not failed
+    assert sorted(os.listdir(os.path.join(output_directory, '2021'))) == [f'2021-01-0{day}.json.gz' for day in (3, 4, 5)]
+    assert sorted(BackfillManifest(manifest_path).days) == [f'2021-01-0{day}' for day in range(1, 6)]
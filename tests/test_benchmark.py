@@ -0,0 +1,10 @@
+from pipe_vms_brazil.benchmark import run
+
+
+def test_the_prepare_stages_run_with_and_without_dedup(tmp_path):
+    results = run([1], ['ndjson'], historical_days=1, trace_memory=False, fleet_size=5, pings_per_day=2,
+                  work_directory=str(tmp_path))
+    assert [result['stage'] for result in results] == [
+        'parse_devices', 'parse_messages', 'join', 'prepare_ndjson', 'prepare_ndjson_no_dedup', 'split_year']
+    records = {result['stage']: result['records'] for result in results}
+    assert records['prepare_ndjson'] == records['prepare_ndjson_no_dedup'] == records['join'] == 10
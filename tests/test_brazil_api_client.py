@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+
+from email.utils import format_datetime
+
+from types import SimpleNamespace
+
+from pipe_vms_brazil.brazil_api_client import BrazilApiClient, RateLimiter, day_windows
+
+from pipe_vms_brazil.json_stream import iter_array
+
+import gzip, json, os, pytest, time
+
+
+@pytest.mark.parametrize('retry_after, expected', [
+    ('2', 2.0),
+    ('3600', 30.0),
+    (format_datetime(datetime.now(timezone.utc) + timedelta(days=1), usegmt=True), 30.0),
+    ('-5', 0.0),
+])
+def test_the_retry_after_is_capped(retry_after, expected):
+    client = BrazilApiClient('http://localhost', 'token', backoff_cap=30.0)
+    assert client.backoff(0, SimpleNamespace(headers={'Retry-After': retry_after})) == expected
+    client.close()
+
+
+def _read(path):
+    with gzip.open(path, 'rb') as payload:
+        return list(iter_array(payload, 'mensagens'))
+
+
+def test_the_rate_limiter_spaces_the_requests():
+    limiter = RateLimiter(20)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.2
+
+
+def test_the_rate_limiter_is_unlimited_by_default():
+    limiter = RateLimiter()
+    start = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert limiter.interval == 0 and time.monotonic() - start < 0.1
+
+
+@pytest.mark.parametrize('windows', [1, 3, 7])
+def test_the_windows_cover_the_day_without_overlaps(windows):
+    bounds = day_windows(datetime(2021, 2, 25, 13), windows)
+    assert len(bounds) == windows
+    assert bounds[0][0] == datetime(2021, 2, 25) and bounds[-1][1] == datetime(2021, 2, 25, 23, 59, 59)
+    assert all(end + timedelta(seconds=1) == start for (_, end), (start, _) in zip(bounds, bounds[1:]))
+
+
+@pytest.mark.parametrize('stream', [False, True])
+@pytest.mark.parametrize('fault', [(500, False), (503, False), (0, True)])
+def test_a_failed_response_is_retried_once_in_the_file(tmp_path, mock_api, stream, fault):
+    path = os.path.join(tmp_path, 'messages.json.gz')
+    server = mock_api(faults=[fault])
+    client = BrazilApiClient(server.endpoint, 'token', backoff_base=0.01)
+    assert client.get_messages(datetime(2021, 2, 25), path, stream=stream)
+    client.close()
+    assert server.stats['requests'] == 2
+    assert len(_read(path)) == 120
+    assert os.listdir(tmp_path) == ['messages.json.gz']
+
+
+def test_a_retried_day_replaces_the_previous_file(tmp_path, mock_api):
+    path = os.path.join(tmp_path, 'messages.json.gz')
+    server = mock_api()
+    client = BrazilApiClient(server.endpoint, 'token', backoff_base=0.01)
+    assert client.get_messages(datetime(2021, 2, 25), path)
+    assert client.get_messages(datetime(2021, 2, 25), path)
+    client.close()
+    with gzip.open(path, 'rt') as payload:
+        assert len(json.load(payload)['mensagens']) == 120
+
+
+def test_the_too_many_requests_wait_is_capped(tmp_path, mock_api):
+    path = os.path.join(tmp_path, 'messages.json.gz')
+    server = mock_api(faults=[(429, False)] * 2)
+    client = BrazilApiClient(server.endpoint, 'token', backoff_base=0.01, backoff_cap=0.1)
+    start = time.monotonic()
+    assert client.get_messages(datetime(2021, 2, 25), path, stream=True)
+    client.close()
+    assert time.monotonic() - start < 1
+    assert server.stats['requests'] == 3 and server.stats['errors'] == 2
+
+
+def test_the_client_gives_up_after_the_retries(tmp_path, mock_api):
+    path = os.path.join(tmp_path, 'messages.json.gz')
+    server = mock_api(error_rate=1.0)
+    client = BrazilApiClient(server.endpoint, 'token', max_retries=2, backoff_base=0.01, backoff_cap=0.01)
+    assert not client.get_messages(datetime(2021, 2, 25), path)
+    client.close()
+    assert server.stats['requests'] == server.stats['errors'] == 2
+    assert not os.listdir(tmp_path)
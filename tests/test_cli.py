@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from pipe_vms_brazil.cli import COMMANDS, PROG
+
+import json, subprocess, sys
+
+import pytest
+
+
+# Only imported when a step uses them, never to start it.
+HEAVY_MODULES = ('requests', 'urllib3', 'google', 'numpy', 'pyarrow', 'fastavro', 'orjson', 'cProfile', 'pstats')
+
+# About ten times the start of a step today, it only catches regressions.
+STARTUP_BUDGET_SECONDS = 0.5
+
+STARTUP = '''
+from pipe_vms_brazil import cli
+import json, sys, time
+start = time.perf_counter()
+try:
+    cli.main([sys.argv[1], '--help'])
+except SystemExit as exit:
+    code = exit.code
+json.dump({'code': code, 'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}, sys.stderr)
+'''
+
+
+@pytest.mark.parametrize('command', list(COMMANDS))
+def test_starts_a_step_without_the_heavy_dependencies(command):
+    process = subprocess.run([sys.executable, '-c', STARTUP, command], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True,
+                             cwd=Path(__file__).resolve().parent.parent)
+    startup = json.loads(process.stderr)
+    assert startup['code'] == 0
+    assert process.stdout.startswith(f'usage: {PROG} {command}')
+    assert [module for module in startup['modules'] if module.split('.')[0] in HEAVY_MODULES] == []
+    assert startup['seconds'] < STARTUP_BUDGET_SECONDS
+
+
+@pytest.mark.parametrize('command, arguments', [
+    ('prepare', ['-i', 'gs://bucket/input/']),
+    ('fetch-prepare', []),
+])
+def test_the_enrichment_without_numpy_fails_parsing_the_arguments(command, arguments, monkeypatch, capsys):
+    from pipe_vms_brazil import cli
+    monkeypatch.setitem(sys.modules, 'numpy', None)
+    with pytest.raises(SystemExit) as exit:
+        cli.main([command, '-d', '2021-02-25', '-o', 'gs://bucket/output/', '-en'] + arguments)
+    assert exit.value.code == 2
+    assert 'pip install pipe-vms-brazil[enrich]' in capsys.readouterr().err
@@ -0,0 +1,48 @@
+from datetime import date
+
+from pipe_vms_brazil.dedup import ExternalSorter
+
+from pipe_vms_brazil.join import join_messages
+
+from pipe_vms_brazil.records import RecordBatch
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages
+
+import random
+
+
+def _rows():
+    devices = generate_devices(30, seed=5)
+    messages = list(generate_messages(devices, date(2021, 2, 25), 8, seed=5))
+    rows = list(join_messages({device['ID']: device for device in devices}, messages))
+    # Repeated by overlapping fetches, in any order.
+    repeated = rows + random.Random(5).sample(rows, 50)
+    random.Random(6).shuffle(repeated)
+    return rows, repeated
+
+
+def test_sorts_by_id_and_datahora_dropping_duplicates_in_memory_and_spilled(tmp_path):
+    rows, repeated = _rows()
+    expected = sorted(rows, key=lambda row: (row['ID'], row['datahora'], row['mID']))
+    for max_rows in (10000, 37):
+        sorter = ExternalSorter(max_rows, str(tmp_path))
+        assert list(sorter.sort_unique(repeated)) == expected
+        assert sorter.duplicates == 50
+        assert sorter.runs == (0 if max_rows == 10000 else -(-len(repeated) // 37))
+    assert not list(tmp_path.iterdir())
+
+
+def test_sorts_a_batch_in_place_as_in_memory():
+    rows, repeated = _rows()
+    batch = RecordBatch()
+    batch.extend(repeated)
+    sorter = ExternalSorter()
+    assert list(sorter.sort_batch(batch)) == list(ExternalSorter().sort_unique(repeated))
+    assert sorter.duplicates == 50 and sorter.runs == 0 and len(batch) == len(repeated)
+
+
+def test_rows_with_untyped_keys_are_kept_after_the_typed_ones():
+    rows, _ = _rows()
+    odd = dict(rows[0], ID=None)
+    result = list(ExternalSorter(10).sort_unique([odd] + rows[:5] + [dict(odd)]))
+    assert result[-1] == odd and len(result) == 6
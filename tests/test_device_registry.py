@@ -0,0 +1,59 @@
+from datetime import date
+
+from pipe_vms_brazil.device_registry import DeviceRegistry, content_hash, load_registry, save_registry
+
+import os
+
+
+def _device(device_id, codMarinha, nome):
+    return dict(ID=device_id, codMarinha=codMarinha, nome=nome)
+
+
+def test_the_content_hash_ignores_the_order():
+    devices = [_device(1, 'A', 'UM'), _device(2, 'B', 'DOIS')]
+    assert content_hash(devices) == content_hash(devices[::-1])
+    assert content_hash(devices) != content_hash(devices[:1])
+
+
+def test_only_the_differences_are_recorded():
+    registry = DeviceRegistry()
+    assert registry.update([_device(1, 'A', 'UM'), _device(2, 'B', 'DOIS')], date(2021, 1, 1)) == dict(
+        added=2, changed=0, removed=0)
+    assert registry.update([_device(2, 'B', 'DOIS'), _device(1, 'A', 'UM')], date(2021, 1, 2)) is None
+    assert registry.update([_device(1, 'A', 'UNO'), _device(3, 'C', 'TRES')], date(2021, 1, 3)) == dict(
+        added=1, changed=1, removed=1)
+    assert registry.checked == '2021-01-03'
+    assert registry.history[1] == [dict(since=None, codMarinha='A', nome='UM'),
+                                   dict(since='2021-01-03', codMarinha='A', nome='UNO')]
+
+
+def test_the_devices_are_joined_with_the_info_valid_at_a_date():
+    registry = DeviceRegistry()
+    registry.update([_device(1, 'A', 'UM'), _device(2, 'B', 'DOIS')], date(2021, 1, 1))
+    registry.update([_device(1, 'A', 'UNO')], date(2021, 1, 3))
+    # Before the first snapshot the device info is assumed to be the same.
+    assert {device_id: device['nome'] for device_id, device in registry.devices_at(date(2020, 6, 1)).items()} == {
+        1: 'UM', 2: 'DOIS'}
+    assert {device_id: device['nome'] for device_id, device in registry.devices_at(date(2021, 1, 3)).items()} == {
+        1: 'UNO'}
+
+
+def test_the_freshness_of_the_last_check():
+    registry = DeviceRegistry()
+    assert not registry.is_fresh(date(2021, 1, 1), 7)
+    registry.update([_device(1, 'A', 'UM')], date(2021, 1, 1))
+    assert registry.is_fresh(date(2021, 1, 7), 7)
+    assert not registry.is_fresh(date(2021, 1, 8), 7)
+    assert not registry.is_fresh(date(2021, 1, 1), 0)
+
+
+def test_the_snapshot_round_trip(tmp_path):
+    path = f'file://{os.path.join(tmp_path, "registry.json.gz")}'
+    assert load_registry(path).to_dict() == DeviceRegistry().to_dict()
+    registry = DeviceRegistry()
+    registry.update([_device(1, 'A', 'UM')], date(2021, 1, 1))
+    registry.update([_device(1, 'A', 'UNO')], date(2021, 1, 3))
+    save_registry(registry, path)
+    loaded = load_registry(path)
+    assert loaded.to_dict() == registry.to_dict()
+    assert loaded.devices_at(date(2021, 1, 2)) == registry.devices_at(date(2021, 1, 2))
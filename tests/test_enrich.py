@@ -0,0 +1,45 @@
+from pipe_vms_brazil.dedup import ExternalSorter
+
+from pipe_vms_brazil.enrich import TRACK_FIELDS, enrich_tracks
+
+import pytest
+
+pytest.importorskip('numpy')
+
+
+def _message(vessel, mid, datahora, lat, lon='-45.000000'):
+    return dict(ID=vessel, curso=0, datahora=datahora, lat=lat, lon=lon, mID=mid, speed=0, codMarinha=None,
+                nome='A')
+
+def _track(rows, chunk_rows):
+    enriched = enrich_tracks(ExternalSorter().sort_unique(rows), chunk_rows=chunk_rows)
+    return [(row['mID'],) + tuple(row[field] for field in TRACK_FIELDS) for row in enriched]
+
+
+@pytest.mark.parametrize('chunk_rows', [2, 100])
+def test_compares_each_ping_with_the_previous_of_its_vessel(chunk_rows):
+    rows = [_message(2, 1, '2021-01-01 01:00:00', '-23.000000'),
+            _message(1, 2, '2021-01-01 01:00:00', '-23.000000'),
+            _message(1, 3, '2021-01-01 00:00:00', '-22.000000'),
+            _message(None, 4, '2021-01-01 00:00:00', '-22.000000'),
+            _message(1, 5, '2021-01-01 01:30:00', '-23.100000'),
+            _message(1, 6, '2021-01-01 02:00:00', 'unknown'),
+            _message(2, 7, '2021-01-01 01:00:00', '-23.010000')]
+    assert _track(rows, chunk_rows) == [
+        (3, None, None, None, None),
+        # 1 degree of latitude in an hour.
+        (2, 3600, 111.195, 111.2, True),
+        (5, 1800, 11.12, 22.24, False),
+        (6, 1800, None, None, None),
+        (1, None, None, None, None),
+        # Moved at the same second.
+        (7, 0, 1.112, None, True),
+        # Without ID, sorted last and not part of any track.
+        (4, None, None, None, None)]
+
+
+def test_keeps_the_fields_of_the_merged_messages():
+    rows = [_message(1, 1, '2021-01-01 00:00:00', '-22.000000'), _message(1, 2, '2021-01-01 00:10:00', '-22.010000')]
+    enriched = list(enrich_tracks(dict(row) for row in rows))
+    assert [{key: row[key] for key in rows[0]} for row in enriched] == rows
+    assert list(enrich_tracks([])) == []
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from pipe_vms_brazil import fetch_prepare, metrics
+
+from pipe_vms_brazil.brazil_api_client import BrazilApiClient, day_windows, messages_url
+
+from pipe_vms_brazil.join import index_devices
+
+from pipe_vms_brazil.json_stream import iter_array
+
+import gzip, hashlib, json, os
+
+import pytest
+
+
+def _stream_merge(server, tmp_path, **options):
+    client = BrazilApiClient(server.endpoint, 'token', backoff_base=0.01)
+    url = messages_url(f'{server.endpoint}/GetMessages/token', *day_windows(datetime(2021, 2, 25), 1)[0])
+    merged_file_path, raw_file_path = os.path.join(tmp_path, 'merged.json.gz'), os.path.join(tmp_path, 'raw.json.gz')
+    digest = fetch_prepare.stream_merge(client, url, index_devices(server.iter_devices()), merged_file_path,
+                                        raw_file_path, **options)
+    client.close()
+    return digest, merged_file_path, raw_file_path
+
+
+@pytest.mark.parametrize('faults', [[], [(503, False)], [(0, True)]])
+def test_the_stream_is_merged_and_archived(tmp_path, mock_api, faults):
+    server = mock_api(faults)
+    digest, merged_file_path, raw_file_path = _stream_merge(server, tmp_path, compresslevel=1, dedup=True)
+    assert server.stats['requests'] == len(faults) + 1
+    with gzip.open(merged_file_path, 'rt') as merged:
+        rows = [json.loads(line) for line in merged]
+    assert len(rows) == 120 and rows == sorted(rows, key=lambda row: (row['ID'], row['datahora'], row['mID']))
+    with gzip.open(raw_file_path, 'rb') as raw:
+        body = raw.read()
+    assert digest == hashlib.md5(body).hexdigest()
+    assert len(json.loads(body)['mensagens']) == 120
+
+
+def test_the_stream_gives_up_after_the_retries(tmp_path, mock_api):
+    server = mock_api(error_rate=1.0)
+    client = BrazilApiClient(server.endpoint, 'token', max_retries=2, backoff_base=0.01, backoff_cap=0.01)
+    url = messages_url(f'{server.endpoint}/GetMessages/token', *day_windows(datetime(2021, 2, 25), 1)[0])
+    assert fetch_prepare.stream_merge(client, url, {}, os.path.join(tmp_path, 'merged.json.gz')) is None
+    client.close()
+    assert server.stats['requests'] == 2
+
+
+def test_an_unchanged_day_is_not_uploaded_again(tmp_path, mock_api, monkeypatch, capsys):
+    server = mock_api(token=None)
+    output_directory = os.path.join(tmp_path, 'output') + '/'
+    monkeypatch.chdir(tmp_path)
+    # Without the summary reported at exit.
+    monkeypatch.setattr(metrics, 'start', lambda step, path=None, profile=None: metrics.reset(step))
+    argv = ['-d', '2021-02-25', '-o', output_directory, '-ep', server.endpoint, '-wt', '0.01']
+    fetch_prepare.main(argv)
+    merged_file_path = os.path.join(output_directory, '2021-02-25.json.gz')
+    assert os.path.exists(os.path.join(output_directory, '_manifests', 'fetch_prepare', '2021-02-25.json'))
+    modified = os.stat(merged_file_path).st_mtime_ns
+
+    fetch_prepare.main(argv)
+    assert 'did not change since the last run' in capsys.readouterr().out
+    assert os.stat(merged_file_path).st_mtime_ns == modified
+    fetch_prepare.main(argv + ['--force'])
+    assert os.stat(merged_file_path).st_mtime_ns != modified
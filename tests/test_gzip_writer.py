@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pipe_vms_brazil.gzip_writer import ParallelGzipWriter, compress, open_gzip
+
+import gzip, os, zlib
+
+import pytest
+
+
+def _lines(count):
+    return ''.join(f'{{"mID": {index}, "nome": "JOÃO"}}\n' for index in range(count))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_the_blocks_decompress_to_the_input(tmp_path, workers):
+    path = os.path.join(tmp_path, 'output.json.gz')
+    content = _lines(5000)
+    with ParallelGzipWriter(path, 'wt', compresslevel=1, workers=workers, block_size=1 << 12) as output:
+        for start in range(0, len(content), 1000):
+            output.write(content[start:start + 1000])
+    with gzip.open(path, 'rt', encoding='utf-8') as written:
+        assert written.read() == content
+
+
+def test_a_shared_executor_and_append(tmp_path):
+    path = os.path.join(tmp_path, 'output.json.gz')
+    with ThreadPoolExecutor(2) as executor:
+        for mode, content in (('wb', b'first\n'), ('ab', b'second\n')):
+            with open_gzip(path, mode, executor=executor) as output:
+                output.write(content)
+        # The shared executor is still usable.
+        assert executor.submit(int).result() == 0
+    with gzip.open(path, 'rb') as written:
+        assert written.read() == b'first\nsecond\n'
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_an_empty_file_is_a_valid_gzip(tmp_path, workers):
+    path = os.path.join(tmp_path, 'empty.json.gz')
+    open_gzip(path, 'wt', workers=workers).close()
+    with gzip.open(path, 'rb') as written:
+        assert written.read() == b''
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_the_same_content_gives_the_same_bytes(tmp_path, workers):
+    contents = []
+    for run in ('first', 'second'):
+        os.makedirs(os.path.join(tmp_path, run))
+        path = os.path.join(tmp_path, run, 'output.json.gz')
+        with open_gzip(path, 'wt', workers=workers) as output:
+            output.write(_lines(10))
+        with open(path, 'rb') as written:
+            contents.append(written.read())
+    assert contents[0] == contents[1]
+    assert zlib.decompress(compress(b'block', 1), 31) == b'block'
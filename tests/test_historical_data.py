@@ -0,0 +1,70 @@
+from datetime import date
+
+from pipe_vms_brazil.historical_data import SHARDS_FOLDER, split_year
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages, write_payload
+
+import gzip, json, os
+
+import pytest
+
+
+def _read(path):
+    with gzip.open(path, 'rt') as day:
+        return [json.loads(line) for line in day]
+
+
+def test_out_of_core_split_writes_each_day_sorted_without_duplicates(tmp_path):
+    devices = generate_devices(15, seed=2)
+    messages = [message for day in (1, 2, 3) for message in generate_messages(devices, date(2021, 1, day), 4, seed=day)]
+    write_payload(os.path.join(tmp_path, 'Devices.txt'), 'devices', devices)
+    # The second day fetched twice.
+    write_payload(os.path.join(tmp_path, '2021.json'), 'mensagens', messages + messages[60:120])
+
+    year_path, counts = split_year(2021, str(tmp_path), last_day=date(2021, 1, 3), memory_budget_mb=1)
+    assert counts == {'2021-01-01': 60, '2021-01-02': 60, '2021-01-03': 60}
+    assert not os.path.exists(os.path.join(year_path, SHARDS_FOLDER))
+    for day in counts:
+        rows = _read(os.path.join(year_path, f'{day}.json.gz'))
+        assert rows == sorted(rows, key=lambda row: (row['ID'], row['datahora'], row['mID']))
+        assert len({(row['ID'], row['mID'], row['datahora']) for row in rows}) == 60
+
+
+@pytest.mark.parametrize('partition_by', ['day', 'hour'])
+def test_in_memory_and_out_of_core_splits_write_the_same_bytes(tmp_path, partition_by):
+    devices = generate_devices(15, seed=2)
+    messages = [message for day in (1, 2) for message in generate_messages(devices, date(2021, 1, day), 4, seed=day)]
+    contents = []
+    for memory_budget_mb in (None, 1):
+        directory = os.path.join(tmp_path, str(memory_budget_mb))
+        write_payload(os.path.join(directory, 'Devices.txt'), 'devices', devices)
+        write_payload(os.path.join(directory, '2021.json'), 'mensagens', messages[::-1] + messages[:30])
+        year_path, counts = split_year(2021, directory, last_day=date(2021, 1, 3), partition_by=partition_by,
+                                       memory_budget_mb=memory_budget_mb)
+        assert counts == {'2021-01-01': 60, '2021-01-02': 60, '2021-01-03': 0}
+        if partition_by == 'day':
+            with open(os.path.join(year_path, '2021-01-03.json.gz'), 'rb') as empty:
+                # Without the time of writing in the GZIP header.
+                assert empty.read()[4:8] == bytes(4)
+        files = {}
+        for filename in sorted(os.listdir(year_path)):
+            with open(os.path.join(year_path, filename), 'rb') as partition:
+                files[filename] = partition.read()
+        contents.append(files)
+    assert contents[0] == contents[1]
+
+
+@pytest.mark.parametrize('memory_budget_mb', [None, 1])
+def test_split_encodes_the_days_with_the_json_backend(tmp_path, memory_budget_mb):
+    pytest.importorskip('orjson')
+    devices = generate_devices(15, seed=2)
+    write_payload(os.path.join(tmp_path, 'Devices.txt'), 'devices', devices)
+    write_payload(os.path.join(tmp_path, '2021.json'), 'mensagens', generate_messages(devices, date(2021, 1, 1), 4))
+
+    year_path, _ = split_year(2021, str(tmp_path), last_day=date(2021, 1, 1), memory_budget_mb=memory_budget_mb)
+    expected = _read(os.path.join(year_path, '2021-01-01.json.gz'))
+    year_path, _ = split_year(2021, str(tmp_path), last_day=date(2021, 1, 1), memory_budget_mb=memory_budget_mb,
+                              json_backend='orjson')
+    with gzip.open(os.path.join(year_path, '2021-01-01.json.gz'), 'rt') as day:
+        assert ', ' not in day.readline()
+    assert _read(os.path.join(year_path, '2021-01-01.json.gz')) == expected
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from pipe_vms_brazil.incremental import compact_deltas, poll_window, split_deltas
+
+from pipe_vms_brazil.json_stream import iter_array
+
+from pipe_vms_brazil.synthetic import write_payload
+
+import gzip, os
+
+
+def _message(mid, datahora):
+    return dict(ID=1, mID=mid, datahora=datahora, lat='-23.000000', lon='-45.000000', curso=0, speed=0)
+
+def _read(path):
+    with gzip.open(path, 'rb') as messages:
+        return list(iter_array(messages, 'mensagens'))
+
+
+def test_polls_keep_only_the_new_messages_and_compact_without_duplicates(tmp_path):
+    end = datetime(2021, 2, 26, 0, 5)
+    first = os.path.join(tmp_path, 'first.json.gz')
+    write_payload(first, 'mensagens', [_message(1, '25-02-2021 23:50:00'), _message(2, '25-02-2021 23:58:00'),
+                                       _message(3, '26-02-2021 00:01:00')])
+    deltas, watermark = split_deltas(first, None, end, os.path.join(tmp_path, 'deltas'), 'a')
+    assert {day: messages for day, (_, messages) in deltas.items()} == {'2021-02-25': 2, '2021-02-26': 1}
+    assert watermark['mID'] == 3 and watermark['datahora'] == '2021-02-26T00:01:00'
+
+    start, _ = poll_window(watermark, end + timedelta(minutes=15), timedelta(minutes=10))
+    assert start == datetime(2021, 2, 25, 23, 51)
+    second = os.path.join(tmp_path, 'second.json.gz')
+    # mID 2 requested again by the overlap, mID 4 received late.
+    write_payload(second, 'mensagens', [_message(2, '25-02-2021 23:58:00'), _message(4, '25-02-2021 23:59:00')])
+    later, watermark = split_deltas(second, watermark, end + timedelta(minutes=15), os.path.join(tmp_path, 'deltas'), 'b')
+    assert list(later) == ['2021-02-25'] and later['2021-02-25'][1] == 1
+    assert watermark['mID'] == 4 and watermark['datahora'] == '2021-02-26T00:01:00'
+
+    compacted = os.path.join(tmp_path, 'compacted.json.gz')
+    # The same delta twice, as a retried poll would leave it.
+    paths = [deltas['2021-02-25'][0], later['2021-02-25'][0], later['2021-02-25'][0]]
+    assert compact_deltas(paths, compacted) == (3, 1)
+    assert [message['mID'] for message in _read(compacted)] == [1, 2, 4]
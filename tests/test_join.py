@@ -0,0 +1,44 @@
+from pipe_vms_brazil.join import UnmatchedCounter, index_devices, join_messages
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+
+DEVICES = [
+    dict(ID=1, codMarinha='A1', nome='UM'),
+    dict(ID=2, codMarinha='B2', nome='DOIS'),
+    dict(ID=1, codMarinha='C3', nome='REPETIDO'),
+]
+
+
+def _message(device_id, mID, datahora='25-02-2021 13:45:00'):
+    return dict(ID=device_id, mID=mID, datahora=datahora, lat='-23.5', lon='-45.1', curso=90, speed=7)
+
+
+def test_the_first_device_of_an_id_is_indexed():
+    index = index_devices(DEVICES)
+    assert list(index) == [1, 2] and index[1]['nome'] == 'UM'
+
+
+def test_the_messages_are_merged_in_order_with_their_device():
+    messages = [_message(2, 10), _message(1, 11)]
+    rows = list(join_messages(index_devices(DEVICES), messages))
+    assert rows == [
+        dict(ID=2, curso=90, datahora='2021-02-25 13:45:00', lat='-23.5', lon='-45.1', mID=10, speed=7,
+             codMarinha='B2', nome='DOIS'),
+        dict(ID=1, curso=90, datahora='2021-02-25 13:45:00', lat='-23.5', lon='-45.1', mID=11, speed=7,
+             codMarinha='A1', nome='UM'),
+    ]
+
+
+def test_the_unknown_and_malformed_messages_are_reported():
+    unmatched, timestamps = [], TimestampConverter()
+    messages = [_message(3, 10), _message(1, 11, 'yesterday'), _message(1, 12)]
+    rows = list(join_messages(index_devices(DEVICES), messages, unmatched, timestamps))
+    assert [row['mID'] for row in rows] == [12]
+    assert unmatched == [messages[0]] and timestamps.malformed == 1
+
+
+def test_the_unmatched_counter_keeps_only_some_samples():
+    counter = UnmatchedCounter(max_samples=2)
+    list(join_messages({}, [_message(3, mID) for mID in range(5)], counter))
+    assert len(counter) == 5 and [message['mID'] for message in counter.samples] == [0, 1]
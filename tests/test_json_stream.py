@@ -0,0 +1,56 @@
+from pipe_vms_brazil.json_stream import JsonChecker, iter_array
+
+import io, json
+
+import pytest
+
+
+PAYLOAD = {'total': 3, 'mensagens': [{'ID': 1, 'nome': 'JOÃO "ÇA" \\ ]}'}, 12345678901234567890, [1, [2]], 'x' * 100],
+           'devices': []}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 16])
+@pytest.mark.parametrize('binary', [False, True])
+def test_the_array_is_decoded_element_by_element(chunk_size, binary):
+    content = json.dumps(PAYLOAD, ensure_ascii=False)
+    fileobj = io.BytesIO(content.encode('utf-8')) if binary else io.StringIO(content)
+    assert list(iter_array(fileobj, 'mensagens', chunk_size)) == PAYLOAD['mensagens']
+
+
+def test_an_empty_array_and_a_missing_key():
+    content = json.dumps(PAYLOAD)
+    assert list(iter_array(io.StringIO(content), 'devices')) == []
+    with pytest.raises(KeyError):
+        list(iter_array(io.StringIO(content), 'other'))
+    with pytest.raises(KeyError):
+        list(iter_array(io.StringIO('{}'), 'devices'))
+
+
+def test_a_truncated_array_fails():
+    with pytest.raises(ValueError):
+        list(iter_array(io.StringIO(json.dumps(PAYLOAD)[:40]), 'mensagens', 8))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1 << 16])
+def test_the_checker_counts_the_records_of_a_well_formed_document(chunk_size):
+    payload = {'mensagens': [{'ID': 1, 'nome': 'JOÃO "ÇA" \\ ]}'}, {'ID': [2]}, {}], 'devices': [{'ID': 1}]}
+    content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    checker = JsonChecker()
+    for start in range(0, len(content), chunk_size):
+        checker.feed(content[start:start + chunk_size])
+    checker.close()
+    assert checker.size == len(content) and checker.records == 4
+
+
+@pytest.mark.parametrize('content', [b'{"mensagens": [{"ID": 1}', b'{"nome": "JO', b'', b'   '])
+def test_the_checker_detects_a_truncated_document(content):
+    checker = JsonChecker()
+    checker.feed(content)
+    with pytest.raises(ValueError):
+        checker.close()
+
+
+@pytest.mark.parametrize('content', [b'{"mensagens": [}', b'{"a": 1}}', b'{"a": 1} x', b'{"a": 1} {}'])
+def test_the_checker_detects_a_malformed_document(content):
+    with pytest.raises(ValueError):
+        JsonChecker().feed(content)
@@ -0,0 +1,72 @@
+from pipe_vms_brazil import load, metrics
+
+import os, subprocess, threading, time
+
+import pytest
+
+
+class _Bash(object):
+    """Records the gcs2bq.sh runs instead of loading, failing the days given."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, arguments, **options):
+        # The script is only extracted from the package while it runs.
+        assert os.path.isfile(arguments[1])
+        with self._lock:
+            self.calls.append(arguments)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+        code = 1 if arguments[2] in self.failing else 0
+        return subprocess.CompletedProcess(arguments, code, stdout=f'exit {code}\n')
+
+
+@pytest.fixture
+def bash(monkeypatch):
+    def stub(failing=()):
+        runs = _Bash(failing)
+        monkeypatch.setattr(load.subprocess, 'run', runs)
+        # Without the summary reported at exit.
+        monkeypatch.setattr(metrics, 'start', lambda step, path=None: metrics.reset(step))
+        return runs
+    return stub
+
+
+@pytest.mark.parametrize('parallel_days', [1, 2])
+def test_each_day_of_the_range_is_loaded(bash, parallel_days):
+    runs = bash()
+    load.main(['-d', '2021-02-27', '-de', '2021-03-02', '-i', 'gs://bucket/merged/', '-t', 'project:dataset.table',
+               '-P', str(parallel_days)])
+    days = ['2021-02-27', '2021-02-28', '2021-03-01', '2021-03-02']
+    assert sorted(arguments[2] for arguments in runs.calls) == days
+    for arguments in runs.calls:
+        assert arguments[0] == 'bash' and os.path.basename(arguments[1]) == 'gcs2bq.sh'
+        assert arguments[3:] == ['gs://bucket/merged', 'project:dataset.table', '']
+    assert runs.max_running == parallel_days
+
+
+def test_the_format_and_force_are_passed_in_order(bash):
+    runs = bash()
+    load.main(['-d', '2021-02-27', '-i', 'gs://bucket/merged', '-t', 'project:dataset.table', '-of', 'parquet', '-f'])
+    assert [arguments[2:] for arguments in runs.calls] == [
+        ['2021-02-27', 'gs://bucket/merged', 'project:dataset.table', 'parquet', 'force']]
+
+
+def test_a_failing_day_fails_the_command(bash, capsys):
+    runs = bash(failing=('2021-02-28',))
+    with pytest.raises(SystemExit) as exit:
+        load.main(['-d', '2021-02-27', '-de', '2021-03-01', '-i', 'gs://bucket/merged', '-t', 'project:dataset.table',
+                   '-P', '3'])
+    assert exit.value.code == 1
+    # The other days are still loaded.
+    assert len(runs.calls) == 3
+    output = capsys.readouterr().out
+    assert '[2021-02-28] exit 1' in output and "{'2021-02-28': 1}" in output
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pipe_vms_brazil import metrics
+
+from pipe_vms_brazil.metrics import Metrics
+
+import pytest
+
+
+def test_the_stages_and_counters_are_added_up():
+    step_metrics = Metrics('prepares_data')
+    for _ in range(2):
+        with step_metrics.stage('parse'):
+            pass
+    step_metrics.add_time('parse', 1.5)
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda _: step_metrics.count('rows_out', 10), range(100)))
+    summary = step_metrics.summary()
+    assert summary['step'] == 'prepares_data'
+    assert summary['stages']['parse']['calls'] == 3 and summary['stages']['parse']['seconds'] >= 1.5
+    assert summary['counters'] == {'rows_out': 1000}
+    assert summary['rows_per_second'] > 0 and summary['max_rss_bytes'] > 0
+
+
+def test_timed_excludes_the_time_of_the_consumer():
+    step_metrics = metrics.reset('test')
+    assert list(metrics.timed(range(3), 'produce')) == [0, 1, 2]
+    assert step_metrics.stages['produce']['calls'] == 1
+    assert metrics.get_metrics() is step_metrics
+
+
+def test_an_unknown_profile_fails():
+    with pytest.raises(ValueError):
+        metrics.start('test', profile='disk')
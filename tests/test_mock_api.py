@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from pipe_vms_brazil.brazil_api_client import BrazilApiClient
+
+from pipe_vms_brazil.json_stream import iter_array
+
+import gzip, os
+
+
+def _read(path):
+    with gzip.open(path, 'rb') as payload:
+        return list(iter_array(payload, 'mensagens'))
+
+
+def test_the_client_fetches_the_windows_of_a_day(tmp_path, mock_api):
+    path = os.path.join(tmp_path, 'messages.json.gz')
+    server = mock_api()
+    client = BrazilApiClient(server.endpoint, 'token', backoff_base=0.01)
+    assert client.get_messages(datetime(2021, 2, 25), path, stream=True, windows=3, concurrency=3)
+    client.close()
+    messages = _read(path)
+    assert len(messages) == 120 and len({message['mID'] for message in messages}) == 120
+    assert all(message['datahora'].startswith('25-02-2021') for message in messages)
+
+
+def test_truncated_bodies_are_retried_until_the_client_gives_up(tmp_path, mock_api):
+    path = os.path.join(tmp_path, 'messages.json.gz')
+    server = mock_api(truncate_rate=1.0)
+    client = BrazilApiClient(server.endpoint, 'token', max_retries=2, backoff_base=0.01)
+    assert not client.get_messages(datetime(2021, 2, 25), path, stream=True)
+    client.close()
+    assert server.stats['requests'] == server.stats['truncated'] == 2
@@ -0,0 +1,60 @@
+from pipe_vms_brazil.enrich import TRACK_FIELDS
+
+from pipe_vms_brazil.ndjson import NdjsonEncoder, encode_json
+
+import io, json, sys
+
+import pytest
+
+
+@pytest.mark.parametrize('change', [
+    {},
+    {'curso': 1.5},
+    {'nome': None, 'codMarinha': None},
+    {'mID': 1 << 70},
+    {'extra': True},
+])
+def test_encodes_the_same_text_as_json_dumps(change, merged_rows):
+    for row in merged_rows(fleet_size=5):
+        row.update(change)
+        assert encode_json(row) == json.dumps(row) + '\n'
+
+
+@pytest.mark.parametrize('track', [
+    (None, None, None, None),
+    (60, 0.5, 30.0, False),
+    (0, 1.25, None, True),
+    (60, float('nan'), None, None),
+])
+def test_encodes_the_enriched_messages_as_json_dumps(track, merged_rows):
+    for row in merged_rows(fleet_size=5):
+        row.update(zip(TRACK_FIELDS, track))
+        assert encode_json(row) == json.dumps(row) + '\n'
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_writes_blocks_of_lines(backend, merged_rows):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    rows = merged_rows()
+    output = io.BytesIO()
+    encoder = NdjsonEncoder(output, backend, block_size=1000)
+    for row in rows:
+        encoder.write(row)
+    encoder.flush()
+    lines = output.getvalue().decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == rows
+    if backend == 'json':
+        assert output.getvalue() == ''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8')
+
+
+def test_falls_back_to_json_without_orjson(monkeypatch, merged_rows):
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    output = io.BytesIO()
+    encoder = NdjsonEncoder(output, 'orjson')
+    assert encoder.backend == 'json'
+    rows = merged_rows(fleet_size=5)
+    for row in rows:
+        encoder.write(row)
+    encoder.flush()
+    assert output.getvalue() == ''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8')
@@ -0,0 +1,68 @@
+from datetime import date, datetime, timezone
+
+from pipe_vms_brazil.assets import LOAD_SCRIPT, asset_path
+
+from pipe_vms_brazil.enrich import enrich_tracks
+
+from pipe_vms_brazil.join import index_devices, join_messages
+
+from pipe_vms_brazil.output import ColumnarWriter, load_schema, open_output
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages
+
+import os
+
+import pytest
+
+
+def _enriched_rows():
+    devices = generate_devices(5)
+    rows = sorted(join_messages(index_devices(devices), generate_messages(devices, date(2020, 2, 29), 4)),
+                  key=lambda row: (row['ID'], row['datahora']))
+    rows[0]['nome'] = None
+    return list(enrich_tracks(rows))
+
+
+def _expected(row):
+    expected = dict(row)
+    expected['datahora'] = datetime.strptime(row['datahora'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return expected
+
+
+def test_columnar_writer_needs_the_row_groups():
+    with pytest.raises(TypeError):
+        ColumnarWriter('unused.parquet', schema=[])
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip('numpy')
+    parquet = pytest.importorskip('pyarrow.parquet')
+    rows = _enriched_rows()
+    path = os.path.join(tmp_path, 'day.parquet')
+    with open_output(path, 'parquet') as output:
+        output.row_group_size = 7
+        for row in rows:
+            output.write(row)
+    table = parquet.read_table(path)
+    assert parquet.ParquetFile(path).num_row_groups == -(-len(rows) // 7)
+    assert str(table.schema.field('datahora').type) == 'timestamp[us, tz=UTC]'
+    assert [{name: row[name] for name in rows[0]} for row in table.to_pylist()] == [_expected(row) for row in rows]
+
+
+def test_avro_round_trip(tmp_path):
+    pytest.importorskip('numpy')
+    fastavro = pytest.importorskip('fastavro')
+    rows = _enriched_rows()
+    path = os.path.join(tmp_path, 'day.avro')
+    with open_output(path, 'avro') as output:
+        for row in rows:
+            output.write(row)
+    with open(path, 'rb') as avro:
+        written = list(fastavro.reader(avro))
+    assert [{name: row[name] for name in rows[0]} for row in written] == [_expected(row) for row in rows]
+
+
+def test_the_assets_are_found_as_package_data():
+    assert [field['name'] for field in load_schema()][:3] == ['datahora', 'ID', 'mID']
+    with asset_path(LOAD_SCRIPT) as script:
+        assert os.path.isfile(script)
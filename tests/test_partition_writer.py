@@ -0,0 +1,49 @@
+from datetime import date
+
+from pipe_vms_brazil.join import index_devices, join_messages
+
+from pipe_vms_brazil.partition_writer import PartitionWriter
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages
+
+import gzip, json, os, zlib
+
+
+def _members(path):
+    with open(path, 'rb') as partition:
+        data = partition.read()
+    members = 0
+    while data:
+        decompressor = zlib.decompressobj(31)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        members += 1
+    return members
+
+def _read(path):
+    with gzip.open(path, 'rt') as partition:
+        return [json.loads(line) for line in partition]
+
+
+def test_a_flush_does_not_reopen_the_open_partitions(tmp_path):
+    devices = generate_devices(5)
+    days = {day: list(join_messages(index_devices(devices), generate_messages(devices, date(2021, 1, day), 2)))
+            for day in (1, 2, 3)}
+    with PartitionWriter(str(tmp_path), max_open_files=2) as writer:
+        for day in (3, 1):
+            for message in days[day][:5]:
+                writer.write(message)
+            writer.flush()
+        # The 3rd is open but the least recently used, it is written before the 2nd is opened.
+        for day in (2, 3):
+            for message in days[day][5:]:
+                writer.write(message)
+        writer.flush()
+        for message in days[1][5:] + days[2][:5] + days[3][:5]:
+            writer.write(message)
+    assert writer.counts == {'2021-01-01': 10, '2021-01-02': 10, '2021-01-03': 15}
+    for day, members in ((1, 2), (2, 1), (3, 1)):
+        path = os.path.join(tmp_path, f'2021-01-0{day}.json.gz')
+        assert _members(path) == members
+    assert _read(os.path.join(tmp_path, '2021-01-01.json.gz')) == days[1]
+    assert _read(os.path.join(tmp_path, '2021-01-03.json.gz')) == days[3][:5] + days[3][5:] + days[3][:5]
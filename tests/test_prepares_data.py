@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from pipe_vms_brazil.prepares_data import day_range, prepare_day, prepare_days
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages, write_payload
+
+import gzip, os
+
+import pytest
+
+
+@pytest.mark.parametrize('parallel_days', [1, 2])
+def test_prepares_a_date_range_in_a_single_run(tmp_path, monkeypatch, parallel_days):
+    monkeypatch.chdir(tmp_path)
+    devices = generate_devices(10)
+    days = day_range(datetime(2021, 2, 27), datetime(2021, 3, 1))
+    assert [day.strftime('%Y-%m-%d') for day in days] == ['2021-02-27', '2021-02-28', '2021-03-01']
+    for day in days:
+        write_payload(f'input/devices/{day:%Y-%m-%d}.json.gz', 'devices', devices)
+        write_payload(f'input/messages/{day:%Y-%m-%d}.json.gz', 'mensagens',
+                      generate_messages(devices, day.date(), 3))
+    write_payload('input/devices/2021-03-02.json.gz', 'devices', devices)
+
+    failed = prepare_days(days + [datetime(2021, 3, 2)], parallel_days, input_directory='input/',
+                          output_directory='output/')
+    assert list(failed) == ['2021-03-02']
+    for day in days:
+        with gzip.open(f'output/{day:%Y-%m-%d}.json.gz', 'rt') as merged:
+            assert len(merged.readlines()) == 30
+    # The days prepared are skipped the next time.
+    modified = os.path.getmtime('output/2021-02-28.json.gz')
+    assert prepare_days(days, parallel_days, input_directory='input/', output_directory='output/') == {}
+    assert os.path.getmtime('output/2021-02-28.json.gz') == modified
+
+
+def test_compacts_the_deltas_again_when_a_late_poll_adds_one(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    devices = generate_devices(10)
+    day = datetime(2021, 2, 25)
+    write_payload('input/devices/2021-02-25.json.gz', 'devices', devices)
+    options = dict(input_directory='input/', output_directory='output/', compact=True)
+    # Without deltas the day fails, the messages are not replaced by an empty file.
+    with pytest.raises(FileNotFoundError):
+        prepare_day(day, **options)
+    assert not os.path.exists('input/messages/2021-02-25.json.gz')
+
+    messages = list(generate_messages(devices, day.date(), 2))
+    write_payload('input/messages_deltas/2021-02-25/a.json.gz', 'mensagens', messages[:10])
+    assert prepare_day(day, **options)
+    assert not prepare_day(day, **options)
+    write_payload('input/messages_deltas/2021-02-25/b.json.gz', 'mensagens', messages[10:])
+    assert prepare_day(day, **options)
+    with gzip.open('output/2021-02-25.json.gz', 'rt') as merged:
+        assert len(merged.readlines()) == 20
@@ -0,0 +1,45 @@
+from pipe_vms_brazil.records import RecordBatch
+
+import json
+
+import pytest
+
+
+def test_round_trip_to_the_same_ndjson(merged_rows):
+    rows = merged_rows()
+    batch = RecordBatch()
+    batch.extend(rows)
+    assert len(batch) == len(rows)
+    assert list(batch) == rows
+    assert batch.to_ndjson() == ''.join(json.dumps(row) + '\n' for row in rows)
+    assert len(batch.strings) <= 2 * 50 + 1
+
+
+@pytest.mark.parametrize('field, value', [
+    ('ID', None), ('ID', '12'), ('mID', 1 << 70), ('speed', True), ('curso', 1.5),
+    ('datahora', '2021-02-30 00:00:00'), ('datahora', '2021-02-01 24:00:00'),
+    ('lat', 1.5), ('lat', '1e5'), ('lat', ' 1.5'), ('lon', '+2.0'), ('lon', None),
+    ('codMarinha', 12), ('nome', None),
+])
+def test_values_out_of_the_columns_are_kept(field, value, merged_rows):
+    rows = merged_rows(2, 2)
+    rows[1][field] = value
+    batch = RecordBatch()
+    batch.extend(rows)
+    assert list(batch) == rows
+    assert [type(v) for v in batch.row(1).values()] == [type(v) for v in rows[1].values()]
+    assert batch.to_ndjson() == ''.join(json.dumps(row) + '\n' for row in rows)
+
+
+def test_group_by_day_and_take(merged_rows):
+    rows = merged_rows(3, 2) + merged_rows(3, 2)[::-1]
+    batch = RecordBatch()
+    batch.extend(rows)
+    groups = batch.group_by(lambda index: batch.columns['datahora'][index] // 86400)
+    assert sum(len(indices) for indices in groups.values()) == len(rows)
+    assert list(batch.take(reversed(range(len(rows))))) == rows[::-1]
+
+
+def test_unexpected_fields_are_rejected():
+    with pytest.raises(ValueError):
+        RecordBatch().append(dict(ID=1))
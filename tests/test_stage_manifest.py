@@ -0,0 +1,51 @@
+from pipe_vms_brazil.stage_manifest import checksums, is_unchanged, load_manifest, manifest_path, save_manifest
+
+import os
+
+
+def _write(path, content):
+    with open(path, 'w') as output:
+        output.write(content)
+
+
+def _manifest(tmp_path):
+    directory = f'{tmp_path}/'
+    _write(os.path.join(tmp_path, 'input.json'), 'input')
+    _write(os.path.join(tmp_path, 'output.json'), 'output')
+    path = manifest_path(directory, 'prepares_data', '2021-02-25')
+    inputs = checksums([f'{directory}input.json'])
+    save_manifest(path, 'prepares_data', '2021-02-25', inputs, [f'{directory}output.json'], dict(compresslevel=9))
+    return path, inputs
+
+
+def test_unchanged_with_the_same_inputs_options_and_outputs(tmp_path):
+    path, inputs = _manifest(tmp_path)
+    assert path == f'{tmp_path}/_manifests/prepares_data/2021-02-25.json'
+    assert is_unchanged(load_manifest(path), inputs, dict(compresslevel=9))
+
+
+def test_changed_without_manifest(tmp_path):
+    _, inputs = _manifest(tmp_path)
+    assert load_manifest(f'{tmp_path}/_manifests/prepares_data/2021-02-26.json') is None
+    assert not is_unchanged(None, inputs, dict(compresslevel=9))
+
+
+def test_changed_when_an_input_changes_or_is_missing(tmp_path):
+    path, inputs = _manifest(tmp_path)
+    manifest = load_manifest(path)
+    _write(os.path.join(tmp_path, 'input.json'), 'another input')
+    assert not is_unchanged(manifest, checksums(list(inputs)), dict(compresslevel=9))
+    os.remove(os.path.join(tmp_path, 'input.json'))
+    assert not is_unchanged(manifest, checksums(list(inputs)), dict(compresslevel=9))
+
+
+def test_changed_when_an_option_changes(tmp_path):
+    path, inputs = _manifest(tmp_path)
+    assert not is_unchanged(load_manifest(path), inputs, dict(compresslevel=1))
+    assert not is_unchanged(load_manifest(path), inputs, dict(compresslevel=9, dedup=True))
+
+
+def test_changed_when_an_output_changes(tmp_path):
+    path, inputs = _manifest(tmp_path)
+    _write(os.path.join(tmp_path, 'output.json'), 'edited output')
+    assert not is_unchanged(load_manifest(path), inputs, dict(compresslevel=9))
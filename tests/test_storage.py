@@ -0,0 +1,40 @@
+from pipe_vms_brazil.storage import checksum, download, exists, list_files, parse_path, upload, upload_file
+
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('gs://bucket/prefix/file.json', ('gs', 'bucket', 'prefix/file.json')),
+    ('gs://bucket', ('gs', 'bucket', '')),
+    ('file:///tmp/file.json', ('file', None, '/tmp/file.json')),
+    ('downloads/file.json', ('file', None, 'downloads/file.json')),
+])
+def test_parse_path(path, expected):
+    assert parse_path(path) == expected
+
+
+def test_the_file_round_trip(tmp_path):
+    local_path = os.path.join(tmp_path, 'local.json')
+    with open(local_path, 'w') as local:
+        local.write('{"devices": []}')
+    remote = f'file://{tmp_path}/remote/nested/'
+    assert not exists(f'{remote}copy.json') and checksum(f'{remote}copy.json') is None
+    upload_file(local_path, f'{remote}copy.json')
+    assert exists(f'{remote}copy.json') and checksum(f'{remote}copy.json') == checksum(local_path)
+    assert list_files(remote) == [f'{remote}copy.json']
+    download(f'{remote}copy.json', os.path.join(tmp_path, 'downloaded.json'))
+    with open(os.path.join(tmp_path, 'downloaded.json')) as downloaded:
+        assert downloaded.read() == '{"devices": []}'
+
+
+def test_the_files_of_a_pattern_are_uploaded(tmp_path):
+    for name in ('2021-01-01.json.gz', '2021-01-01T01.json.gz', '2021-01-02.json.gz'):
+        with open(os.path.join(tmp_path, name), 'w') as local:
+            local.write(name)
+    directory = f'{tmp_path}/output/'
+    uploaded = upload(os.path.join(tmp_path, '2021-01-01'), directory)
+    assert [filename.name for filename in uploaded] == ['2021-01-01.json.gz', '2021-01-01T01.json.gz']
+    assert list_files(directory) == [f'{directory}2021-01-01.json.gz', f'{directory}2021-01-01T01.json.gz']
+    assert list_files(f'{tmp_path}/missing/') == []
@@ -0,0 +1,33 @@
+from datetime import date
+
+from pipe_vms_brazil.join import index_devices, join_messages
+
+from pipe_vms_brazil.json_stream import iter_array
+
+from pipe_vms_brazil.synthetic import generate_devices, generate_messages, write_day
+
+import gzip, os
+
+
+def test_messages_have_the_api_shape_and_join_with_their_devices(tmp_path):
+    total = write_day(str(tmp_path), date(2021, 2, 25), fleet_size=20, pings_per_day=6)
+    assert total == 120
+    with gzip.open(os.path.join(tmp_path, 'devices', '2021-02-25.json.gz'), 'rb') as devices:
+        devices = index_devices(iter_array(devices, 'devices'))
+    with gzip.open(os.path.join(tmp_path, 'messages', '2021-02-25.json.gz'), 'rb') as messages:
+        messages = list(iter_array(messages, 'mensagens'))
+    assert len(devices) == 20
+    assert set(messages[0]) == {'ID', 'mID', 'datahora', 'lat', 'lon', 'curso', 'speed'}
+    assert all(message['datahora'].startswith('25-02-2021 ') for message in messages)
+    unmatched = []
+    merged = list(join_messages(devices, messages, unmatched))
+    assert len(merged) == 120 and not unmatched
+
+
+def test_same_seed_same_payload_and_unknown_devices():
+    devices = generate_devices(10, seed=3)
+    assert devices == generate_devices(10, seed=3)
+    messages = list(generate_messages(devices, date(2021, 1, 1), 10, seed=3, unknown_rate=0.5))
+    assert messages == list(generate_messages(devices, date(2021, 1, 1), 10, seed=3, unknown_rate=0.5))
+    unknown = [message for message in messages if message['ID'] not in {device['ID'] for device in devices}]
+    assert 0 < len(unknown) < len(messages)
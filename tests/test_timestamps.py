@@ -0,0 +1,63 @@
+from datetime import date, datetime, timedelta
+
+from pipe_vms_brazil.timestamps import TimestampConverter
+
+import calendar, random
+
+import pytest
+
+
+def strptime_conversion(value):
+    return datetime.strptime(value, '%d-%m-%Y %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_same_result_as_strptime_for_every_day_and_random_times():
+    converter = TimestampConverter()
+    rand = random.Random(42)
+    day = date(1999, 12, 25)
+    while day < date(2031, 1, 5):
+        for _ in range(3):
+            value = f'{day.strftime("%d-%m-%Y")} {rand.randint(0, 23):02d}:{rand.randint(0, 59):02d}:{rand.randint(0, 59):02d}'
+            assert converter.to_datahora(value) == strptime_conversion(value)
+        day += timedelta(days=1)
+    assert converter.malformed == 0
+
+
+@pytest.mark.parametrize('value', [
+    '01-01-2021 00:00:00',
+    '31-12-2020 23:59:59',
+    '29-02-2020 12:30:45',
+    '1-2-2020 1:2:3',
+    '01-02-2020  10:00:00',
+    '01-02-0999 10:00:00',
+])
+def test_same_result_as_strptime_for_edge_cases(value):
+    assert TimestampConverter().to_datahora(value) == strptime_conversion(value)
+
+
+@pytest.mark.parametrize('value', [
+    '29-02-2021 10:00:00',
+    '32-01-2021 10:00:00',
+    '01-13-2021 10:00:00',
+    '01-02-2021 24:00:00',
+    '01-02-2021 10:60:00',
+    '01-02-2021 10:00:60',
+    '01-02-2021T10:00:00',
+    ' 01-02-2021 10:00:00',
+    '2021-02-01 10:00:00',
+    '',
+    None,
+])
+def test_malformed_values_are_reported(value):
+    converter = TimestampConverter()
+    assert converter.to_datahora(value) is None
+    assert converter.to_epoch(value) is None
+    assert converter.malformed == 2
+    assert converter.malformed_samples == [value, value]
+
+
+def test_epoch_seconds_as_utc():
+    converter = TimestampConverter()
+    for value in ['01-01-1970 00:00:00', '25-02-2021 13:14:15', '1-2-2020 1:2:3']:
+        expected = calendar.timegm(datetime.strptime(value, '%d-%m-%Y %H:%M:%S').timetuple())
+        assert converter.to_epoch(value) == expected